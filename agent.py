@@ -0,0 +1,398 @@
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import event, record_usage, span
+from scheduler import DEFAULT_REQUEST_TOKENS, get_scheduler
+from tool_registry import ToolArgumentError, get_registry
+
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+MAX_TOOL_WORKERS = 8
+MAX_AGENT_STEPS = 25
+
+
+def _args(*names):
+    return lambda args: [args.get(name) for name in names]
+
+
+def _op_paths(key, field):
+    return lambda args: [op.get(field) for op in args.get(key) or []]
+
+
+# For each tool, the paths its arguments read and write. Calls that touch
+# overlapping paths (including a directory and anything inside it) keep their
+# original order; tools missing from this table (shell commands, patches,
+# batch image jobs) may touch anything and run on their own.
+TOOL_PATH_ACCESS = {
+    "create_file": (None, _args("path")),
+    "create_directory": (None, _args("path")),
+    "delete_file": (None, _args("path")),
+    "does_file_exist": (_args("path"), None),
+    "get_directory_tree": (_args("path"), None),
+    "read_file": (_args("path"), None),
+    "search_files": (lambda args: [args.get("path") or "."], None),
+    "get_changes_since": (lambda args: [args.get("path") or "."], None),
+    "write_file": (None, _args("path")),
+    "edit_file": (None, _args("path")),
+    "edit_files": (None, _op_paths("files", "path")),
+    "append_to_file": (None, _args("path")),
+    "copy_file": (_args("src"), _args("dst")),
+    "move_file": (None, _args("src", "dst")),
+    "copy_files": (_op_paths("operations", "src"), _op_paths("operations", "dst")),
+    "move_files": (None, lambda args: _op_paths("operations", "src")(args) + _op_paths("operations", "dst")(args)),
+    "open_an_image": (_args("path"), None),
+    "get_image_metadata": (_args("path"), None),
+    "find_duplicate_images": (lambda args: [args.get("path") or ".", args.get("image")], None),
+    "move_the_image": (None, _args("path_before", "path_after")),
+    "generate_image": (None, lambda args: [args.get("path") or "."]),
+    "modify_image": (_args("path_of_the_image_to_modify"), lambda args: [args.get("path_to_save_the_image") or "."]),
+}
+
+
+def create_chat(client, model=DEFAULT_MODEL, history=None, tools=None):
+    """Create a chat session that can call the registered tools.
+
+    Automatic function calling is disabled; tool calls are executed by
+    ``run_turn`` through a ``ToolDispatcher``.
+
+    Args:
+        client (genai.Client): The Gemini client.
+        model (str): The model name.
+        history (list[types.Content]): Earlier turns to resume from.
+        tools (list[str]): Names of the tools to offer; defaults to every registered tool.
+
+    Returns:
+        Chat: The chat session.
+    """
+    from google.genai import types
+
+    config = types.GenerateContentConfig(
+        tools=[types.Tool(function_declarations=get_registry().function_declarations(tools))],
+        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+    )
+    return client.chats.create(model=model, config=config, history=history)
+
+
+def _to_jsonable(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return {"base64": base64.b64encode(value).decode('ascii'), "size": len(value)}
+    if isinstance(value, dict):
+        return {str(k): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_to_jsonable(v) for v in value]
+    return str(value)
+
+
+def _normalize(paths):
+    return {os.path.abspath(path) for path in paths if isinstance(path, str)}
+
+
+def _overlaps(first, second):
+    for a in first:
+        for b in second:
+            if a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep):
+                return True
+    return False
+
+
+def _conflicts(access, other):
+    """Whether two calls' (reads, writes) path sets (None for "anything") must keep their order."""
+    if access is None or other is None:
+        return True
+    reads, writes = access
+    other_reads, other_writes = other
+    return _overlaps(writes, other_reads | other_writes) or _overlaps(reads, other_writes)
+
+
+def _response_part(function_call, response):
+    from google.genai import types
+
+    part = types.Part.from_function_response(name=function_call.name, response=response)
+    if function_call.id:
+        part.function_response.id = function_call.id
+    return part
+
+
+class ToolCallBatch:
+    """The function calls of one model turn, started one by one as they stream in.
+
+    Each call is submitted to the dispatcher's pool as soon as it is added
+    and runs once every earlier call it conflicts with (see
+    ``ToolDispatcher.plan``) has finished, so tools can run while the model
+    is still producing the rest of its turn.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.function_calls = []
+        self.accesses = []
+        self.futures = []
+
+    def add(self, function_call):
+        """Start a function call.
+
+        Args:
+            function_call (types.FunctionCall): The call, as received from the model.
+        """
+        name, args = function_call.name, dict(function_call.args or {})
+        access = self.dispatcher._access(name, args)
+        # The pool runs tasks in submission order, so every dependency has
+        # already started by the time a call waits on it.
+        dependencies = [future for other, future in zip(self.accesses, self.futures) if _conflicts(access, other)]
+        self.function_calls.append(function_call)
+        self.accesses.append(access)
+        self.futures.append(self.dispatcher.pool.submit(self._run, dependencies, name, args))
+
+    def _run(self, dependencies, name, args):
+        for future in dependencies:
+            future.result()
+        return self.dispatcher.call(name, args)
+
+    def __len__(self):
+        return len(self.function_calls)
+
+    def parts(self):
+        """Wait for every call and build the function response parts.
+
+        Returns:
+            list[types.Part]: One function response per call, in the order they were added.
+        """
+        return [_response_part(call, future.result()) for call, future in zip(self.function_calls, self.futures)]
+
+
+class ToolDispatcher:
+    """Execute the function calls of a model turn, concurrently where safe.
+
+    Calls are grouped into waves: a call goes into the wave after the last
+    earlier call it conflicts with, where two calls conflict if one writes a
+    path the other reads or writes. Calls within a wave run in parallel on a
+    thread pool, since the tools are dominated by file and network I/O.
+    Arguments are validated against the tool registry before a handler runs.
+
+    Args:
+        registry (ToolRegistry): Defaults to the shared registry.
+        max_workers (int): Size of the dispatcher's own thread pool.
+        path_access (dict): Defaults to ``TOOL_PATH_ACCESS``.
+        pool (Executor): A pool shared with other dispatchers, used instead of
+            creating one; ``close`` leaves it running.
+    """
+
+    def __init__(self, registry=None, max_workers=MAX_TOOL_WORKERS, path_access=None, pool=None):
+        self.registry = get_registry() if registry is None else registry
+        self.path_access = TOOL_PATH_ACCESS if path_access is None else path_access
+        self.owns_pool = pool is None
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool") if pool is None else pool
+
+    def prepare(self, name, args):
+        """Rewrite a call's arguments before it is planned and run.
+
+        Subclasses override this to scope calls, e.g. to a workspace.
+
+        Args:
+            name (str): The tool name.
+            args (dict): The arguments supplied by the model.
+
+        Returns:
+            tuple[dict, dict]: The arguments, and hidden arguments passed to
+            the handler but not validated against its schema (or None).
+
+        Raises:
+            ToolArgumentError: If the call must not run.
+        """
+        return args, None
+
+    def _access(self, name, args):
+        """Return (reads, writes) path sets, or None if the call may touch anything."""
+        access = self.path_access.get(name)
+        if access is None:
+            return None
+        try:
+            args, _ = self.prepare(name, args)
+        except ToolArgumentError:
+            return None
+        reads, writes = access
+        return (
+            _normalize(reads(args) if reads else []),
+            _normalize(writes(args) if writes else []),
+        )
+
+    def plan(self, calls):
+        """Assign each call to a wave.
+
+        Args:
+            calls (list[tuple[str, dict]]): (tool name, arguments) pairs in model order.
+
+        Returns:
+            list[list[int]]: Waves of call indices; each wave may run in parallel.
+        """
+        accesses = [self._access(name, args) for name, args in calls]
+        wave_of = []
+        for i, access in enumerate(accesses):
+            wave = 0
+            for j in range(i):
+                if _conflicts(access, accesses[j]):
+                    wave = max(wave, wave_of[j] + 1)
+            wave_of.append(wave)
+
+        waves = [[] for _ in range(max(wave_of, default=-1) + 1)]
+        for i, wave in enumerate(wave_of):
+            waves[wave].append(i)
+        return waves
+
+    def call(self, name, args):
+        """Run one tool call and wrap its outcome as a function response payload.
+
+        Args:
+            name (str): The tool name.
+            args (dict): The tool arguments.
+
+        Returns:
+            dict: ``{"result": ...}`` on success or ``{"error": ...}`` on failure.
+        """
+        if name not in self.registry.schemas:
+            return {"error": f"Unknown tool: {name}"}
+        try:
+            args, hidden = self.prepare(name, args)
+            return {"result": _to_jsonable(self.registry.call(name, args, hidden=hidden))}
+        except ToolArgumentError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def dispatch(self, function_calls):
+        """Execute a turn's function calls and build the function response parts.
+
+        Args:
+            function_calls (list[types.FunctionCall]): The calls from the model response.
+
+        Returns:
+            list[types.Part]: One function response per call, in the original order.
+        """
+        calls = [(call.name, dict(call.args or {})) for call in function_calls]
+        responses = [None] * len(calls)
+
+        for wave in self.plan(calls):
+            futures = {i: self.pool.submit(self.call, *calls[i]) for i in wave}
+            for i, future in futures.items():
+                responses[i] = future.result()
+
+        return [_response_part(call, response) for call, response in zip(function_calls, responses)]
+
+    def batch(self):
+        """Start a ``ToolCallBatch`` for calls that arrive one at a time."""
+        return ToolCallBatch(self)
+
+    def close(self):
+        """Shut down the worker pool, unless it is shared."""
+        if self.owns_pool:
+            self.pool.shutdown(wait=True)
+
+
+def _send(chat, message):
+    # A turn re-sends the whole history, so reserve about as many tokens as the last prompt used.
+    tokens = getattr(chat, "last_prompt_tokens", None) or DEFAULT_REQUEST_TOKENS
+    with span("gemini", "send_message"):
+        response = get_scheduler().call(lambda: chat.send_message(message), tokens=tokens)
+        record_usage(response)
+        return response
+
+
+def run_turn(chat, message, dispatcher, max_steps=MAX_AGENT_STEPS):
+    """Send a user message and keep executing tool calls until the model answers.
+
+    All function calls of a model response are executed together and their
+    results returned in a single follow-up message.
+
+    Args:
+        chat (Chat): The chat session.
+        message (str): The user message.
+        dispatcher (ToolDispatcher): Executes the tool calls.
+        max_steps (int): Maximum number of tool-call rounds before giving up.
+
+    Returns:
+        str: The model's final text reply.
+
+    Raises:
+        RuntimeError: If the model is still calling tools after ``max_steps`` rounds.
+    """
+    response = _send(chat, message)
+    for _ in range(max_steps):
+        if not response.function_calls:
+            return response.text
+        response = _send(chat, dispatcher.dispatch(response.function_calls))
+
+    raise RuntimeError(f"The agent did not finish within {max_steps} tool-call rounds.")
+
+
+def _stream_step(chat, message, dispatcher, on_text):
+    """Stream one model response, starting its tool calls as they arrive.
+
+    Falls back to a blocking request if the stream fails before any tool
+    call was started; after that, a retry could run tools twice, so the
+    error is raised.
+
+    Returns:
+        tuple[str, list[types.Part] | None]: The response text, and the function
+        responses to send back, or None if the model made no calls.
+    """
+    tokens = getattr(chat, "last_prompt_tokens", None) or DEFAULT_REQUEST_TOKENS
+    batch = dispatcher.batch()
+    text = []
+    try:
+        with span("gemini", "send_message_stream"):
+            last = None
+            for chunk in get_scheduler().stream(lambda: chat.send_message_stream(message), tokens=tokens):
+                last = chunk
+                content = chunk.candidates[0].content if chunk.candidates else None
+                for part in (content.parts or []) if content is not None else []:
+                    if part.function_call is not None:
+                        batch.add(part.function_call)
+                    elif part.text and not part.thought:
+                        text.append(part.text)
+                        if on_text is not None:
+                            on_text(part.text)
+            record_usage(last)
+    except Exception as e:
+        if len(batch):
+            raise
+        event("stream_fallback", f"Streaming failed ({type(e).__name__}: {e}); retrying without streaming", error=type(e).__name__)
+        response = _send(chat, message)
+        if on_text is not None and response.text:
+            on_text(response.text)
+        parts = dispatcher.dispatch(response.function_calls) if response.function_calls else None
+        return response.text or '', parts
+
+    return ''.join(text), batch.parts() if len(batch) else None
+
+
+def stream_turn(chat, message, dispatcher, on_text=None, max_steps=MAX_AGENT_STEPS):
+    """Streaming flavour of ``run_turn``.
+
+    Text is passed to ``on_text`` as soon as it arrives, and each function
+    call is started as soon as it has been received rather than when the
+    model's response is complete. Requests fall back to ``send_message``
+    when streaming fails.
+
+    Args:
+        chat (Chat): The chat session; it must provide ``send_message_stream``.
+        message (str): The user message.
+        dispatcher (ToolDispatcher): Executes the tool calls.
+        on_text (callable): Called with each piece of response text.
+        max_steps (int): Maximum number of tool-call rounds before giving up.
+
+    Returns:
+        str: The model's final text reply.
+
+    Raises:
+        RuntimeError: If the model is still calling tools after ``max_steps`` rounds.
+    """
+    text, parts = _stream_step(chat, message, dispatcher, on_text)
+    for _ in range(max_steps):
+        if parts is None:
+            return text
+        text, parts = _stream_step(chat, parts, dispatcher, on_text)
+
+    raise RuntimeError(f"The agent did not finish within {max_steps} tool-call rounds.")
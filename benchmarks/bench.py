@@ -0,0 +1,320 @@
+"""Benchmark the tools and Gemini request paths without a network or API key.
+
+Suites:
+    files     file_tools operations over a synthetic tree of configurable size
+    commands  run_command / run_commands throughput
+    gemini    generate_image, modify_image, batches and chat turns, blocking and
+              streamed, against the local fake Gemini server (benchmarks/fake_gemini.py)
+
+Every benchmark reports its throughput and mean/p50/p95/p99 latency.
+
+Usage:
+    python benchmarks/bench.py [--suite files,commands,gemini] [--iterations 50] [--output bench_output.txt] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from fake_gemini import FakeGeminiServer, make_png  # noqa: E402
+
+
+def percentile(samples, q):
+    """Return the nearest-rank percentile of ``samples``.
+
+    Args:
+        samples (list[float]): The measurements.
+        q (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile.
+    """
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(name, func, iterations, warmup=1, ops_per_call=1, before_each=None):
+    """Time ``func`` over ``iterations`` calls.
+
+    Args:
+        name (str): The benchmark name.
+        func (callable): Called with the iteration index.
+        iterations (int): Number of timed calls.
+        warmup (int): Untimed calls made first.
+        ops_per_call (int): Operations each call performs, for the throughput figure.
+        before_each (callable): Untimed setup run before every call.
+
+    Returns:
+        dict: ``name``, ``n``, ``ops_per_s`` and ``mean``/``p50``/``p95``/``p99`` in milliseconds.
+    """
+    for i in range(warmup):
+        if before_each is not None:
+            before_each()
+        func(i)
+
+    samples = []
+    for i in range(iterations):
+        if before_each is not None:
+            before_each()
+        started = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - started)
+
+    total = sum(samples)
+    return {
+        "name": name,
+        "n": iterations,
+        "ops_per_s": iterations * ops_per_call / total if total else float('inf'),
+        "mean": statistics.mean(samples) * 1000,
+        "p50": percentile(samples, 50) * 1000,
+        "p95": percentile(samples, 95) * 1000,
+        "p99": percentile(samples, 99) * 1000,
+    }
+
+
+def make_tree(root, files, file_kb, depth, fanout):
+    """Create a synthetic source tree.
+
+    Args:
+        root (str): The directory to fill.
+        files (int): Number of text files.
+        file_kb (int): Size of each file in KiB.
+        depth (int): Directory nesting depth.
+        fanout (int): Subdirectories per directory.
+
+    Returns:
+        list[str]: The file paths.
+    """
+    directories = [root]
+    frontier = [root]
+    for _ in range(depth):
+        frontier = [os.path.join(parent, f"dir{i}") for parent in frontier for i in range(fanout)]
+        directories.extend(frontier)
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    rng = random.Random(0)
+    words = ["alpha", "beta", "gamma", "delta", "config", "handler", "request", "value", "index", "token"]
+    paths = []
+    for i in range(files):
+        path = os.path.join(rng.choice(directories), f"file{i}.py")
+        lines = []
+        size = 0
+        while size < file_kb * 1024:
+            line = f"def {rng.choice(words)}_{i}_{len(lines)}(x): return x + {rng.randint(0, 999)}  # {' '.join(rng.choices(words, k=6))}\n"
+            lines.append(line)
+            size += len(line)
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        paths.append(path)
+    return paths
+
+
+def bench_files(args, workdir):
+    import file_tools
+    from tool_cache import get_tool_cache
+
+    root = os.path.join(workdir, "tree")
+    paths = make_tree(root, args.files, args.file_kb, args.depth, args.fanout)
+    large = os.path.join(workdir, "large.log")
+    with open(large, 'wb') as f:
+        line = b"2024-01-01T00:00:00 INFO request handled in 12ms\n"
+        f.write(line * (args.large_file_mb * 1024 * 1024 // len(line)))
+
+    cache = get_tool_cache()
+    rng = random.Random(1)
+    results = [
+        measure("read_file (uncached)", lambda i: file_tools.read_file(rng.choice(paths)), args.iterations, before_each=cache.clear),
+        measure("read_file (cached)", lambda i: file_tools.read_file(paths[0]), args.iterations),
+        measure(f"read_file tail=100 of {args.large_file_mb} MiB", lambda i: file_tools.read_file(large, tail=100), args.iterations, before_each=cache.clear),
+        measure("get_directory_tree (uncached)", lambda i: file_tools.get_directory_tree(root), args.iterations, before_each=cache.clear),
+        measure("get_directory_tree max_depth=1 (cached)", lambda i: file_tools.get_directory_tree(root, max_depth=1), args.iterations),
+        measure("search_files literal", lambda i: file_tools.search_files("handler_1", root), args.iterations),
+        measure("search_files regex", lambda i: file_tools.search_files(r"return x \+ 99\d", root, regex=True), args.iterations),
+    ]
+
+    scratch = os.path.join(workdir, "scratch")
+    os.makedirs(scratch)
+    content = open(paths[0]).read()
+    results.append(measure("write_file", lambda i: file_tools.write_file(os.path.join(scratch, f"w{i}.py"), content), args.iterations))
+    edit_target = os.path.join(scratch, "edit.py")
+    file_tools.write_file(edit_target, "value = 0\n" + content)
+    results.append(measure(
+        "edit_file",
+        lambda i: file_tools.edit_file(edit_target, [{"search": f"value = {i}\n", "replace": f"value = {i + 1}\n"}]),
+        args.iterations, warmup=0,
+    ))
+    results.append(measure("copy_file", lambda i: file_tools.copy_file(large, os.path.join(scratch, "copy.log")), args.iterations))
+
+    from fs_watcher import WorkspaceWatcher
+
+    watcher = WorkspaceWatcher(root).start()
+    cursor = [watcher.changes_since()["cursor"]]
+
+    def write_and_poll(i):
+        file_tools.write_file(os.path.join(root, f"watched{i}.py"), content)
+        cursor[0] = watcher.changes_since(cursor[0])["cursor"]
+
+    results.append(measure("write_file + get_changes_since", write_and_poll, args.iterations))
+    watcher.close()
+    return results
+
+
+def bench_commands(args, workdir):
+    import use_cli
+
+    batch = 16
+    return [
+        measure("run_command true", lambda i: use_cli.run_command("true"), args.iterations),
+        measure("run_command persistent", lambda i: use_cli.run_command("true", persistent=True), args.iterations),
+        measure("run_command 1 MiB output", lambda i: use_cli.run_command("head -c 1048576 /dev/zero | tr '\\0' x"), args.iterations),
+        measure(
+            f"run_commands x{batch} (concurrency 8)",
+            lambda i: use_cli.run_commands(["sleep 0.01"] * batch, max_concurrency=8),
+            max(1, args.iterations // 4), ops_per_call=batch,
+        ),
+    ]
+
+
+def bench_gemini(args, workdir):
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    server = FakeGeminiServer(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        image_size=(args.image_size, args.image_size),
+        tool_call={"name": "does_file_exist", "args": {"path": workdir}},
+        error_rate=args.error_rate,
+        stream_interval=args.stream_interval_ms / 1000,
+    ).start()
+    try:
+        import gemini_client
+        import image_generator
+        import image_index
+        from agent import ToolDispatcher, create_chat, run_turn, stream_turn
+
+        from scheduler import configure_scheduler, get_scheduler
+
+        gemini_client.configure_client(base_url=server.url)
+        # Keep retry delays short so injected errors do not dominate the timings.
+        configure_scheduler(max_backoff=0.5)
+        client = gemini_client.get_client()
+
+        out = os.path.join(workdir, "images")
+        os.makedirs(out)
+        source = os.path.join(workdir, "source.png")
+        with open(source, 'wb') as f:
+            f.write(make_png(args.image_size, args.image_size))
+
+        dispatcher = ToolDispatcher()
+        chat = create_chat(client)
+        batch = 8
+        results = [
+            measure(
+                "generate_content (text)",
+                lambda i: get_scheduler().call(lambda: client.models.generate_content(model="fake", contents="hi")),
+                args.iterations,
+            ),
+            measure(
+                "generate_image",
+                lambda i: image_generator.generate_image("a cat", "512x512", out, f"gen{i}", use_cache=False, stream=False),
+                args.iterations,
+            ),
+            measure(
+                "generate_image (stream)",
+                lambda i: image_generator.generate_image("a cat", "512x512", out, f"gens{i}", use_cache=False, stream=True),
+                args.iterations,
+            ),
+            measure("generate_image (cache hit)", lambda i: image_generator.generate_image("a cat", "512x512", out, "cached"), args.iterations),
+            measure(
+                "modify_image",
+                lambda i: image_generator.modify_image(source, out, "make it blue", f"mod{i}", "512x512", use_cache=False),
+                args.iterations,
+            ),
+            measure(
+                f"generate_images_batch x{batch}",
+                lambda i: image_generator.generate_images_batch([
+                    {"prompt": f"dog {i} {j}", "dimensions": "512x512", "path": out, "name_of_image": f"b{i}_{j}", "use_cache": False}
+                    for j in range(batch)
+                ]),
+                max(1, args.iterations // 4), ops_per_call=batch,
+            ),
+            measure("find_duplicate_images (indexed on save)", lambda i: image_index.find_duplicate_images(out), args.iterations),
+            measure("chat turn with one tool call", lambda i: run_turn(chat, f"check the workspace {i}", dispatcher), args.iterations),
+            measure("chat turn with one tool call (stream)", lambda i: stream_turn(chat, f"check again {i}", dispatcher), args.iterations),
+        ]
+        dispatcher.close()
+        return results
+    finally:
+        server.stop()
+
+
+SUITES = {"files": bench_files, "commands": bench_commands, "gemini": bench_gemini}
+
+
+def format_results(results):
+    header = f"{'benchmark':<40} {'n':>5} {'ops/s':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r['name']:<40} {r['n']:>5} {r['ops_per_s']:>10.1f} {r['mean']:>9.2f} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['p99']:>9.2f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", default=",".join(SUITES), help="Comma-separated suites to run.")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed calls per benchmark.")
+    parser.add_argument("--files", type=int, default=500, help="Files in the synthetic tree.")
+    parser.add_argument("--file-kb", type=int, default=8, help="Size of each synthetic file in KiB.")
+    parser.add_argument("--depth", type=int, default=3, help="Directory depth of the synthetic tree.")
+    parser.add_argument("--fanout", type=int, default=3, help="Subdirectories per directory.")
+    parser.add_argument("--large-file-mb", type=int, default=64, help="Size of the large file used for ranged reads and copies.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Fake Gemini server latency per request.")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Extra random fake server latency.")
+    parser.add_argument("--image-size", type=int, default=1024, help="Edge length of fake generated images.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake server requests that fail with 429 and are retried.")
+    parser.add_argument("--stream-interval-ms", type=float, default=5.0, help="Fake server delay between the events of a streamed response.")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    parser.add_argument("--json", help="Write the raw results as JSON to this file.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AGENT_QUIET", "1")
+    # The image cache would otherwise persist across runs in the working directory.
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("IMAGE_CACHE_DIR", os.path.join(workdir, "image_cache"))
+
+    report = []
+    all_results = {}
+    try:
+        for suite in args.suite.split(','):
+            suite = suite.strip()
+            if suite not in SUITES:
+                parser.error(f"unknown suite {suite!r}; choose from {', '.join(SUITES)}")
+            suite_dir = os.path.join(workdir, suite)
+            os.makedirs(suite_dir)
+            results = SUITES[suite](args, suite_dir)
+            all_results[suite] = results
+            section = f"== {suite} ==\n{format_results(results)}"
+            print(section + '\n', flush=True)
+            report.append(section)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('\n\n'.join(report) + '\n')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
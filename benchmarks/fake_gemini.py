@@ -0,0 +1,249 @@
+"""A local stand-in for the Gemini REST API, for benchmarks without network access.
+
+It answers ``generateContent``, ``streamGenerateContent`` and
+``countTokens`` requests for any model:
+
+* requests asking for the IMAGE response modality get a short text part and
+  an inline PNG of the configured size;
+* requests that offer tools and end with a user message get a function call
+  (``tool_call``), so chat benchmarks exercise the dispatcher; the follow-up
+  with the function response gets a text answer;
+* everything else gets a text answer.
+
+Every response is delayed by ``latency`` seconds (plus up to ``jitter``), and
+a fraction ``error_rate`` of requests fail with 429 RESOURCE_EXHAUSTED to
+exercise retries. Streamed responses send one part per server-sent event,
+``stream_interval`` seconds apart, with the usage in the last event.
+
+Usage:
+    python benchmarks/fake_gemini.py [--port 8765] [--latency-ms 50]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+
+# The real API charges an inline image a flat 258 tokens, however many bytes it has.
+IMAGE_TOKENS = 258
+
+
+def count_prompt_tokens(contents):
+    """Estimate the prompt tokens of ``contents`` like the real API would.
+
+    Text and other parts cost one token per four characters of their JSON;
+    ``inlineData`` parts cost ``IMAGE_TOKENS`` rather than their base64 length.
+    """
+    tokens = 0
+    for content in contents:
+        for part in content.get("parts", []) if isinstance(content, dict) else [content]:
+            if isinstance(part, dict) and "inlineData" in part:
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += len(json.dumps(part)) // 4
+    return tokens
+
+
+def make_png(width, height):
+    """Return a PNG of random pixels, so it does not compress below a realistic size."""
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class FakeGeminiServer:
+    """Serve emulated Gemini responses on a background thread.
+
+    Args:
+        host (str): The interface to bind.
+        port (int): The port to bind; 0 picks a free one.
+        latency (float): Seconds to wait before every response.
+        jitter (float): Extra random delay of up to this many seconds.
+        image_size (tuple[int, int]): Width and height of returned images.
+        tool_call (dict): ``name`` and ``args`` of the function call returned to tool-enabled requests.
+        error_rate (float): Fraction of requests answered with 429.
+        stream_interval (float): Seconds between the events of a streamed response.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, jitter=0.0, image_size=(1024, 1024), tool_call=None, error_rate=0.0,
+                 stream_interval=0.0):
+        self.latency = latency
+        self.stream_interval = stream_interval
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_base64 = base64.b64encode(make_png(*image_size)).decode('ascii')
+        self.tool_call = tool_call
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Start serving and return the server."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _usage(self, body, output_tokens):
+        prompt_tokens = count_prompt_tokens(body.get("contents", []))
+        return {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+
+    def generate_content(self, body):
+        """Build the response to a ``generateContent`` request body."""
+        contents = body.get("contents") or []
+        last_parts = contents[-1].get("parts", []) if contents else []
+        modalities = (body.get("generationConfig") or {}).get("responseModalities") or []
+
+        if "IMAGE" in modalities:
+            parts = [
+                {"text": "Here is the image."},
+                {"inlineData": {"mimeType": "image/png", "data": self.image_base64}},
+            ]
+            output_tokens = 1290
+        elif self.tool_call and body.get("tools") and any("text" in part for part in last_parts):
+            parts = [{"functionCall": {"name": self.tool_call["name"], "args": self.tool_call.get("args", {})}}]
+            output_tokens = 20
+        else:
+            parts = [{"text": "Done. This is a canned answer from the fake Gemini server."}]
+            output_tokens = 12
+
+        return {
+            "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": self._usage(body, output_tokens),
+            "modelVersion": "fake",
+        }
+
+    def stream_generate_content(self, body):
+        """Split the response to a ``generateContent`` request body into streamed chunks."""
+        response = self.generate_content(body)
+        candidate = response["candidates"][0]
+        parts = []
+        for part in candidate["content"]["parts"]:
+            if "text" in part:
+                words = part["text"].split(" ")
+                middle = len(words) // 2
+                parts.extend({"text": text} for text in (" ".join(words[:middle]) + " ", " ".join(words[middle:])) if text.strip())
+            else:
+                parts.append(part)
+
+        chunks = [{"candidates": [{"content": {"role": "model", "parts": [part]}, "index": 0}], "modelVersion": "fake"} for part in parts]
+        chunks[-1]["candidates"][0]["finishReason"] = candidate["finishReason"]
+        chunks[-1]["usageMetadata"] = response["usageMetadata"]
+        return chunks
+
+    def count_tokens(self, body):
+        """Build the response to a ``countTokens`` request body."""
+        return {"totalTokens": count_prompt_tokens(body.get("contents", []))}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, Nagle's
+            # algorithm and delayed ACKs add about 40 ms to small responses.
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    server.requests += 1
+
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+
+                if random.random() < server.error_rate:
+                    self._send(429, {"error": {"code": 429, "message": "Emulated quota exhaustion.", "status": "RESOURCE_EXHAUSTED"}})
+                    return
+
+                path = self.path.split('?', 1)[0]
+                if path.endswith(":streamGenerateContent"):
+                    self._send_stream(server.stream_generate_content(body))
+                    return
+                if path.endswith(":generateContent"):
+                    payload = server.generate_content(body)
+                elif path.endswith(":countTokens"):
+                    payload = server.count_tokens(body)
+                else:
+                    self._send(404, {"error": {"code": 404, "message": f"Not emulated: {path}", "status": "NOT_FOUND"}})
+                    return
+                self._send(200, payload)
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, chunk in enumerate(chunks):
+                    if i and server.stream_interval:
+                        time.sleep(server.stream_interval)
+                    data = f"data: {json.dumps(chunk)}\r\n\r\n".encode('utf-8')
+                    self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--image-size", type=int, default=1024, help="Edge length of returned square images.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--stream-interval-ms", type=float, default=0.0, help="Delay between the events of a streamed response.")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000, (args.image_size, args.image_size),
+                              error_rate=args.error_rate, stream_interval=args.stream_interval_ms / 1000)
+    print(f"Fake Gemini API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Measure how long the agent takes to start.
+
+Each scenario runs in a fresh interpreter with ``-X importtime``, repeated
+``--runs`` times; the median wall time is reported together with the modules
+that took longest to import. The script exits with status 1 when a scenario's
+median exceeds its budget, so it can be tracked in CI.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--budget-ms MS] [--top 10] [--output bench_output.txt]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scenario name -> (code, default median budget in milliseconds). The budgets
+# include the bare interpreter start, which is reported as the baseline.
+SCENARIOS = {
+    "import main": ("import main", 250.0),
+    "tool metadata": ("from tool_registry import get_registry; get_registry().schemas", 250.0),
+    "first file tool call": (
+        "from tool_registry import get_registry; "
+        "get_registry().call('does_file_exist', {'path': 'main.py'})",
+        600.0,
+    ),
+}
+
+HEAVY_MODULES = ("google.genai", "PIL", "pydantic")
+
+
+def parse_importtime(stderr):
+    """Parse ``-X importtime`` output.
+
+    Args:
+        stderr (str): The interpreter's stderr.
+
+    Returns:
+        dict: Cumulative import time in microseconds per top-level import of each module.
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        try:
+            cumulative[name.strip()] = int(cumulative_us)
+        except ValueError:
+            continue
+    return cumulative
+
+
+def run_scenario(code, runs):
+    """Run ``code`` in ``runs`` fresh interpreters.
+
+    Args:
+        code (str): The Python source to execute.
+        runs (int): Number of repetitions.
+
+    Returns:
+        tuple[list[float], dict]: Wall times in milliseconds and the import times of the last run.
+
+    Raises:
+        RuntimeError: If the interpreter exits with an error.
+    """
+    times = []
+    imports = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        times.append((time.perf_counter() - started) * 1000)
+        if process.returncode != 0:
+            raise RuntimeError(f"{code!r} failed:\n{process.stderr[-2000:]}")
+        imports = parse_importtime(process.stderr)
+    return times, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Interpreter launches per scenario.")
+    parser.add_argument("--budget-ms", type=float, help="Override the median budget of every scenario.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list.")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    baseline, _ = run_scenario("pass", args.runs)
+    lines = [f"interpreter baseline: median {statistics.median(baseline):.1f} ms"]
+    over_budget = []
+
+    for name, (code, budget_ms) in SCENARIOS.items():
+        budget_ms = args.budget_ms or budget_ms
+        times, imports = run_scenario(code, args.runs)
+        median = statistics.median(times)
+        status = "ok" if median <= budget_ms else "OVER BUDGET"
+        if median > budget_ms:
+            over_budget.append(name)
+
+        lines.append("")
+        lines.append(f"{name}: median {median:.1f} ms, min {min(times):.1f} ms, max {max(times):.1f} ms "
+                     f"(budget {budget_ms:.0f} ms, {status})")
+        heavy = [module for module in HEAVY_MODULES if module in imports]
+        lines.append(f"  heavy modules loaded: {', '.join(heavy) or 'none'}")
+        for module, cumulative_us in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+            lines.append(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+
+    report = '\n'.join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
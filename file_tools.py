@@ -1,129 +1,56 @@
+import codecs
+import errno
+import mmap
 import os
-
-
-FILE_TOOLS = {
-    "create_file": {
-        "name": "create_file",
-        "description": "Create a new file at the specified path.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path where the file should be created."}
-            },
-            "required": ["path"]
-        }
-    },
-    "create_directory": {
-        "name": "create_directory",
-        "description": "Create a new directory at the specified path.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path where the directory should be created."}
-            },
-            "required": ["path"]
-        }
-    },
-    "delete_file": {
-        "name": "delete_file",
-        "description": "Delete a file at the specified path.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path of the file to delete."}
-            },
-            "required": ["path"]
-        }
-    },
-    "does_file_exist": {
-        "name": "does_file_exist",
-        "description": "Check if a file exists at the specified path.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path of the file to check."}
-            },
-            "required": ["path"]
-        }
-    },
-    "get_directory_tree": {
-        "name": "get_directory_tree",
-        "description": "Return the tree structure of a directory, including hidden files.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The directory path to get the tree structure for."},
-                "prefix": {"type": "string", "description": "Prefix for formatting the tree structure.", "default": ""}
-            },
-            "required": ["path"]
-        }
-    },
-    "read_file": {
-        "name": "read_file",
-        "description": "Read the content of a file.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path of the file to read."}
-            },
-            "required": ["path"]
-        }
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import event, record
+from tool_cache import clears_cache, file_stamp, invalidates, memoized, parent_stamp
+from tool_registry import tool, tool_schemas
+
+
+# Files at least this large are memory-mapped by read_file instead of read whole.
+MMAP_THRESHOLD = 1024 * 1024
+BINARY_SNIFF_BYTES = 8192
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP}
+
+# Item schemas for list-of-object parameters, which docstrings cannot express.
+_EDIT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "search": {"type": "string", "description": "The exact text to find."},
+        "replace": {"type": "string", "description": "The text to put in its place."},
+        "count": {"type": "integer", "description": "How many times the search text must occur (default 1). Use 0 to replace every occurrence."}
     },
-    "write_file": {
-        "name": "write_file",
-        "description": "Write content to a file.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path of the file to write to."},
-                "content": {"type": "string", "description": "The content to write to the file."}
-            },
-            "required": ["path", "content"]
-        }
-    },
-    "append_to_file": {
-        "name": "append_to_file",
-        "description": "Append content to a file.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The path of the file to append to."},
-                "content": {"type": "string", "description": "The content to append to the file."}
-            },
-            "required": ["path", "content"]
-        }
-    },
-    "copy_file": {
-        "name": "copy_file",
-        "description": "Copy a file from source to destination.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "src": {"type": "string", "description": "The source file path."},
-                "dst": {"type": "string", "description": "The destination file path."}
-            },
-            "required": ["src", "dst"]
-        }
+    "required": ["search", "replace"]
+}
+_FILE_OPERATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "src": {"type": "string", "description": "The source file path."},
+        "dst": {"type": "string", "description": "The destination file path."}
     },
-    "move_file": {
-        "name": "move_file",
-        "description": "Move a file from source to destination.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "src": {"type": "string", "description": "The source file path."},
-                "dst": {"type": "string", "description": "The destination file path."}
-            },
-            "required": ["src", "dst"]
-        }
-    }
+    "required": ["src", "dst"]
 }
 
 
+@tool()
+@invalidates("path")
 def create_file(path):
+    """Create a new file at the specified path.
+
+    Args:
+        path (str): The path where the file should be created.
+    """
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    print(f"File created at {path}")
+    event("file_created", f"File created at {path}", path=path)
 
+@tool()
+@invalidates("path")
 def create_directory(path):
     """Create a directory if it does not already exist.
 
@@ -134,8 +61,10 @@ def create_directory(path):
         OSError: If the directory cannot be created.
     """
     os.makedirs(path, exist_ok=True)
-    print(f"Directory created at {path}")
+    event("directory_created", f"Directory created at {path}", path=path)
 
+@tool()
+@invalidates("path")
 def delete_file(path):
     """Delete a file at the specified path.
 
@@ -150,8 +79,10 @@ def delete_file(path):
         raise FileNotFoundError(f"The file at {path} does not exist.")
 
     os.remove(path)
-    print(f"File deleted at {path}")
+    event("file_deleted", f"File deleted at {path}", path=path)
 
+@tool()
+@memoized(parent_stamp)
 def does_file_exist(path):
     """Check if a file exists at the specified path.
 
@@ -163,28 +94,231 @@ def does_file_exist(path):
     """
     return os.path.exists(path)
 
-def get_directory_tree(path, prefix=''):
-    """Return the tree structure of a directory, including hidden files."""
-    tree_str = ''
-    entries = sorted(os.listdir(path))
-    entries_count = len(entries)
-    for idx, entry in enumerate(entries):
-        full_path = os.path.join(path, entry)
-        connector = '└── ' if idx == entries_count - 1 else '├── '
-        tree_str += f"{prefix}{connector}{entry}\n"
-        if os.path.isdir(full_path):
-            extension = '    ' if idx == entries_count - 1 else '│   '
-            tree_str += get_directory_tree(full_path, prefix + extension)
-    return tree_str
-
-def read_file(path):
-    """Read the content of a file.
+def _glob_to_regex(pattern):
+    i, n, out = 0, len(pattern), []
+    while i < n:
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            j = pattern.index(']', i + 1)
+            out.append('[' + pattern[i + 1:j].replace('\\', '\\\\') + ']')
+            i = j + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(out))
+
+
+def compile_exclude_patterns(patterns):
+    """Compile gitignore-style patterns into a matcher.
+
+    Supported syntax: ``*``, ``?``, ``[...]`` and ``**`` wildcards, a trailing
+    ``/`` to match directories only, a ``/`` inside the pattern to anchor it to
+    the root, and a leading ``!`` to re-include a previously excluded path.
+    As in gitignore, the last matching pattern wins.
+
+    Args:
+        patterns (list[str] | str): The patterns, as a list or a comma-separated string.
+
+    Returns:
+        callable: ``matcher(rel_path, is_dir)`` returning True if the path is excluded.
+    """
+    if isinstance(patterns, str):
+        patterns = patterns.split(',')
+
+    rules = []
+    for pattern in patterns:
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        negate = pattern.startswith('!')
+        pattern = pattern.lstrip('!')
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        anchored = '/' in pattern
+        rules.append((negate, dir_only, anchored, _glob_to_regex(pattern.lstrip('/'))))
+
+    def matcher(rel_path, is_dir):
+        excluded = False
+        name = rel_path.rsplit('/', 1)[-1]
+        for negate, dir_only, anchored, regex in rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path if anchored else name):
+                excluded = not negate
+        return excluded
+
+    return matcher
+
+
+def _scan_sorted(path, rel_path, is_excluded):
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    if is_excluded is None:
+        return entries
+    return [
+        entry for entry in entries
+        if not is_excluded(f"{rel_path}{entry.name}", entry.is_dir())
+    ]
+
+
+def iter_directory_tree(path, prefix='', max_depth=None, max_entries=None, exclude=None):
+    """Yield the lines of a directory tree one at a time.
+
+    The tree is walked iteratively with ``os.scandir``, so file types come
+    from the cached directory entries rather than a stat per entry. Symlinked
+    directories are followed, but never into one of their own ancestors.
+
+    Args:
+        path (str): The directory path to get the tree structure for.
+        prefix (str): Prefix for formatting the tree structure.
+        max_depth (int): Maximum depth to descend to; 1 lists only the entries of ``path``. None for no limit.
+        max_entries (int): Stop after this many entries and yield a truncation marker. None for no limit.
+        exclude (list[str] | str): Gitignore-style patterns of paths to leave out (see ``compile_exclude_patterns``).
+
+    Yields:
+        str: One line of the tree, including its trailing newline.
+
+    Raises:
+        FileNotFoundError: If the directory does not exist.
+        NotADirectoryError: If the path is not a directory.
+    """
+    is_excluded = compile_exclude_patterns(exclude) if exclude else None
+    root_stat = os.stat(path)
+
+    # Each frame is [entries, next index, prefix, depth, relative path, ancestor dirs].
+    stack = [[_scan_sorted(path, '', is_excluded), 0, prefix, 1, '', frozenset([(root_stat.st_dev, root_stat.st_ino)])]]
+    emitted = 0
+
+    while stack:
+        frame = stack[-1]
+        entries, idx, frame_prefix, depth, rel_path, ancestors = frame
+        if idx == len(entries):
+            stack.pop()
+            continue
+        frame[1] = idx + 1
+
+        if max_entries is not None and emitted >= max_entries:
+            yield f"{frame_prefix}... (truncated after {max_entries} entries)\n"
+            return
+
+        entry = entries[idx]
+        is_last = idx == len(entries) - 1
+        connector = '└── ' if is_last else '├── '
+        yield f"{frame_prefix}{connector}{entry.name}\n"
+        emitted += 1
+
+        if not entry.is_dir() or (max_depth is not None and depth >= max_depth):
+            continue
+
+        try:
+            entry_stat = entry.stat()
+            key = (entry_stat.st_dev, entry_stat.st_ino)
+            if key in ancestors:
+                continue
+            child_rel_path = f"{rel_path}{entry.name}/"
+            children = _scan_sorted(entry.path, child_rel_path, is_excluded)
+        except OSError:
+            continue
+
+        extension = '    ' if is_last else '│   '
+        stack.append([children, 0, frame_prefix + extension, depth + 1, child_rel_path, ancestors | {key}])
+
+
+@tool(hidden=("stream",))
+# The directory's stamp only changes with its direct entries, so only single-level listings are cached.
+@memoized(file_stamp, bypass=lambda args: args["stream"] or args["max_depth"] != 1)
+def get_directory_tree(path, prefix='', max_depth=None, max_entries=None, exclude=None, stream=False):
+    """Return the tree structure of a directory, including hidden files.
+
+    Args:
+        path (str): The directory path to get the tree structure for.
+        prefix (str): Prefix for formatting the tree structure.
+        max_depth (int): Maximum depth to descend to; 1 lists only the entries of ``path``. None for no limit.
+        max_entries (int): Stop after this many entries and add a truncation marker. None for no limit.
+        exclude (list[str] | str): Gitignore-style patterns of paths to leave out, e.g. ``[".git/", "node_modules/"]``.
+        stream (bool): If True, return a generator yielding the lines instead of a single string.
+
+    Returns:
+        str | Iterator[str]: The rendered tree, or a generator of its lines when ``stream`` is True.
+
+    Raises:
+        FileNotFoundError: If the directory does not exist.
+        NotADirectoryError: If the path is not a directory.
+    """
+    lines = iter_directory_tree(path, prefix, max_depth, max_entries, exclude)
+    if stream:
+        return lines
+    return ''.join(lines)
+
+
+def _line_range(buf, start, end, offset, limit, tail):
+    if tail is not None:
+        if tail <= 0:
+            return end, end
+        search_end = end - 1 if end > start and buf[end - 1:end] == b'\n' else end
+        line_start = start
+        for _ in range(tail):
+            newline = buf.rfind(b'\n', start, search_end)
+            if newline == -1:
+                line_start = start
+                break
+            line_start = newline + 1
+            search_end = newline
+        return line_start, end
+
+    pos = start
+    for _ in range(offset or 0):
+        newline = buf.find(b'\n', pos, end)
+        if newline == -1:
+            return end, end
+        pos = newline + 1
+    start = pos
+
+    if limit is not None:
+        for _ in range(limit):
+            newline = buf.find(b'\n', pos, end)
+            if newline == -1:
+                pos = end
+                break
+            pos = newline + 1
+        end = pos
+
+    return start, end
+
+
+@tool(description="Read the content of a file, or a range of it. Use offset/limit, tail or max_bytes for large files.")
+@memoized(file_stamp)
+def read_file(path, offset=None, limit=None, byte_offset=None, byte_limit=None, tail=None, max_bytes=None, encoding='utf-8', errors='replace'):
+    """Read the content of a file, or a range of it.
+
+    Files of ``MMAP_THRESHOLD`` bytes or more are memory-mapped, so only the
+    pages that hold the requested range are loaded. A byte range is applied
+    first, then the line range (or ``tail``) within it, then ``max_bytes``.
 
     Args:
         path (str): The file path to read.
+        offset (int): Number of lines to skip from the start.
+        limit (int): Maximum number of lines to return.
+        byte_offset (int): Byte position to start reading from.
+        byte_limit (int): Maximum number of bytes to consider from ``byte_offset``.
+        tail (int): Return only the last N lines; takes precedence over ``offset``/``limit``.
+        max_bytes (int): Cap on the returned bytes; longer output is cut and ends with a truncation marker.
+        encoding (str): Text encoding used to decode the file.
+        errors (str): How decoding errors are handled ('strict', 'replace', 'ignore', ...).
 
     Returns:
-        str: The content of the file.
+        str: The selected content, or a short description if the file looks binary.
 
     Raises:
         FileNotFoundError: If the file does not exist.
@@ -192,11 +326,94 @@ def read_file(path):
     if not os.path.exists(path):
         raise FileNotFoundError(f"The file at {path} does not exist.")
 
-    with open(path, 'r') as f:
-        content = f.read()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ''
+
+        use_mmap = size >= MMAP_THRESHOLD
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read()
+        try:
+            start, end = 0, size
+            if byte_offset is not None or byte_limit is not None:
+                start = min(max(byte_offset or 0, 0), size)
+                end = size if byte_limit is None else min(size, start + byte_limit)
+
+            if tail is not None or offset is not None or limit is not None:
+                start, end = _line_range(buf, start, end, offset, limit, tail)
+
+            if b'\x00' in buf[start:min(end, start + BINARY_SNIFF_BYTES)]:
+                return f"[binary file {path}: {size} bytes, showing nothing]"
+
+            selected = end - start
+            truncated = max_bytes is not None and selected > max_bytes
+            if truncated:
+                end = start + max_bytes
+            data = buf[start:end]
+            record(bytes_read=len(data))
+        finally:
+            if use_mmap:
+                buf.close()
+
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    content = decoder.decode(data, final=not truncated)
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+    if truncated:
+        content += f"\n... [truncated: showing {max_bytes} of {selected} bytes]"
 
     return content
 
+
+@tool(description="Search the contents of files under a directory for a literal string or regular expression, using a persistent index that is updated incrementally. Returns matching lines as 'path:line: text'.")
+def search_files(query, path='.', regex=False, glob=None, case_sensitive=True, max_results=50, context_lines=0):
+    """Search file contents under a directory.
+
+    Candidate files are narrowed down with a persistent trigram index (see
+    ``search_index``) before any file is read, and the index is refreshed
+    incrementally from file mtimes on every call.
+
+    Args:
+        query (str): The text or regular expression to search for.
+        path (str): The directory to search.
+        regex (bool): Treat ``query`` as a regular expression.
+        glob (str): Only search files matching this glob.
+        case_sensitive (bool): Whether matching is case sensitive.
+        max_results (int): Maximum number of matching lines to return.
+        context_lines (int): Lines of context to show before and after each match.
+
+    Returns:
+        str: Matches as ``path:line: text``, with context lines as ``path-line- text`` and groups separated by ``--``.
+
+    Raises:
+        FileNotFoundError: If the directory does not exist.
+        re.error: If ``query`` is not a valid regular expression.
+    """
+    from search_index import search
+
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"The directory at {path} does not exist.")
+
+    matches, truncated = search(path, query, regex, glob, case_sensitive, max_results, context_lines)
+    if not matches:
+        return f"No matches for {query!r} in {path}"
+
+    blocks = []
+    for match in matches:
+        first = match["line"] - len(match["before"])
+        lines = [f"{match['path']}-{first + i}- {text}" for i, text in enumerate(match["before"])]
+        lines.append(f"{match['path']}:{match['line']}: {match['text']}")
+        lines += [f"{match['path']}-{match['line'] + 1 + i}- {text}" for i, text in enumerate(match["after"])]
+        blocks.append('\n'.join(lines))
+
+    result = ('\n--\n' if context_lines else '\n').join(blocks)
+    if truncated:
+        result += f"\n... [stopped after {max_results} matches]"
+    return result
+
+
+@tool()
+@invalidates("path")
 def write_file(path, content):
     """Write content to a file.
 
@@ -209,9 +426,298 @@ def write_file(path, content):
     """
     with open(path, 'w') as f:
         f.write(content)
-    print(f"Content written to {path}")
+    record(bytes_written=len(content))
+    event("file_written", f"Content written to {path}", path=path, chars=len(content))
+
+
+def _atomic_write(path, content):
+    """Write text to ``path`` via a temporary file and a rename.
+
+    Readers see either the old or the new content, never a partial write.
+    The permission bits of an existing file are kept.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+            f.flush()
+            record(bytes_written=f.tell())
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def _apply_search_replace(path, content, edits):
+    for number, edit in enumerate(edits, start=1):
+        search, replace = edit["search"], edit["replace"]
+        expected = edit.get("count", 1)
+        if not search:
+            raise ValueError(f"Edit {number} for {path} has an empty search string.")
+
+        found = content.count(search)
+        if expected is None or expected == 0:
+            if found == 0:
+                raise ValueError(f"Edit {number} for {path}: search text not found.")
+        elif found != expected:
+            raise ValueError(f"Edit {number} for {path}: expected {expected} occurrence(s) of the search text, found {found}.")
+
+        content = content.replace(search, replace)
+    return content
+
+
+@tool(
+    description="Change part of a file by replacing exact snippets, without resending the whole file. Each search text must match exactly (including whitespace) the expected number of times; nothing is written if any edit does not match.",
+    edits={"items": _EDIT_SCHEMA},
+)
+@invalidates("path")
+def edit_file(path, edits):
+    """Apply search/replace edits to a file.
 
+    Every edit's search text must occur exactly ``count`` times (default 1;
+    0 replaces all occurrences but requires at least one). Edits are applied
+    in order, and the file is only rewritten, atomically, if all of them match.
 
+    Args:
+        path (str): The file path to edit.
+        edits (list[dict]): Edits with ``search`` and ``replace`` keys and an optional ``count``.
+
+    Returns:
+        str: A short summary of the change.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        ValueError: If a search text does not match as expected.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The file at {path} does not exist.")
+
+    _atomic_write(path, _apply_search_replace(path, _read_text(path), edits))
+    event("file_edited", f"Applied {len(edits)} edit(s) to {path}", path=path, edits=len(edits))
+    return f"Applied {len(edits)} edit(s) to {path}"
+
+
+@tool(
+    description="Apply search/replace edits to several files in one call. Nothing is written unless every edit in every file matches.",
+    files={"items": {
+        "type": "object",
+        "properties": {
+            "path": {"type": "string", "description": "The path of the file to edit."},
+            "edits": {"type": "array", "description": "The edits to apply to this file, in order.", "items": _EDIT_SCHEMA}
+        },
+        "required": ["path", "edits"]
+    }},
+)
+@clears_cache
+def edit_files(files):
+    """Apply search/replace edits to several files at once.
+
+    All edits are checked before anything is written, so a mismatch in one
+    file leaves every file untouched.
+
+    Args:
+        files (list[dict]): One entry per file, with ``path`` and ``edits`` keys (see ``edit_file``).
+
+    Returns:
+        str: A short summary of the changes.
+
+    Raises:
+        FileNotFoundError: If a file does not exist.
+        ValueError: If a search text does not match as expected.
+    """
+    staged = []
+    for entry in files:
+        path = entry["path"]
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"The file at {path} does not exist.")
+        staged.append((path, _apply_search_replace(path, _read_text(path), entry["edits"])))
+
+    for path, content in staged:
+        _atomic_write(path, content)
+
+    edit_count = sum(len(entry["edits"]) for entry in files)
+    event("files_edited", f"Applied {edit_count} edit(s) to {len(staged)} file(s)", paths=[path for path, _ in staged], edits=edit_count)
+    return f"Applied {edit_count} edit(s) to {len(staged)} file(s): {', '.join(path for path, _ in staged)}"
+
+
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _patch_path(header, root=None):
+    path = header.split('\t', 1)[0].strip()
+    if path == '/dev/null':
+        return None
+    if root is not None:
+        from workspace import resolve_path
+
+        if path[:2] in ('a/', 'b/') and not os.path.exists(os.path.join(root, path)):
+            path = path[2:]
+        return resolve_path(root, path)
+    if path[:2] in ('a/', 'b/') and not os.path.exists(path):
+        return path[2:]
+    return path
+
+
+def _parse_unified_diff(patch, root=None):
+    """Split a unified diff into ``(old_path, new_path, hunks)`` per file.
+
+    Each hunk is ``(old_start, lines)`` where lines are ``(tag, text)`` pairs
+    and tag is one of ``' '``, ``'-'`` or ``'+'``. With ``root``, paths are
+    resolved against it and paths outside it raise ``ValueError``.
+    """
+    files = []
+    lines = patch.splitlines(keepends=True)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not (line.startswith('--- ') and i + 1 < len(lines) and lines[i + 1].startswith('+++ ')):
+            i += 1
+            continue
+
+        old_path, new_path = _patch_path(line[4:], root), _patch_path(lines[i + 1][4:], root)
+        hunks = []
+        i += 2
+        while i < len(lines) and lines[i].startswith('@@'):
+            match = _HUNK_HEADER.match(lines[i])
+            if not match:
+                raise ValueError(f"Malformed hunk header: {lines[i].rstrip()}")
+            old_start = int(match.group(1))
+            old_left = int(match.group(2) or 1)
+            new_left = int(match.group(4) or 1)
+            hunk_lines = []
+            i += 1
+            while i < len(lines) and (old_left > 0 or new_left > 0 or lines[i].startswith('\\')):
+                line = lines[i]
+                if line.startswith('\\'):
+                    # "\ No newline at end of file" applies to the previous line.
+                    tag, text = hunk_lines[-1]
+                    hunk_lines[-1] = (tag, text.rstrip('\r\n'))
+                elif line[:1] in (' ', '-', '+') or line in ('\n', '\r\n'):
+                    tag = line[:1] if line[:1] in ('-', '+') else ' '
+                    text = line[1:] if line[:1] in (' ', '-', '+') else line
+                    hunk_lines.append((tag, text))
+                    if tag != '+':
+                        old_left -= 1
+                    if tag != '-':
+                        new_left -= 1
+                else:
+                    raise ValueError(f"Unexpected line in hunk: {line.rstrip()}")
+                i += 1
+            hunks.append((old_start, hunk_lines))
+
+        files.append((old_path, new_path, hunks))
+
+    if not files:
+        raise ValueError("The patch contains no file changes.")
+    return files
+
+
+def _apply_hunks(path, old_lines, hunks):
+    newline = '\r\n' if old_lines and old_lines[0].endswith('\r\n') else '\n'
+    result = []
+    pos = 0
+    for number, (old_start, hunk_lines) in enumerate(hunks, start=1):
+        expected = [text.rstrip('\r\n') for tag, text in hunk_lines if tag != '+']
+        replacement = [text for tag, text in hunk_lines if tag != '-']
+
+        def matches_at(start):
+            if start < pos or start + len(expected) > len(old_lines):
+                return False
+            return all(old_lines[start + k].rstrip('\r\n') == expected[k] for k in range(len(expected)))
+
+        # Prefer the stated position, then the nearest offset that matches.
+        target = max(old_start - 1, 0) if expected else old_start
+        start = None
+        for delta in range(len(old_lines) + 1):
+            if matches_at(target + delta):
+                start = target + delta
+                break
+            if delta and matches_at(target - delta):
+                start = target - delta
+                break
+        if start is None:
+            raise ValueError(f"Hunk {number} does not match {path} near line {old_start}.")
+
+        result.extend(old_lines[pos:start])
+        for text in replacement:
+            if text.endswith('\n'):
+                text = text.rstrip('\r\n') + newline
+            result.append(text)
+        pos = start + len(expected)
+
+    result.extend(old_lines[pos:])
+    return ''.join(result)
+
+
+@tool(description="Apply a unified diff (as produced by 'diff -u' or 'git diff') to one or more files. Context lines must match; nothing is written if any hunk fails.",
+      hidden=("root",))
+@clears_cache
+def apply_patch(patch, root=None):
+    """Apply a unified diff to one or more files.
+
+    Hunks must match the file contents (context and removed lines), though
+    they may have moved from the line numbers in their headers. Files are
+    created or deleted when one side of the diff is ``/dev/null``. Every file
+    is patched in memory first and only then written atomically, so a hunk
+    that does not apply leaves all files untouched.
+
+    Args:
+        patch (str): The unified diff, e.g. the output of ``diff -u`` or ``git diff``.
+        root (str): Resolve the paths in the patch against this directory and refuse paths outside it.
+
+    Returns:
+        str: A short summary of the changed files.
+
+    Raises:
+        FileNotFoundError: If a file to be patched does not exist.
+        ValueError: If the patch is malformed, a hunk does not match or a path is outside ``root``.
+    """
+    staged = []
+    for old_path, new_path, hunks in _parse_unified_diff(patch, root):
+        if old_path is None:
+            old_lines = []
+        else:
+            if not os.path.exists(old_path):
+                raise FileNotFoundError(f"The file at {old_path} does not exist.")
+            old_lines = _read_text(old_path).splitlines(keepends=True)
+
+        content = _apply_hunks(old_path or new_path, old_lines, hunks)
+        if new_path is None and content:
+            raise ValueError(f"The patch deletes {old_path} but leaves content behind.")
+        staged.append((old_path, new_path, content))
+
+    changed = []
+    for old_path, new_path, content in staged:
+        if new_path is None:
+            os.remove(old_path)
+            changed.append(f"deleted {old_path}")
+            continue
+
+        if os.path.dirname(new_path):
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        _atomic_write(new_path, content)
+        if old_path is not None and old_path != new_path:
+            os.remove(old_path)
+            changed.append(f"renamed {old_path} -> {new_path}")
+        else:
+            changed.append(f"{'created' if old_path is None else 'patched'} {new_path}")
+
+    event("patch_applied", f"Patch applied to {len(changed)} file(s)", changes=changed)
+    return "Patch applied: " + ", ".join(changed)
+
+
+@tool()
+@invalidates("path")
 def append_to_file(path, content):
     """Append content to a file.
 
@@ -224,14 +730,66 @@ def append_to_file(path, content):
     """
     with open(path, 'a') as f:
         f.write(content)
-    print(f"Content appended to {path}")
+    record(bytes_written=len(content))
+    event("file_appended", f"Content appended to {path}", path=path, chars=len(content))
 
-def copy_file(src, dst):
+def _copy_contents(f_src, f_dst):
+    """Copy an open file's contents in the kernel where possible.
+
+    Tries ``os.copy_file_range`` first, then ``os.sendfile``, and falls back to
+    a chunked read/write loop when neither is supported for these files.
+    """
+    src_fd, dst_fd = f_src.fileno(), f_dst.fileno()
+    size = os.fstat(src_fd).st_size
+    copied = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src_fd, dst_fd, min(size - copied, COPY_CHUNK_BYTES), copied, copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED or copied:
+                raise
+
+    if copied == 0 and hasattr(os, 'sendfile'):
+        try:
+            while copied < size:
+                sent = os.sendfile(dst_fd, src_fd, copied, min(size - copied, COPY_CHUNK_BYTES))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED or copied:
+                raise
+
+    # Also picks up anything appended to the source while copying.
+    f_src.seek(copied)
+    f_dst.seek(copied)
+    buf = bytearray(COPY_CHUNK_BYTES)
+    view = memoryview(buf)
+    while True:
+        read = f_src.readinto(buf)
+        if not read:
+            break
+        f_dst.write(view[:read])
+    record(bytes_read=f_dst.tell(), bytes_written=f_dst.tell())
+
+
+@tool()
+@invalidates("src", "dst")
+def copy_file(src, dst, preserve_metadata=False):
     """Copy a file from source to destination.
 
+    The data is moved with ``copy_file_range``/``sendfile`` when the platform
+    supports it, so it never passes through Python buffers.
+
     Args:
         src (str): The source file path.
         dst (str): The destination file path.
+        preserve_metadata (bool): Also copy permission bits, timestamps and flags.
 
     Raises:
         FileNotFoundError: If the source file does not exist.
@@ -240,17 +798,24 @@ def copy_file(src, dst):
     if not os.path.exists(src):
         raise FileNotFoundError(f"The source file at {src} does not exist.")
 
-    with open(src, 'rb') as f_src:
-        content = f_src.read()
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        _copy_contents(f_src, f_dst)
 
-    with open(dst, 'wb') as f_dst:
-        f_dst.write(content)
+    if preserve_metadata:
+        shutil.copystat(src, dst)
 
-    print(f"File copied from {src} to {dst}")
+    event("file_copied", f"File copied from {src} to {dst}", src=src, dst=dst)
 
+
+@tool()
+@invalidates("src", "dst")
 def move_file(src, dst):
     """Move a file from source to destination.
 
+    Moves across filesystems are done as a copy (with metadata) to a
+    temporary file next to ``dst``, a rename into place, and an unlink of
+    ``src``.
+
     Args:
         src (str): The source file path.
         dst (str): The destination file path.
@@ -262,5 +827,84 @@ def move_file(src, dst):
     if not os.path.exists(src):
         raise FileNotFoundError(f"The source file at {src} does not exist.")
 
-    os.rename(src, dst)
-    print(f"File moved from {src} to {dst}")
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+        tmp_path = os.path.join(os.path.dirname(dst) or '.', f".{os.path.basename(dst)}.{os.getpid()}.tmp")
+        try:
+            with open(src, 'rb') as f_src, open(tmp_path, 'wb') as f_dst:
+                _copy_contents(f_src, f_dst)
+            shutil.copystat(src, tmp_path)
+            os.replace(tmp_path, dst)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.unlink(src)
+
+    event("file_moved", f"File moved from {src} to {dst}", src=src, dst=dst)
+
+
+def _run_file_operations(func, operations, max_workers, **kwargs):
+    def run(index, operation):
+        result = {"index": index, "src": operation.get("src"), "dst": operation.get("dst"), "ok": True, "error": None}
+        try:
+            func(operation["src"], operation["dst"], **kwargs)
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1.")
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, max(len(operations), 1))) as pool:
+        return list(pool.map(run, range(len(operations)), operations))
+
+
+@tool(
+    description="Copy many files in one call, running the copies concurrently. Returns a result per copy; one failure does not stop the others.",
+    operations={"items": _FILE_OPERATION_SCHEMA},
+)
+def copy_files(operations, preserve_metadata=False, max_workers=8):
+    """Copy many files concurrently.
+
+    Args:
+        operations (list[dict]): Copies to perform, each with ``src`` and ``dst`` keys.
+        preserve_metadata (bool): Also copy permission bits, timestamps and flags.
+        max_workers (int): Maximum number of copies running at once.
+
+    Returns:
+        list[dict]: One result per operation, in input order, with ``index``, ``src``,
+        ``dst``, ``ok`` and ``error`` keys. A failed copy does not stop the others.
+
+    Raises:
+        ValueError: If max_workers is less than 1.
+    """
+    return _run_file_operations(copy_file, operations, max_workers, preserve_metadata=preserve_metadata)
+
+
+@tool(
+    description="Move many files in one call, running the moves concurrently. Returns a result per move; one failure does not stop the others.",
+    operations={"items": _FILE_OPERATION_SCHEMA},
+)
+def move_files(operations, max_workers=8):
+    """Move many files concurrently.
+
+    Args:
+        operations (list[dict]): Moves to perform, each with ``src`` and ``dst`` keys.
+        max_workers (int): Maximum number of moves running at once.
+
+    Returns:
+        list[dict]: One result per operation, in input order (see ``copy_files``).
+
+    Raises:
+        ValueError: If max_workers is less than 1.
+    """
+    return _run_file_operations(move_file, operations, max_workers)
+
+
+FILE_TOOLS = tool_schemas(__name__)
@@ -0,0 +1,484 @@
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import threading
+import time
+
+from instrumentation import event, get_metrics
+from search_index import exclude_matcher
+from tool_registry import tool, tool_schemas
+
+
+# Quiet period after the last event before pending changes are applied.
+DEBOUNCE_SECONDS = 0.1
+# Apply pending changes at least this often, even while events keep arriving.
+MAX_DELAY_SECONDS = 1.0
+POLL_INTERVAL_SECONDS = 2.0
+# Changes kept for get_changes_since; older cursors get a reset.
+MAX_CHANGES = 10_000
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Return the queued events as (wd, mask, name) tuples without blocking."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _ancestors(rel_path):
+    """Yield the parent directories of ``rel_path``, up to the root ('')."""
+    while rel_path:
+        rel_path = rel_path.rpartition('/')[0]
+        yield rel_path
+
+
+class WorkspaceWatcher:
+    """An in-memory snapshot of a directory tree and a feed of its changes.
+
+    Changes are picked up with inotify where available: events only mark
+    paths as dirty, and after a ``debounce`` quiet period each dirty path is
+    compared with the snapshot, so a burst of writes to one file becomes a
+    single change. Without inotify (or when it runs out of watches) the
+    whole tree is rescanned every ``poll_interval`` seconds instead.
+
+    Every change is numbered; ``changes_since`` returns the net changes
+    after a given number (the cursor), so callers see only deltas.
+    Directories are reported when created or deleted, never as modified.
+
+    Args:
+        root (str): The directory to watch.
+        exclude (list[str] | str): Gitignore-style patterns to ignore; defaults to ``search_index.DEFAULT_EXCLUDES``.
+        debounce (float): Quiet period in seconds before pending events are applied.
+        poll_interval (float): Seconds between rescans when polling.
+        backend (str): "inotify", "poll" or "auto" (inotify if it can be used).
+    """
+
+    def __init__(self, root, exclude=None, debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL_SECONDS, backend="auto"):
+        self.root = os.path.abspath(root)
+        self.is_excluded = exclude_matcher(self.root, exclude)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # rel_path -> (is_dir, mtime_ns, size); directories carry no mtime or size.
+        self.snapshot = {}
+        self.children = collections.defaultdict(set)
+        self.changes = collections.deque(maxlen=MAX_CHANGES)
+        self.cursor = 0
+        self.lock = threading.RLock()
+        self._dirty = set()
+        self._first_dirty = None
+        self._last_event = None
+        self._inotify = None
+        self._watches = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+        if backend not in ("auto", "inotify", "poll"):
+            raise ValueError(f"Unknown watcher backend {backend!r}.")
+        if backend != "poll":
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                if backend == "inotify":
+                    raise
+        self.backend = "inotify" if self._inotify is not None else "poll"
+
+        with self.lock:
+            self._reconcile('', record=False)
+
+    # -- snapshot ---------------------------------------------------------
+
+    def _abs(self, rel_path):
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+    def _watch(self, rel_path):
+        if self._inotify is None:
+            return
+        try:
+            self._watches[self._inotify.add_watch(self._abs(rel_path))] = rel_path
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                return
+            # Out of inotify watches: fall back to polling the whole tree.
+            self._inotify.close()
+            self._inotify = None
+            self._watches.clear()
+            self.backend = "poll"
+            event("watcher_fallback", f"inotify watch limit reached; polling {self.root} instead", root=self.root)
+
+    def _scan(self, rel_path):
+        """Return {rel_path: entry} for ``rel_path`` and everything below it on disk."""
+        found = {}
+        try:
+            st = os.lstat(self._abs(rel_path))
+        except OSError:
+            return found
+
+        stack = []
+        if stat.S_ISDIR(st.st_mode):
+            if rel_path:
+                found[rel_path] = (True, None, None)
+            stack.append(rel_path)
+        elif rel_path:
+            found[rel_path] = (False, st.st_mtime_ns, st.st_size)
+
+        while stack:
+            directory = stack.pop()
+            # Watch before listing, so entries created in between still raise events.
+            self._watch(directory)
+            try:
+                with os.scandir(self._abs(directory)) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                child = f"{directory}/{entry.name}" if directory else entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if self.is_excluded(child, is_dir):
+                        continue
+                    if is_dir:
+                        found[child] = (True, None, None)
+                        stack.append(child)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        found[child] = (False, st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return found
+
+    def _known(self, rel_path):
+        """Return the snapshot paths at and below ``rel_path``."""
+        known = []
+        stack = [rel_path]
+        if rel_path and rel_path not in self.snapshot:
+            return known
+        while stack:
+            path = stack.pop()
+            if path:
+                known.append(path)
+            prefix = f"{path}/" if path else ''
+            stack.extend(prefix + name for name in self.children.get(path, ()))
+        return known
+
+    def _record(self, rel_path, kind, is_dir):
+        self.cursor += 1
+        self.changes.append((self.cursor, rel_path, kind, is_dir))
+
+    def _reconcile(self, rel_path, record=True):
+        """Bring the snapshot at and below ``rel_path`` in line with the disk."""
+        if rel_path and self.is_excluded(rel_path, os.path.isdir(self._abs(rel_path))):
+            return
+        found = self._scan(rel_path)
+        known = self._known(rel_path)
+
+        # Children before their parents.
+        for path in reversed(known):
+            if path not in found or found[path][0] != self.snapshot[path][0]:
+                is_dir = self.snapshot.pop(path)[0]
+                parent, _, name = path.rpartition('/')
+                self.children[parent].discard(name)
+                self.children.pop(path, None)
+                if record:
+                    self._record(path, "deleted", is_dir)
+
+        # Sorted so that directories are added before their contents.
+        for path in sorted(found):
+            entry = found[path]
+            old = self.snapshot.get(path)
+            if old == entry:
+                continue
+            self.snapshot[path] = entry
+            if old is None:
+                parent, _, name = path.rpartition('/')
+                self.children[parent].add(name)
+            if record:
+                self._record(path, "created" if old is None else "modified", entry[0])
+
+    # -- events -----------------------------------------------------------
+
+    def _drain(self):
+        """Move queued inotify events into the dirty set."""
+        if self._inotify is None:
+            return
+        events = self._inotify.read_events()
+        if not events:
+            return
+        now = time.monotonic()
+        self._last_event = now
+        if self._first_dirty is None:
+            self._first_dirty = now
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self._dirty.add('')
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # A moved directory is watched again under its new path when that is reconciled.
+                if mask & IN_MOVE_SELF:
+                    self._inotify.rm_watch(wd)
+                    del self._watches[wd]
+                self._dirty.add(directory)
+                continue
+            self._dirty.add(f"{directory}/{name}" if directory and name else (name or directory))
+
+    def _apply_dirty(self):
+        dirty = self._dirty
+        self._dirty = set()
+        self._first_dirty = None
+        # A dirty directory is reconciled with its whole subtree, so skip paths below one.
+        for path in sorted(dirty):
+            if not any(ancestor in dirty for ancestor in _ancestors(path)):
+                self._reconcile(path)
+
+    def sync(self):
+        """Apply every change made so far, without waiting for the debounce period."""
+        with self.lock:
+            if self._inotify is None:
+                self._reconcile('')
+                return
+            self._drain()
+            if self._dirty:
+                self._apply_dirty()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self._inotify is None:
+                if self._stopped.wait(self.poll_interval):
+                    return
+                with self.lock:
+                    self._reconcile('')
+                continue
+
+            timeout = None
+            if self._first_dirty is not None:
+                now = time.monotonic()
+                timeout = max(0.0, min(self._last_event + self.debounce, self._first_dirty + MAX_DELAY_SECONDS) - now)
+            try:
+                readable, _, _ = select.select([self._inotify.fd], [], [], timeout if timeout is not None else 0.5)
+            except (OSError, ValueError):
+                readable = []
+            with self.lock:
+                if self._inotify is None:
+                    continue
+                if readable:
+                    self._drain()
+                now = time.monotonic()
+                if self._first_dirty is not None and (
+                        now >= self._last_event + self.debounce or now >= self._first_dirty + MAX_DELAY_SECONDS):
+                    self._apply_dirty()
+
+    def start(self):
+        """Start watching in a background thread and return the watcher."""
+        self._thread = threading.Thread(target=self._run, name=f"watch:{self.root}", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop watching."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self.lock:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+    # -- queries ----------------------------------------------------------
+
+    def changes_since(self, cursor=None):
+        """Return the net changes after ``cursor``.
+
+        Args:
+            cursor (int): A cursor returned by an earlier call, or None to only get the current cursor.
+
+        Returns:
+            dict: ``cursor``, ``created``, ``modified`` and ``deleted`` relative paths (directories
+            with a trailing ``/``), and ``reset``, which is True when ``cursor`` is too old (or
+            from another watcher) and the caller must re-read the tree.
+        """
+        self.sync()
+        with self.lock:
+            result = {"cursor": self.cursor, "created": [], "modified": [], "deleted": [], "reset": False}
+            if cursor is None:
+                return result
+            oldest = self.changes[0][0] - 1 if self.changes else self.cursor
+            if cursor < oldest or cursor > self.cursor:
+                result["reset"] = True
+                return result
+
+            first = {}
+            last = {}
+            for seq, path, kind, is_dir in self.changes:
+                if seq <= cursor:
+                    continue
+                first.setdefault(path, kind)
+                last[path] = (kind, is_dir)
+
+            for path, (kind, is_dir) in last.items():
+                existed_before = first[path] != "created"
+                exists_now = kind != "deleted"
+                if existed_before and exists_now:
+                    net = "modified"
+                elif exists_now:
+                    net = "created"
+                elif existed_before:
+                    net = "deleted"
+                else:
+                    continue
+                if net == "modified" and is_dir:
+                    continue
+                result[net].append(f"{path}/" if is_dir else path)
+
+        for kind in ("created", "modified", "deleted"):
+            result[kind].sort()
+        get_metrics().inc("watcher_changes_total", sum(len(result[kind]) for kind in ("created", "modified", "deleted")))
+        return result
+
+    def stats(self):
+        """Return the backend and the snapshot and change log sizes.
+
+        Returns:
+            dict: ``backend``, ``paths``, ``watches``, ``cursor`` and ``pending``.
+        """
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "paths": len(self.snapshot),
+                "watches": len(self._watches),
+                "cursor": self.cursor,
+                "pending": len(self._dirty),
+            }
+
+
+def get_watcher(root='.', exclude=None):
+    """Return the running watcher for ``root``, starting it on first use.
+
+    The backend can be forced with the ``AGENT_WATCH_BACKEND`` environment
+    variable ("inotify" or "poll").
+
+    Args:
+        root (str): The workspace root.
+        exclude (list[str]): Gitignore-style patterns to ignore; defaults to ``search_index.DEFAULT_EXCLUDES``.
+
+    Returns:
+        WorkspaceWatcher: The watcher.
+    """
+    if isinstance(exclude, str):
+        exclude = exclude.split(',')
+    key = (os.path.abspath(root), tuple(exclude) if exclude is not None else None)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            backend = os.environ.get("AGENT_WATCH_BACKEND", "auto")
+            watcher = _watchers[key] = WorkspaceWatcher(root, exclude=exclude, backend=backend).start()
+        return watcher
+
+
+def close_watchers(root):
+    """Stop and forget every watcher started for ``root`` or a directory inside it.
+
+    Args:
+        root (str): The directory, e.g. a workspace that is being unloaded.
+    """
+    root = os.path.abspath(root)
+    with _watchers_lock:
+        keys = [key for key in _watchers if key[0] == root or key[0].startswith(root + os.sep)]
+        watchers = [_watchers.pop(key) for key in keys]
+    for watcher in watchers:
+        watcher.close()
+
+
+@tool(description="List the files and directories created, modified or deleted under a directory since an earlier call. Call it once without a cursor to start, then pass the returned cursor each time instead of re-reading the whole tree.")
+def get_changes_since(cursor=None, path='.', exclude=None):
+    """Return the changes under a directory since a cursor.
+
+    The first call for a directory starts watching it and returns only a
+    cursor. Later calls return the paths that changed since the given
+    cursor, relative to ``path``, and a new cursor.
+
+    Args:
+        cursor (int): The cursor returned by the previous call; omit it to get a starting cursor.
+        path (str): The directory to watch; defaults to the current working directory.
+        exclude (list[str]): Gitignore-style patterns of noisy paths to ignore, replacing the defaults (.git/, node_modules/, __pycache__/, virtualenvs and caches).
+
+    Returns:
+        dict: ``cursor``, ``created``, ``modified`` and ``deleted`` paths (directories end with '/'),
+        and ``reset``, which is True if the cursor is too old and the tree must be re-read.
+
+    Raises:
+        NotADirectoryError: If the path is not a directory.
+    """
+    if not os.path.isdir(path):
+        raise NotADirectoryError(f"{path} is not a directory.")
+    return get_watcher(path, exclude).changes_since(cursor)
+
+
+WATCH_TOOLS = tool_schemas(__name__)
@@ -0,0 +1,133 @@
+import os
+import threading
+
+
+API_KEY_FILE = "api_key.txt"
+
+_client = None
+_api_key = None
+_lock = threading.Lock()
+
+_settings = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0,
+    "connect_timeout": 10.0,
+    "read_timeout": 120.0,
+    "request_timeout": 120.0,
+    "base_url": None,
+}
+
+
+def load_api_key(path=API_KEY_FILE):
+    """Load the Gemini API key once and reuse it for every later call.
+
+    The key is read from ``path`` the first time, falling back to the
+    ``GEMINI_API_KEY`` / ``GOOGLE_API_KEY`` environment variables when the
+    file does not exist.
+
+    Args:
+        path (str): The file containing the API key.
+
+    Returns:
+        str: The API key.
+
+    Raises:
+        FileNotFoundError: If neither the key file nor an environment variable is available.
+    """
+    global _api_key
+
+    if _api_key is not None:
+        return _api_key
+
+    with _lock:
+        if _api_key is None:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    _api_key = f.read().strip()
+            else:
+                _api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+                if not _api_key:
+                    raise FileNotFoundError(f"The file at {path} does not exist and no API key is set in the environment.")
+
+    return _api_key
+
+
+def configure_client(**settings):
+    """Tune the connection pool and timeouts of the shared client.
+
+    Must be called before the first ``get_client()`` to take effect; calling it
+    afterwards drops the current client so the next ``get_client()`` rebuilds it
+    with the new settings.
+
+    Args:
+        max_connections (int): Maximum number of concurrent connections to the API.
+        max_keepalive_connections (int): Number of idle keep-alive connections kept in the pool.
+        keepalive_expiry (float): Seconds an idle connection is kept open.
+        connect_timeout (float): Seconds allowed to establish a connection.
+        read_timeout (float): Seconds allowed between bytes of a response.
+        request_timeout (float): Overall request timeout in seconds, passed to the SDK.
+        base_url (str): API endpoint to use instead of the public one, e.g. a local stand-in server.
+
+    Raises:
+        ValueError: If an unknown setting is given.
+    """
+    global _client
+
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+
+    with _lock:
+        _settings.update(settings)
+        _client = None
+
+
+def _http_options():
+    import httpx
+    from google.genai import types
+
+    limits = httpx.Limits(
+        max_connections=_settings["max_connections"],
+        max_keepalive_connections=_settings["max_keepalive_connections"],
+        keepalive_expiry=_settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(
+        _settings["request_timeout"],
+        connect=_settings["connect_timeout"],
+        read=_settings["read_timeout"],
+    )
+    client_args = {"limits": limits, "timeout": timeout}
+
+    return types.HttpOptions(
+        base_url=_settings["base_url"],
+        timeout=int(_settings["request_timeout"] * 1000),
+        client_args=client_args,
+        async_client_args=dict(client_args),
+    )
+
+
+def get_client():
+    """Return the process-wide Gemini client, creating it on first use.
+
+    The client owns a pooled HTTP connection set, so reusing it across tools and
+    the chat session keeps connections alive instead of paying a new TLS
+    handshake per request. Safe to call from multiple threads.
+
+    Returns:
+        genai.Client: The shared client.
+    """
+    global _client
+
+    client = _client
+    if client is not None:
+        return client
+
+    api_key = load_api_key()
+    # The SDK takes about a second to import, so it is only loaded once a client is needed.
+    from google import genai
+
+    with _lock:
+        if _client is None:
+            _client = genai.Client(api_key=api_key, http_options=_http_options())
+        return _client
@@ -0,0 +1,287 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from agent import DEFAULT_MODEL, create_chat
+from instrumentation import event, record_usage, span
+from scheduler import estimate_tokens, get_scheduler
+
+
+HISTORY_TOKEN_BUDGET = 100_000
+KEEP_RECENT_TURNS = 4
+MAX_TOOL_OUTPUT_CHARS = 2000
+TOOL_OUTPUT_PREVIEW_CHARS = 500
+SUMMARY_MODEL = "gemini-2.5-flash"
+MAX_CACHED_COUNTS = 4096
+# Rough characters per token, used when the token counting endpoint fails.
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and an assistant that uses tools. "
+    "Keep every fact, decision, file path, command and open task needed to continue the work; "
+    "drop pleasantries and raw tool output. Write it as notes, not as a dialogue.\n\n"
+)
+
+
+def _content_key(content):
+    return hashlib.sha1(content.model_dump_json(exclude_none=True).encode('utf-8')).hexdigest()
+
+
+def _is_user_message(content):
+    """Whether ``content`` is a user-written message, as opposed to function responses."""
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+
+def _split_turns(history):
+    """Split a history into turns, each starting at a user-written message."""
+    turns = []
+    for content in history:
+        if _is_user_message(content) or not turns:
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _render(content, max_chars=TOOL_OUTPUT_PREVIEW_CHARS):
+    """Render a message as plain text for the summarizer."""
+    lines = []
+    for part in content.parts or []:
+        if part.text:
+            lines.append(part.text)
+        elif part.function_call:
+            lines.append(f"[called {part.function_call.name}({json.dumps(part.function_call.args or {}, default=str)})]")
+        elif part.function_response:
+            response = json.dumps(part.function_response.response, default=str)
+            if len(response) > max_chars:
+                response = response[:max_chars] + "..."
+            lines.append(f"[{part.function_response.name} returned {response}]")
+        elif part.inline_data:
+            lines.append(f"[{part.inline_data.mime_type} attachment]")
+    return f"{content.role}: " + '\n'.join(lines)
+
+
+class HistoryManager:
+    """Keep a chat session's history within a token budget.
+
+    Wraps the chat created by ``create_chat`` and is used in its place
+    (``run_turn`` only needs ``send_message``, and ``stream_turn``
+    ``send_message_stream``). Before each user message:
+
+    * function responses from earlier turns that the model has already
+      answered are elided when longer than ``max_tool_output_chars``, keeping
+      a short preview;
+    * when the history exceeds ``budget_tokens``, every turn but the last
+      ``keep_recent_turns`` is replaced by a model-written summary.
+
+    The chat is then recreated from the compacted history. Token counts come
+    from the token counting endpoint and are cached per message content, so
+    each message is counted once; the need to compact is judged from the
+    usage reported with the previous response, which costs nothing.
+
+    With a ``store`` and ``session_id``, the session is resumed from the
+    store if it exists, the messages of every exchange are appended to it as
+    soon as the exchange completes, and a compacted history replaces the
+    stored one.
+    """
+
+    def __init__(self, client, model=DEFAULT_MODEL, tools=None, history=None, budget_tokens=HISTORY_TOKEN_BUDGET,
+                 keep_recent_turns=KEEP_RECENT_TURNS, max_tool_output_chars=MAX_TOOL_OUTPUT_CHARS,
+                 summary_model=SUMMARY_MODEL, store=None, session_id=None):
+        self.client = client
+        self.model = model
+        self.tools = tools
+        self.budget_tokens = budget_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.max_tool_output_chars = max_tool_output_chars
+        self.summary_model = summary_model
+        self.store = store
+        self.session_id = session_id
+        self.resumed = False
+        if store is not None and history is None and session_id in store:
+            history = store.load(session_id)
+            self.resumed = True
+        self.chat = create_chat(client, model=model, history=history, tools=tools)
+        # Messages of the current history already written to the store.
+        self._persisted = len(history or []) if self.resumed else 0
+        if store is not None and history and not self.resumed:
+            store.replace(session_id, history)
+            self._persisted = len(history)
+        self.last_prompt_tokens = None
+        self.reports = []
+        self._counts = OrderedDict()
+
+    def count_tokens(self, content):
+        """Return the token count of one message, counting it only once.
+
+        Args:
+            content (types.Content): The message.
+
+        Returns:
+            int: The number of tokens.
+        """
+        key = _content_key(content)
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts.move_to_end(key)
+            return count
+
+        try:
+            with span("gemini", "count_tokens"):
+                response = get_scheduler().call(
+                    lambda: self.client.models.count_tokens(model=self.model, contents=[content]),
+                    tokens=0,
+                )
+                count = response.total_tokens or 0
+        except Exception:
+            count = len(content.model_dump_json(exclude_none=True)) // CHARS_PER_TOKEN
+
+        self._counts[key] = count
+        if len(self._counts) > MAX_CACHED_COUNTS:
+            self._counts.popitem(last=False)
+        return count
+
+    def history_tokens(self, history=None):
+        """Return the token count of the whole history.
+
+        Args:
+            history (list[types.Content]): Defaults to the chat's current history.
+
+        Returns:
+            int: The number of tokens.
+        """
+        if history is None:
+            history = self.chat.get_history()
+        return sum(self.count_tokens(content) for content in history)
+
+    def _elide(self, content):
+        """Return ``content`` with bulky function responses replaced by a preview, and the number elided."""
+        parts = []
+        elided = 0
+        for part in content.parts or []:
+            response = part.function_response
+            if response is not None and not (response.response or {}).get("elided"):
+                text = json.dumps(response.response, default=str)
+                if len(text) > self.max_tool_output_chars:
+                    part = part.model_copy(update={"function_response": response.model_copy(update={"response": {
+                        "elided": True,
+                        "original_chars": len(text),
+                        "preview": text[:TOOL_OUTPUT_PREVIEW_CHARS],
+                    }})})
+                    elided += 1
+            parts.append(part)
+        if not elided:
+            return content, 0
+        return content.model_copy(update={"parts": parts}), elided
+
+    def _summarize(self, turns):
+        from google.genai import types
+
+        transcript = '\n\n'.join(_render(content) for turn in turns for content in turn)
+        with span("gemini", "summarize_history", model=self.summary_model):
+            response = get_scheduler().call(
+                lambda: self.client.models.generate_content(model=self.summary_model, contents=SUMMARY_PROMPT + transcript),
+                tokens=estimate_tokens(SUMMARY_PROMPT, transcript),
+            )
+            record_usage(response)
+        return [
+            types.Content(role="user", parts=[types.Part.from_text(
+                text=f"Summary of the earlier conversation:\n{response.text}")]),
+            types.Content(role="model", parts=[types.Part.from_text(text="Understood, I will continue from there.")]),
+        ]
+
+    def compact(self, force=False):
+        """Elide consumed tool outputs and summarize old turns if over budget.
+
+        Args:
+            force (bool): Summarize old turns even if the history is within budget.
+
+        Returns:
+            dict: ``before`` and ``after`` token counts (None if nothing changed),
+            ``elided`` tool outputs and ``summarized_turns``.
+        """
+        history = self.chat.get_history()
+        elided = 0
+        compacted = []
+        for content in history:
+            content, count = self._elide(content)
+            compacted.append(content)
+            elided += count
+
+        turns = _split_turns(compacted)
+        over_budget = self.last_prompt_tokens is not None and self.last_prompt_tokens > self.budget_tokens
+        summarized_turns = 0
+        if (force or over_budget) and len(turns) > self.keep_recent_turns:
+            old, recent = turns[:len(turns) - self.keep_recent_turns], turns[len(turns) - self.keep_recent_turns:]
+            compacted = self._summarize(old) + [content for turn in recent for content in turn]
+            summarized_turns = len(old)
+
+        report = {"before": None, "after": None, "elided": elided, "summarized_turns": summarized_turns}
+        if not elided and not summarized_turns:
+            return report
+
+        report["before"] = self.history_tokens(history)
+        report["after"] = self.history_tokens(compacted)
+        self.chat = create_chat(self.client, model=self.model, history=compacted, tools=self.tools)
+        if self.store is not None:
+            self.store.replace(self.session_id, compacted)
+            self._persisted = len(compacted)
+        self.last_prompt_tokens = report["after"]
+        self.reports.append(report)
+        event("history_compacted", f"Compacted history from {report['before']} to {report['after']} tokens "
+              f"({elided} tool outputs elided, {summarized_turns} turns summarized)", **report)
+        return report
+
+    def send_message(self, message):
+        """Send a message, compacting the history first when a new user turn starts.
+
+        Args:
+            message (str | list[types.Part]): A user message or function responses.
+
+        Returns:
+            types.GenerateContentResponse: The model response.
+        """
+        # Function responses must follow their calls, so only compact between turns.
+        if isinstance(message, str):
+            self.compact()
+
+        response = self.chat.send_message(message)
+        self._track_usage(response)
+        self._persist()
+        return response
+
+    def send_message_stream(self, message):
+        """Streaming flavour of ``send_message``.
+
+        The chat only records the exchange in its history once the stream
+        has been consumed to the end.
+
+        Args:
+            message (str | list[types.Part]): A user message or function responses.
+
+        Yields:
+            types.GenerateContentResponse: The response chunks.
+        """
+        if isinstance(message, str):
+            self.compact()
+
+        for chunk in self.chat.send_message_stream(message):
+            self._track_usage(chunk)
+            yield chunk
+        self._persist()
+
+    def _persist(self):
+        """Append the messages added since the last write to the store."""
+        if self.store is None:
+            return
+        history = self.chat.get_history()
+        self.store.append(self.session_id, history[self._persisted:])
+        self._persisted = len(history)
+
+    def _track_usage(self, response):
+        usage = response.usage_metadata
+        if usage is not None and usage.prompt_token_count is not None:
+            self.last_prompt_tokens = usage.prompt_token_count + (usage.candidates_token_count or 0)
+
+    def get_history(self):
+        """Return the current, possibly compacted, history."""
+        return self.chat.get_history()
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_DIR = ".image_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Entries hold PNG, JPEG, WebP or AVIF bytes, so they get a format-neutral suffix.
+ENTRY_SUFFIX = ".img"
+LEGACY_SUFFIX = ".png"
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents.
+
+    Args:
+        path (str): The file to hash.
+        chunk_size (int): Number of bytes read per chunk.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """Content-addressed on-disk cache of model image outputs.
+
+    Entries are keyed on everything that determines the model output (model
+    name, prompt, dimensions and, for edits, the input image hash) and are
+    evicted least-recently-used once the cache grows past ``max_bytes``.
+    Recency is kept in the file mtimes so it survives process restarts.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(model, prompt, dimensions, input_hash=None, options=None):
+        """Build the cache key for a request.
+
+        Args:
+            model (str): The model name.
+            prompt (str): The text prompt.
+            dimensions (str): The requested dimensions.
+            input_hash (str): SHA-256 of the input image bytes, for modifications.
+            options (str): Anything else that changes the output, e.g. post-processing settings.
+
+        Returns:
+            str: The hex cache key.
+        """
+        digest = hashlib.sha256()
+        fields = (model, prompt, dimensions, input_hash) if options is None else (model, prompt, dimensions, input_hash, options)
+        for field in fields:
+            value = (field or '').encode('utf-8')
+            digest.update(len(value).to_bytes(8, 'big'))
+            digest.update(value)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}{ENTRY_SUFFIX}")
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        found = []
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    key, suffix = os.path.splitext(entry.name)
+                    if suffix == LEGACY_SUFFIX:
+                        # Entries written before ENTRY_SUFFIX existed keep their key.
+                        os.replace(entry.path, self._entry_path(key))
+                    elif suffix != ENTRY_SUFFIX:
+                        continue
+                    st = os.stat(self._entry_path(key))
+                    found.append((st.st_mtime, key, st.st_size))
+
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._total_bytes = sum(self._entries.values())
+
+    def _lookup(self, key):
+        self._load()
+        entry_path = self._entry_path(key)
+
+        if key not in self._entries or not os.path.exists(entry_path):
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            return None
+
+        self._entries.move_to_end(key)
+        os.utime(entry_path)
+        return entry_path
+
+    def get(self, key):
+        """Look up a cached image and mark it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            str: Path to the cached image, or None on a miss.
+        """
+        with self._lock:
+            entry_path = self._lookup(key)
+            if entry_path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry_path
+
+    def materialize(self, key, dst, companions=None):
+        """Place a cached image at ``dst`` without a network call.
+
+        The file is hardlinked when possible and copied otherwise (e.g. across
+        filesystems). An existing ``dst`` is replaced.
+
+        Args:
+            key (str): The cache key.
+            dst (str): The output path.
+            companions (dict): Further ``{key: dst}`` entries that belong to the
+                same request (e.g. a thumbnail). Nothing is placed unless all of
+                them are cached, and the request counts as a single lookup.
+
+        Returns:
+            bool: True on a cache hit, False on a miss.
+        """
+        placements = {key: dst, **(companions or {})}
+        with self._lock:
+            entry_paths = {k: self._lookup(k) for k in placements}
+            if None in entry_paths.values():
+                self.misses += 1
+                return False
+            self.hits += 1
+
+        for k, path in placements.items():
+            self._place(entry_paths[k], path)
+        return True
+
+    @staticmethod
+    def _place(entry_path, dst):
+        # rename() is a no-op when both names are links to the same file, which
+        # would leave the temporary link behind, so skip outputs already in place.
+        try:
+            if os.path.samefile(entry_path, dst):
+                return
+        except OSError:
+            pass
+
+        directory = os.path.dirname(dst) or '.'
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{os.path.basename(dst)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.link(entry_path, tmp_path)
+        except OSError:
+            shutil.copyfile(entry_path, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def put(self, key, src):
+        """Store a copy of ``src`` under ``key`` and evict old entries if needed.
+
+        Args:
+            key (str): The cache key.
+            src (str): The image file to store.
+        """
+        with self._lock:
+            self._load()
+            entry_path = self._entry_path(key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, entry_path)
+
+            size = os.path.getsize(entry_path)
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self.stores += 1
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every cached image."""
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._entries = OrderedDict()
+            self._total_bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Return the process-wide image cache.
+
+    The location and size bound can be set with the ``IMAGE_CACHE_DIR`` and
+    ``IMAGE_CACHE_MAX_BYTES`` environment variables.
+
+    Returns:
+        ImageCache: The shared cache.
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(
+                directory=os.environ.get("IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(os.environ.get("IMAGE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+        return _cache
@@ -1,67 +1,53 @@
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from PIL import Image
-from google import genai
 from google.genai import types
 
-IMAGE_TOOLS = {
-    "open_an_image": {
-        "name": "open_an_image",
-        "description": "Open and read an image file, returning the binary data.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path": {"type": "string", "description": "The file path to the image."}
-            },
-            "required": ["path"]
-        }
+from file_tools import move_file
+from gemini_client import get_client
+from image_cache import get_image_cache, hash_file
+from image_index import record_image
+from image_postprocess import FITS, check_output_format, output_extension, parse_dimensions, postprocess, thumbnail_path
+from image_upload import prepare_image_part
+from instrumentation import event, record, record_usage, span
+from scheduler import BATCH, estimate_tokens, get_scheduler, request_priority
+from tool_cache import get_tool_cache
+from tool_registry import tool, tool_schemas
+
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+# Tokens billed per generated image and per input image, used to reserve rate-limit budget.
+IMAGE_OUTPUT_TOKENS = 1290
+IMAGE_INPUT_TOKENS = 258
+
+# Item schema for generate_images_batch, which docstrings cannot express.
+_IMAGE_SPEC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "prompt": {"type": "string", "description": "The text prompt for this image."},
+        "dimensions": {"type": "string", "description": "The desired dimensions for a generated image (e.g., '512x512')."},
+        "path": {"type": "string", "description": "The directory path to save a generated image."},
+        "name_of_image": {"type": "string", "description": "The name to use for the saved image file (without extension)."},
+        "path_of_the_image_to_modify": {"type": "string", "description": "Path to an existing image; when set the spec is run through modify_image."},
+        "path_to_save_the_image": {"type": "string", "description": "Directory path to save a modified image."},
+        "dimensional_preference": {"type": "string", "description": "Dimensional preferences for a modified image (e.g., '512x512')."},
+        "use_cache": {"type": "boolean", "description": "Reuse a cached result for an identical earlier request."},
+        "max_edge": {"type": "integer", "description": "For modifications, downscale the source so its longest edge is at most this many pixels before upload."},
+        "max_upload_bytes": {"type": "integer", "description": "For modifications, recompress the source until it is at most this many bytes before upload."},
+        "output_format": {"type": "string", "description": "File format of the saved image: 'png', 'jpeg', 'webp' or 'avif'."},
+        "quality": {"type": "integer", "description": "Encoder quality (1-100) for jpeg, webp and avif output."},
+        "fit": {"type": "string", "description": "How to reach the requested dimensions: 'cover' (crop), 'contain', 'stretch' or 'none'."},
+        "thumbnail_size": {"type": "integer", "description": "If set, also save a thumbnail whose longest edge is at most this many pixels."},
+        "stream": {"type": "boolean", "description": "Stream the response, writing the image as soon as it arrives."}
     },
-    "move_the_image": {
-        "name": "move_the_image",
-        "description": "Move an image file from one location to another.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path_before": {"type": "string", "description": "The current file path of the image."},
-                "path_after": {"type": "string", "description": "The new file path where the image should be moved."}
-            },
-            "required": ["path_before", "path_after"]
-        }
-    },
-    "generate_image": {
-        "name": "generate_image",
-        "description": "Generate an image from a text prompt using the Gemini API.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "prompt": {"type": "string", "description": "The text prompt to generate the image from."},
-                "dimensions": {"type": "string", "description": "The desired dimensions for the generated image (e.g., '512x512')."},
-                "path": {"type": "string", "description": "The directory path to save the image. If None or empty, saves to the current working directory."},
-                "name_of_image": {"type": "string", "description": "The name to use for the saved image file (without extension)."}
-            },
-            "required": ["prompt", "dimensions", "path", "name_of_image"]
-        }
-    },
-    "modify_image": {
-        "name": "modify_image",
-        "description": "Modify an existing image based on a text prompt using the Gemini API.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "path_of_the_image_to_modify": {"type": "string", "description": "Path to the image file to be modified."},
-                "path_to_save_the_image": {"type": "string", "description": "Directory path to save the modified image. If None or empty, saves to the current working directory."},
-                "prompt": {"type": "string", "description": "The text prompt describing the modification to apply."},
-                "name_of_image": {"type": "string", "description": "The name to use for the saved modified image file (without extension)."},
-                "dimensional_preference": {"type": "string", "description": "Additional dimensional preferences for the modification (e.g., '512x512')."}
-            },
-            "required": ["path_of_the_image_to_modify", "path_to_save_the_image", "prompt", "name_of_image", "dimensional_preference"]
-        }
-    }
+    "required": ["prompt", "name_of_image"]
 }
 
 
+@tool()
 def open_an_image(path):
-
     """Open and read an image file.
 
     Args:
@@ -82,8 +68,8 @@ def open_an_image(path):
     return image_data
 
 
+@tool()
 def move_the_image(path_before, path_after):
-
     """Move an image file from one location to another.
 
     Args:
@@ -94,241 +80,449 @@ def move_the_image(path_before, path_after):
         FileNotFoundError: If the image file does not exist at the current path.
         OSError: If the destination directory does not exist and cannot be created.
     """
-
     if not os.path.exists(path_before):
         raise FileNotFoundError(f"The file at {path_before} does not exist.")
 
     if not os.path.exists(os.path.dirname(path_after)):
         os.makedirs(os.path.dirname(path_after), exist_ok=True)
 
-    os.rename(path_before, path_after)
-    print(f"Image moved from {path_before} to {path_after}")
+    move_file(path_before, path_after)
 
-def generate_image(prompt, dimensions, path, name_of_image):
 
-    """Generate an image from a text prompt using the Gemini API.
+def _image_save_path(directory, name_of_image, output_format="png"):
+    extension = output_extension(output_format)
+    if not directory:
+        return os.path.join(os.getcwd(), f"{name_of_image}{extension}")
 
-    Args:
-        prompt (str): The text prompt to generate the image from.
-        dimensions (str): The desired dimensions for the generated image (not currently used in the function, but can be used for future extension).
-        path (str): The directory path to save the image. If None or empty, saves to the current working directory.
-        name_of_image (str): The name to use for the saved image file (without extension).
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name_of_image}{extension}")
 
-    Returns:
-        None
 
-    Raises:
-        Exception: If there is an error with the API request or image saving.
-    """
+IMAGE_FORMATS = {
+    ".png": ("PNG", "image/png", b"\x89PNG\r\n\x1a\n"),
+    ".jpg": ("JPEG", "image/jpeg", b"\xff\xd8\xff"),
+    ".jpeg": ("JPEG", "image/jpeg", b"\xff\xd8\xff"),
+    ".webp": ("WEBP", "image/webp", b"RIFF"),
+}
 
-    with open('api_key.txt', 'r') as f:
-        api_key = f.read().strip()
+save_stats = {"direct": 0, "reencoded": 0, "postprocessed": 0}
 
-    client = genai.Client(api_key=api_key)
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=prompt+dimensions,
-        config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
-        )
-    )
+def _response_parts(response):
+    content = response.candidates[0].content if response.candidates else None
+    return (content.parts or []) if content is not None else []
 
-    for part in response.candidates[0].content.parts:
 
-        if part.text is not None:
-            print(part.text)
+def _image_response_parts(client, contents, tokens, stream=True):
+    """Send an image request and yield the parts of the response.
 
-        elif part.inline_data is not None:
-            image = Image.open(BytesIO((part.inline_data.data)))
+    With ``stream``, parts are yielded as they arrive, so text is surfaced
+    and each image can be written while the rest of the response is still
+    in flight. If the stream fails before yielding anything, the request is
+    sent again without streaming.
 
-    if not path:
-        save_path = os.path.join(os.getcwd(), f"{name_of_image}.png")
+    Args:
+        client (genai.Client): The Gemini client.
+        contents (str | list): The request contents.
+        tokens (int): Estimated tokens of the request.
+        stream (bool): Use the streaming endpoint.
 
-    else:
-        os.makedirs(path, exist_ok=True)
-        save_path = os.path.join(path, f"{name_of_image}.png")
+    Yields:
+        types.Part: The response parts.
+    """
+    config = types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+    if stream:
+        yielded = False
+        try:
+            last = None
+            for chunk in get_scheduler().stream(
+                lambda: client.models.generate_content_stream(model=IMAGE_MODEL, contents=contents, config=config),
+                tokens=tokens,
+            ):
+                last = chunk
+                for part in _response_parts(chunk):
+                    yielded = True
+                    if part.inline_data is not None:
+                        record(image_bytes=len(part.inline_data.data or b''))
+                    yield part
+            record_usage(last)
+            return
+        except Exception as e:
+            if yielded:
+                raise
+            event("stream_fallback", f"Streaming failed ({type(e).__name__}: {e}); retrying without streaming", error=type(e).__name__)
+
+    response = get_scheduler().call(
+        lambda: client.models.generate_content(model=IMAGE_MODEL, contents=contents, config=config),
+        tokens=tokens,
+    )
+    record_usage(response)
+    for part in _response_parts(response):
+        if part.inline_data is not None:
+            record(image_bytes=len(part.inline_data.data or b''))
+        yield part
 
-    image.save(save_path)
-    print(f"Image {name_of_image} saved to {save_path}")
 
+def _save_inline_image(inline_data, save_path):
+    """Write model image output to ``save_path``.
 
-def modify_image(path_of_the_image_to_modify, path_to_save_the_image, prompt, name_of_image, dimensional_preference):
-    """Modify an existing image based on a text prompt using the Gemini API.
+    When the payload's MIME type and magic bytes already match the format
+    implied by the file extension, the bytes are written straight to disk;
+    only otherwise is the image decoded and re-encoded with PIL.
 
     Args:
-        path_of_the_image_to_modify (str): Path to the image file to be modified.
-        path_to_save_the_image (str): Directory path to save the modified image. If None or empty, saves to the current working directory.
-        prompt (str): The text prompt describing the modification to apply.
-        name_of_image (str): The name to use for the saved modified image file (without extension).
-        dimensional_preference (str): Additional dimensional preferences for the modification (e.g., '512x512').
+        inline_data (types.Blob): The ``inline_data`` of a response part.
+        save_path (str): The output file path.
 
     Returns:
-        None
+        str: "direct" if the bytes were written as-is, "reencoded" if PIL was used.
+    """
+    pil_format, mime_type, magic = IMAGE_FORMATS[os.path.splitext(save_path)[1].lower()]
+    data = inline_data.data
+
+    # Write to a temporary file and rename it into place, so an output that is
+    # hardlinked from the image cache is replaced rather than overwritten.
+    tmp_path = f"{save_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if inline_data.mime_type == mime_type and data.startswith(magic):
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        mode = "direct"
+    else:
+        image = Image.open(BytesIO(data))
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(tmp_path, format=pil_format)
+        mode = "reencoded"
 
-    Raises:
-        Exception: If there is an error with the API request, image processing, or image saving.
+    os.replace(tmp_path, save_path)
+    get_tool_cache().invalidate(save_path)
+    record(bytes_written=os.path.getsize(save_path))
+    save_stats[mode] += 1
+    return mode
+
+
+def _write_output(inline_data, save_path, dimensions, fit, quality, thumbnail_size):
+    """Save model image output, post-processing it when needed.
+
+    The payload is written as-is when it already has the requested size and
+    format and no quality or thumbnail was asked for; otherwise it is
+    resized, encoded and thumbnailed in the worker pool.
+
+    Returns:
+        str: "direct", "reencoded" or "postprocessed".
     """
-    with open('api_key.txt', 'r') as f:
-        api_key = f.read().strip()
+    size = parse_dimensions(dimensions) if fit != "none" else None
+    if size is not None and Image.open(BytesIO(inline_data.data)).size == size:
+        size = None
 
-    client = genai.Client(api_key=api_key)
+    expected = IMAGE_FORMATS.get(os.path.splitext(save_path)[1].lower())
+    if (size is None and quality is None and not thumbnail_size and expected is not None
+            and inline_data.mime_type == expected[1] and inline_data.data.startswith(expected[2])):
+        return _save_inline_image(inline_data, save_path)
 
-    response = client.models.generate_content(
+    result = postprocess(inline_data.data, save_path, size, fit, quality, thumbnail_size)
+    cache = get_tool_cache()
+    cache.invalidate(save_path)
+    if result["thumbnail_path"]:
+        cache.invalidate(result["thumbnail_path"])
+    record(bytes_written=result["bytes"])
+    save_stats["postprocessed"] += 1
+    return "postprocessed"
 
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=[prompt+dimensional_preference, path_of_the_image_to_modify],
-        config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
-        )
-    )
 
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print(part.text)
+def _output_options(output_format, quality, fit):
+    if fit not in FITS:
+        raise ValueError(f"Unsupported fit {fit!r}; choose from {', '.join(FITS)}.")
+    check_output_format(output_format)
+    return f"{output_format.lower()}:{quality}:{fit}"
 
-        elif part.inline_data is not None:
 
-            image = Image.open(BytesIO(part.inline_data.data))
+def _thumbnail_key(cache, cache_key, thumbnail_size):
+    return cache.make_key(cache_key, "thumbnail", str(thumbnail_size))
 
-            if not path_to_save_the_image:
-                save_path = os.path.join(os.getcwd(), f"{name_of_image}.png")
 
-            else:
-                os.makedirs(path_to_save_the_image, exist_ok=True)
-                save_path = os.path.join(path_to_save_the_image, f"{name_of_image}.png")
+def _materialize_cached(cache, cache_key, save_path, thumbnail_size):
+    """Place a cached output (and its thumbnail, if requested) at ``save_path``.
 
-            image.save(path_to_save_the_image)
-            print(f"Image {name_of_image} saved to {path_to_save_the_image}")
-import os
-from io import BytesIO
-from PIL import Image
-from google import genai
-from google.genai import types
+    Returns:
+        bool: True on a cache hit.
+    """
+    companions = {}
+    if thumbnail_size:
+        companions[_thumbnail_key(cache, cache_key, thumbnail_size)] = thumbnail_path(save_path)
+    if not cache.materialize(cache_key, save_path, companions):
+        return False
 
-def open_an_image(path):
-    """Open and read an image file.
+    get_tool_cache().invalidate(save_path)
+    for path in companions.values():
+        get_tool_cache().invalidate(path)
+    return True
+
+
+def _cache_outputs(cache, cache_key, save_path, thumbnail_size):
+    cache.put(cache_key, save_path)
+    if thumbnail_size:
+        cache.put(_thumbnail_key(cache, cache_key, thumbnail_size), thumbnail_path(save_path))
+
+
+@tool()
+def generate_image(prompt, dimensions, path, name_of_image, use_cache=True, output_format="png", quality=None, fit="cover", thumbnail_size=None,
+                   stream=True):
+    """Generate an image from a text prompt using the Gemini API.
+
+    The model does not reliably honour the requested size, so the output is
+    resized to ``dimensions`` and encoded in ``output_format`` in a worker
+    process (see ``image_postprocess``). Results are cached on disk keyed on
+    the model, prompt, dimensions and output settings, so repeating a request
+    links the cached image into place instead of calling the API again.
 
     Args:
-        path (str): The file path to the image.
+        prompt (str): The text prompt to generate the image from.
+        dimensions (str): The desired dimensions for the generated image (e.g., '512x512'), appended to the prompt.
+        path (str): The directory path to save the image. If None or empty, saves to the current working directory.
+        name_of_image (str): The name to use for the saved image file (without extension).
+        use_cache (bool): Reuse a cached result for an identical earlier request; set to False to force a fresh call.
+        output_format (str): File format of the saved image: 'png', 'jpeg', 'webp' or 'avif'.
+        quality (int): Encoder quality (1-100) for jpeg, webp and avif output; a format default if None.
+        fit (str): How to reach the requested dimensions: 'cover' scales and crops, 'contain' scales to fit inside them, 'stretch' ignores the aspect ratio and 'none' keeps the model's size.
+        thumbnail_size (int): If set, also save a thumbnail whose longest edge is at most this many pixels next to the image.
+        stream (bool): Stream the response, writing the image as soon as it arrives; set to False for a single blocking request.
 
     Returns:
-        bytes: The binary data of the image.
+        str: The path the image was saved to.
 
     Raises:
-        FileNotFoundError: If the image file does not exist at the given path.
+        ValueError: If the output format or fit is not supported.
+        Exception: If there is an error with the API request or image saving.
     """
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"The file at {path} does not exist.")
-
-    with open(path, 'rb') as f:
-        image_data = f.read()
-
-    return image_data
+    save_path = _image_save_path(path, name_of_image, output_format)
+
+    cache = get_image_cache()
+    cache_key = cache.make_key(IMAGE_MODEL, prompt, dimensions, options=_output_options(output_format, quality, fit))
+    if use_cache and _materialize_cached(cache, cache_key, save_path, thumbnail_size):
+        record(cache="hit")
+        record_image(save_path)
+        event("image_cache_hit", f"Image {name_of_image} served from cache to {save_path}", path=save_path)
+        return save_path
+    if use_cache:
+        record(cache="miss")
+
+    client = get_client()
+
+    save_mode = None
+    with span("gemini", "generate_image", model=IMAGE_MODEL, stream=stream):
+        tokens = estimate_tokens(prompt, dimensions) + IMAGE_OUTPUT_TOKENS
+        for part in _image_response_parts(client, prompt+dimensions, tokens, stream):
+            if part.text is not None:
+                event("model_text", part.text)
+            elif part.inline_data is not None:
+                save_mode = _write_output(part.inline_data, save_path, dimensions, fit, quality, thumbnail_size)
+
+    if save_mode is None:
+        raise ValueError(f"The model returned no image for {name_of_image}.")
+
+    if use_cache:
+        _cache_outputs(cache, cache_key, save_path, thumbnail_size)
+
+    record_image(save_path)
+    event("image_saved", f"Image {name_of_image} saved to {save_path} ({save_mode})", path=save_path, mode=save_mode)
+    return save_path
+
+
+@tool()
+def modify_image(path_of_the_image_to_modify, path_to_save_the_image, prompt, name_of_image, dimensional_preference, use_cache=True, max_edge=None, max_upload_bytes=None,
+                 output_format="png", quality=None, fit="cover", thumbnail_size=None, stream=True):
+    """Modify an existing image based on a text prompt using the Gemini API.
 
-def move_the_image(path_before, path_after):
-    """Move an image file from one location to another.
+    The source image's pixels are sent with the prompt, optionally downscaled
+    and recompressed first (see ``image_upload.prepare_image_part``). The
+    output is post-processed like ``generate_image``'s, using the size in
+    ``dimensional_preference`` if it names one. Results are cached on disk
+    keyed on the model, prompt, dimensional preference, output settings and a
+    hash of the input image bytes.
 
     Args:
-        path_before (str): The current file path of the image.
-        path_after (str): The new file path where the image should be moved.
+        path_of_the_image_to_modify (str): Path to the image file to be modified.
+        path_to_save_the_image (str): Directory path to save the modified image. If None or empty, saves to the current working directory.
+        prompt (str): The text prompt describing the modification to apply.
+        name_of_image (str): The name to use for the saved modified image file (without extension).
+        dimensional_preference (str): Additional dimensional preferences for the modification (e.g., '512x512').
+        use_cache (bool): Reuse a cached result for an identical earlier request; set to False to force a fresh call.
+        max_edge (int): If set, downscale the source so its longest edge is at most this many pixels before upload.
+        max_upload_bytes (int): If set, recompress the source until it is at most this many bytes before upload.
+        output_format (str): File format of the saved image: 'png', 'jpeg', 'webp' or 'avif'.
+        quality (int): Encoder quality (1-100) for jpeg, webp and avif output; a format default if None.
+        fit (str): How to reach the preferred dimensions: 'cover' scales and crops, 'contain' scales to fit inside them, 'stretch' ignores the aspect ratio and 'none' keeps the model's size.
+        thumbnail_size (int): If set, also save a thumbnail whose longest edge is at most this many pixels next to the image.
+        stream (bool): Stream the response, writing the image as soon as it arrives; set to False for a single blocking request.
+
+    Returns:
+        str: The path the modified image was saved to.
 
     Raises:
-        FileNotFoundError: If the image file does not exist at the current path.
-        OSError: If the destination directory does not exist and cannot be created.
+        ValueError: If the output format or fit is not supported, or the model returned no image.
+        Exception: If there is an error with the API request, image processing, or image saving.
     """
-    if not os.path.exists(path_before):
-        raise FileNotFoundError(f"The file at {path_before} does not exist.")
+    if not os.path.exists(path_of_the_image_to_modify):
+        raise FileNotFoundError(f"The file at {path_of_the_image_to_modify} does not exist.")
+
+    options = _output_options(output_format, quality, fit)
+    input_hash = hash_file(path_of_the_image_to_modify)
+
+    save_path = _image_save_path(path_to_save_the_image, name_of_image, output_format)
+    cache = get_image_cache()
+    cache_key = None
+    if use_cache:
+        cache_key = cache.make_key(IMAGE_MODEL, prompt, dimensional_preference, f"{input_hash}:{max_edge}:{max_upload_bytes}", options)
+        if _materialize_cached(cache, cache_key, save_path, thumbnail_size):
+            record(cache="hit")
+            record_image(save_path)
+            event("image_cache_hit", f"Image {name_of_image} served from cache to {save_path}", path=save_path)
+            return save_path
+        record(cache="miss")
+
+    image_part = prepare_image_part(path_of_the_image_to_modify, max_edge, max_upload_bytes, content_hash=input_hash)
+
+    client = get_client()
+
+    save_mode = None
+    with span("gemini", "modify_image", model=IMAGE_MODEL, stream=stream):
+        tokens = estimate_tokens(prompt, dimensional_preference) + IMAGE_INPUT_TOKENS + IMAGE_OUTPUT_TOKENS
+        for part in _image_response_parts(client, [prompt+dimensional_preference, image_part], tokens, stream):
+            if part.text is not None:
+                event("model_text", part.text)
+            elif part.inline_data is not None:
+                save_mode = _write_output(part.inline_data, save_path, dimensional_preference, fit, quality, thumbnail_size)
+
+    if save_mode is None:
+        raise ValueError(f"The model returned no image for {name_of_image}.")
+
+    if cache_key is not None:
+        _cache_outputs(cache, cache_key, save_path, thumbnail_size)
+
+    record_image(save_path)
+    event("image_saved", f"Image {name_of_image} saved to {save_path} ({save_mode})", path=save_path, mode=save_mode)
+    return save_path
+
+
+def _run_image_spec(spec):
+    # Batch jobs yield to interactive chat requests in the scheduler queue.
+    with request_priority(BATCH):
+        return _run_image_spec_now(spec)
+
+
+def _run_image_spec_now(spec):
+    if spec.get("path_of_the_image_to_modify"):
+        return modify_image(
+            spec["path_of_the_image_to_modify"],
+            spec.get("path_to_save_the_image", ""),
+            spec["prompt"],
+            spec["name_of_image"],
+            spec.get("dimensional_preference", ""),
+            use_cache=spec.get("use_cache", True),
+            max_edge=spec.get("max_edge"),
+            max_upload_bytes=spec.get("max_upload_bytes"),
+            **_output_settings(spec),
+        )
 
-    if not os.path.exists(os.path.dirname(path_after)):
-        os.makedirs(os.path.dirname(path_after), exist_ok=True)
+    return generate_image(
+        spec["prompt"],
+        spec.get("dimensions", ""),
+        spec.get("path", ""),
+        spec["name_of_image"],
+        use_cache=spec.get("use_cache", True),
+        **_output_settings(spec),
+    )
 
-    os.rename(path_before, path_after)
-    print(f"Image moved from {path_before} to {path_after}")
 
-def generate_image(prompt, dimensions, path, name_of_image):
-    """Generate an image from a text prompt using the Gemini API.
+def _output_settings(spec):
+    return {key: spec[key] for key in ("output_format", "quality", "fit", "thumbnail_size", "stream") if spec.get(key) is not None}
+
+
+def _image_spec_result(index, spec, save_path=None, error=None):
+    return {
+        "index": index,
+        "name_of_image": spec.get("name_of_image"),
+        "ok": error is None,
+        "path": save_path,
+        "error": None if error is None else f"{type(error).__name__}: {error}",
+    }
+
+
+@tool(
+    description="Generate or modify many images in one call, running the requests concurrently. Each spec takes the arguments of generate_image, or of modify_image when it includes path_of_the_image_to_modify.",
+    specs={"items": _IMAGE_SPEC_SCHEMA},
+)
+def generate_images_batch(specs, max_concurrency=4):
+    """Generate or modify many images concurrently.
+
+    Each spec is a dict with the arguments of ``generate_image``; specs that
+    contain ``path_of_the_image_to_modify`` are run through ``modify_image``
+    instead. Every image is written to disk as soon as its request completes,
+    and a failing spec does not stop the rest of the batch.
 
     Args:
-        prompt (str): The text prompt to generate the image from.
-        dimensions (str): The desired dimensions for the generated image (not currently used in the function, but can be used for future extension).
-        path (str): The directory path to save the image. If None or empty, saves to the current working directory.
-        name_of_image (str): The name to use for the saved image file (without extension).
+        specs (list[dict]): The images to produce.
+        max_concurrency (int): Maximum number of requests in flight at once.
 
     Returns:
-        None
+        list[dict]: One result per spec, in input order, with ``index``, ``name_of_image``,
+        ``ok``, ``path`` and ``error`` keys.
 
     Raises:
-        Exception: If there is an error with the API request or image saving.
+        ValueError: If max_concurrency is less than 1.
     """
-    with open('api_key.txt', 'r') as f:
-        api_key = f.read().strip()
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1.")
 
-    client = genai.Client(api_key=api_key)
+    def run(index, spec):
+        try:
+            return _image_spec_result(index, spec, save_path=_run_image_spec(spec))
+        except Exception as e:
+            return _image_spec_result(index, spec, error=e)
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=prompt+dimensions,
-        config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
-        )
-    )
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, max(len(specs), 1))) as pool:
+        results = list(pool.map(run, range(len(specs)), specs))
 
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print(part.text)
-        elif part.inline_data is not None:
-            image = Image.open(BytesIO((part.inline_data.data)))
+    succeeded = sum(1 for result in results if result["ok"])
+    event("image_batch_finished", f"Batch finished: {succeeded}/{len(specs)} images saved", succeeded=succeeded, total=len(specs))
+    return results
 
-    if not path:
-        save_path = os.path.join(os.getcwd(), f"{name_of_image}.png")
-    else:
-        os.makedirs(path, exist_ok=True)
-        save_path = os.path.join(path, f"{name_of_image}.png")
 
-    image.save(save_path)
-    print(f"Image {name_of_image} saved to {save_path}")
+async def agenerate_images_batch(specs, max_concurrency=4):
+    """Asyncio flavour of ``generate_images_batch``.
 
-def modify_image(path_of_the_image_to_modify, path_to_save_the_image, prompt, name_of_image, dimensional_preference):
-    """Modify an existing image based on a text prompt using the Gemini API.
+    The blocking requests run on worker threads, with an ``asyncio.Semaphore``
+    bounding how many are in flight, so the event loop stays responsive.
 
     Args:
-        path_of_the_image_to_modify (str): Path to the image file to be modified.
-        path_to_save_the_image (str): Directory path to save the modified image. If None or empty, saves to the current working directory.
-        prompt (str): The text prompt describing the modification to apply.
-        name_of_image (str): The name to use for the saved modified image file (without extension).
-        dimensional_preference (str): Additional dimensional preferences for the modification (e.g., '512x512').
+        specs (list[dict]): The images to produce.
+        max_concurrency (int): Maximum number of requests in flight at once.
 
     Returns:
-        None
+        list[dict]: One result per spec, in input order (see ``generate_images_batch``).
 
     Raises:
-        Exception: If there is an error with the API request, image processing, or image saving.
+        ValueError: If max_concurrency is less than 1.
     """
-    with open('api_key.txt', 'r') as f:
-        api_key = f.read().strip()
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1.")
 
-    client = genai.Client(api_key=api_key)
+    semaphore = asyncio.Semaphore(max_concurrency)
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-preview-image-generation",
-        contents=[prompt+dimensional_preference, path_of_the_image_to_modify],
-        config=types.GenerateContentConfig(
-            response_modalities=['TEXT', 'IMAGE']
-        )
-    )
+    async def run(index, spec):
+        async with semaphore:
+            try:
+                save_path = await asyncio.to_thread(_run_image_spec, spec)
+                return _image_spec_result(index, spec, save_path=save_path)
+            except Exception as e:
+                return _image_spec_result(index, spec, error=e)
+
+    results = await asyncio.gather(*(run(index, spec) for index, spec in enumerate(specs)))
 
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print(part.text)
-        elif part.inline_data is not None:
-            image = Image.open(BytesIO(part.inline_data.data))
+    succeeded = sum(1 for result in results if result["ok"])
+    event("image_batch_finished", f"Batch finished: {succeeded}/{len(specs)} images saved", succeeded=succeeded, total=len(specs))
+    return list(results)
 
-            if not path_to_save_the_image:
-                save_path = os.path.join(os.getcwd(), f"{name_of_image}.png")
-            else:
-                os.makedirs(path_to_save_the_image, exist_ok=True)
-                save_path = os.path.join(path_to_save_the_image, f"{name_of_image}.png")
 
-            image.save(save_path)
-            print(f"Image {name_of_image} saved to {save_path}")
+IMAGE_TOOLS = tool_schemas(__name__)
@@ -0,0 +1,553 @@
+import hashlib
+import json
+import os
+import threading
+
+from image_cache import hash_file
+from image_postprocess import THUMBNAIL_SUFFIX
+from instrumentation import event
+from search_index import add_state_directory, exclude_matcher
+from tool_registry import tool, tool_schemas
+
+
+# Every index is kept here, one journal per indexed root, never in the image directories themselves.
+DEFAULT_INDEX_DIR = ".image_index"
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".avif"}
+# Thumbnails are near-duplicates of their image by design, so they are left out.
+DEFAULT_EXCLUDES = [".git/", "node_modules/", "__pycache__/", ".venv/", "venv/", ".image_cache/", ".sessions/",
+                    f"*{THUMBNAIL_SUFFIX}.*"]
+# Images are shrunk to DCT_SIZE x DCT_SIZE grey levels; the hash keeps the signs
+# of the lowest HASH_SIZE x HASH_SIZE frequencies relative to their median.
+DCT_SIZE = 32
+HASH_SIZE = 8
+# Images decoded before their hashes are computed together.
+HASH_BATCH = 64
+# Hamming distance (out of 64 bits) up to which two images count as near-duplicates.
+DEFAULT_MAX_DISTANCE = 6
+# Rows of the pairwise distance matrix computed at once.
+DISTANCE_CHUNK = 256
+# The journal is rewritten once it holds this many times more records than live entries.
+COMPACT_RATIO = 2
+MIN_COMPACT_RECORDS = 256
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_dct = None
+
+
+def index_directory():
+    """Return the directory journals are stored in (``IMAGE_INDEX_DIR``, by default ``.image_index``)."""
+    return os.path.abspath(os.environ.get("IMAGE_INDEX_DIR", DEFAULT_INDEX_DIR))
+
+
+add_state_directory(index_directory())
+
+
+def _dct_rows():
+    """Return the first HASH_SIZE rows of the orthonormal DCT-II matrix of size DCT_SIZE."""
+    global _dct
+
+    if _dct is None:
+        import numpy as np
+
+        k = np.arange(HASH_SIZE)[:, None]
+        n = np.arange(DCT_SIZE)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * DCT_SIZE)) * np.sqrt(2 / DCT_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct = matrix.astype(np.float32)
+    return _dct
+
+
+def perceptual_hashes(pixels):
+    """Compute the DCT perceptual hashes of a batch of images.
+
+    Args:
+        pixels (numpy.ndarray): Grey levels of shape ``(n, DCT_SIZE, DCT_SIZE)``.
+
+    Returns:
+        numpy.ndarray: ``n`` 64-bit hashes as ``uint64``.
+    """
+    import numpy as np
+
+    dct = _dct_rows()
+    # Only the low frequencies are needed: D[:8] @ X @ D[:8].T for every image at once.
+    low = (dct @ np.asarray(pixels, dtype=np.float32) @ dct.T).reshape(len(pixels), HASH_SIZE * HASH_SIZE)
+    # The DC term says nothing about structure and would skew the median.
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def hamming_distances(hashes, other):
+    """Return the Hamming distances between ``hashes`` (an array) and ``other`` (a hash or array)."""
+    import numpy as np
+
+    return np.bitwise_count(np.bitwise_xor(hashes, other))
+
+
+def _read_image(path):
+    """Return an image's metadata and its grey levels shrunk to DCT_SIZE x DCT_SIZE."""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as image:
+        metadata = {"format": image.format, "width": image.width, "height": image.height, "mode": image.mode}
+        # Lets JPEG decode at a fraction of its size; other formats ignore it.
+        image.draft("L", (DCT_SIZE * 4, DCT_SIZE * 4))
+        grey = image.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.Resampling.BOX)
+        return metadata, np.asarray(grey, dtype=np.float32)
+
+
+def _describe(path, st, rel_path, same_content=None):
+    """Return a new index entry for an image, still without its hash, and its grey levels.
+
+    Unreadable files get an entry with an ``error`` instead of metadata, so
+    they are not retried until they change.
+
+    Args:
+        same_content (dict): Maps SHA-256 digests to entries already indexed;
+            a file with the same bytes copies its metadata instead of being decoded.
+
+    Raises:
+        FileNotFoundError: If the file disappeared.
+    """
+    record = {"path": rel_path, "mtime_ns": st.st_mtime_ns, "size": st.st_size, "phash": None}
+    try:
+        record["sha256"] = hash_file(path)
+        known = (same_content or {}).get(record["sha256"])
+        if known is not None:
+            record.update({key: known[key] for key in ("format", "width", "height", "mode", "phash")})
+            return record, None
+        metadata, grey = _read_image(path)
+    except (OSError, ValueError) as e:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"The file at {path} does not exist.") from None
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record, None
+    record.update(metadata)
+    return record, grey
+
+
+def _hash_batch(records):
+    """Fill in the ``phash`` of ``(entry, grey levels)`` pairs with one vectorised computation."""
+    import numpy as np
+
+    decoded = [(record, grey) for record, grey in records if grey is not None]
+    if decoded:
+        hashes = perceptual_hashes(np.stack([grey for _, grey in decoded]))
+        for (record, _), value in zip(decoded, hashes):
+            record["phash"] = f"{int(value):016x}"
+
+
+class ImageIndex:
+    """Persistent index of the images under a root directory.
+
+    For every image the index stores its mtime, byte size, format,
+    dimensions, mode, SHA-256 digest and 64-bit DCT perceptual hash, so
+    metadata and duplicate lookups never decode an image twice. ``refresh``
+    re-indexes only images whose mtime or size changed; hashes are computed
+    for ``HASH_BATCH`` images at a time with NumPy.
+
+    The index is an append-only journal of JSON lines, one per indexed or
+    removed image, so each change costs one small write. It is rewritten
+    when it holds many superseded records. Journals live in one directory
+    (``IMAGE_INDEX_DIR``, by default ``.image_index`` in the working
+    directory), named after a hash of the root.
+    """
+
+    def __init__(self, root, index_path=None, exclude=None):
+        self.root = os.path.abspath(root)
+        if index_path is None:
+            name = hashlib.sha256(self.root.encode('utf-8')).hexdigest()[:32]
+            index_path = os.path.join(index_directory(), f"{name}.jsonl")
+        self.index_path = os.path.abspath(index_path)
+        add_state_directory(os.path.dirname(self.index_path))
+        self.is_excluded = exclude_matcher(self.root, DEFAULT_EXCLUDES if exclude is None else exclude)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._records = 0
+        self._has_header = False
+        # (paths, hashes) of the hashed entries, rebuilt after a change.
+        self._hash_table = None
+        # SHA-256 -> a decoded entry with those bytes.
+        self._by_content = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+
+        lines = data.split(b'\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        if header.get("version") != INDEX_VERSION or header.get("root") != self.root:
+            return
+
+        self._has_header = True
+        offset = len(lines[0]) + 1
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            offset += len(line) + 1
+            self._apply(record)
+            self._records += 1
+
+        if offset < len(data):
+            # Drop a record torn by a crash, so the next append starts on a fresh line.
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(offset)
+
+    def _apply(self, record):
+        old = self.entries.pop(record["path"], None)
+        if old is not None and self._by_content.get(old.get("sha256")) is old:
+            del self._by_content[old["sha256"]]
+        if not record.get("deleted"):
+            self.entries[record["path"]] = record
+            if record.get("phash"):
+                self._by_content.setdefault(record["sha256"], record)
+        self._hash_table = None
+
+    def _append(self, records):
+        if not records:
+            return
+        for record in records:
+            self._apply(record)
+        if not self._has_header:
+            self._rewrite()
+            return
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+        self._records += len(records)
+        if self._records > max(MIN_COMPACT_RECORDS, COMPACT_RATIO * len(self.entries)):
+            self._rewrite()
+
+    def _rewrite(self):
+        """Write the live entries to a fresh journal atomically."""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"version": INDEX_VERSION, "root": self.root}) + '\n')
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.index_path)
+        self._records = len(self.entries)
+        self._has_header = True
+
+    def _rel_path(self, path):
+        """Return the path relative to the root, or None if it is outside the root or excluded."""
+        rel_path = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+        if rel_path.startswith('../') or rel_path in ('.', '..'):
+            return None
+        parts = rel_path.split('/')
+        for i in range(1, len(parts)):
+            if self.is_excluded('/'.join(parts[:i]), True):
+                return None
+        if self.is_excluded(rel_path, False):
+            return None
+        return rel_path
+
+    def _walk(self):
+        stack = [(self.root, '')]
+        while stack:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            for entry in entries:
+                rel_path = f"{rel_dir}{entry.name}"
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if self.is_excluded(rel_path, is_dir):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rel_path + '/'))
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file(follow_symlinks=False):
+                    yield rel_path, entry
+
+    def _fresh(self, rel_path, st):
+        entry = self.entries.get(rel_path)
+        return entry is not None and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size
+
+    def _index(self, files):
+        """Decode and hash ``(rel_path, stat)`` pairs in batches and journal their entries."""
+        for start in range(0, len(files), HASH_BATCH):
+            records = []
+            for rel_path, st in files[start:start + HASH_BATCH]:
+                path = os.path.join(self.root, rel_path)
+                try:
+                    records.append(_describe(path, st, rel_path, self._by_content))
+                except FileNotFoundError:
+                    continue
+            _hash_batch(records)
+            self._append([record for record, _ in records])
+
+    def refresh(self):
+        """Bring the index up to date with the images on disk.
+
+        Returns:
+            dict: Counts of ``added``, ``updated`` and ``removed`` images.
+        """
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        with self.lock:
+            seen = set()
+            stale = []
+            for rel_path, entry in self._walk():
+                seen.add(rel_path)
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if not self._fresh(rel_path, st):
+                    counts["updated" if rel_path in self.entries else "added"] += 1
+                    stale.append((rel_path, st))
+
+            self._index(stale)
+            removed = [{"path": rel_path, "deleted": True} for rel_path in self.entries if rel_path not in seen]
+            self._append(removed)
+            counts["removed"] = len(removed)
+        return counts
+
+    def add(self, path):
+        """Index one image now, e.g. right after it was written.
+
+        Args:
+            path (str): The image path.
+
+        Returns:
+            dict: The image's entry, or None if the path is outside the root or excluded.
+
+        Raises:
+            FileNotFoundError: If the image does not exist.
+        """
+        rel_path = self._rel_path(path)
+        if rel_path is None:
+            return None
+        st = os.stat(os.path.join(self.root, rel_path))
+        with self.lock:
+            if not self._fresh(rel_path, st):
+                self._index([(rel_path, st)])
+            return self.entries.get(rel_path)
+
+    def _hashes(self):
+        import numpy as np
+
+        if self._hash_table is None:
+            paths = sorted(rel_path for rel_path, entry in self.entries.items() if entry.get("phash"))
+            hashes = np.array([int(self.entries[rel_path]["phash"], 16) for rel_path in paths], dtype=np.uint64)
+            self._hash_table = (paths, hashes)
+        return self._hash_table
+
+    def _summary(self, rel_path, distance=None):
+        entry = self.entries[rel_path]
+        summary = {key: entry.get(key) for key in ("path", "format", "width", "height", "size")}
+        if distance is not None:
+            summary["distance"] = distance
+            summary["exact"] = False
+        return summary
+
+    def similar(self, path, max_distance=DEFAULT_MAX_DISTANCE):
+        """Return the indexed images that look like one image.
+
+        Args:
+            path (str): The image to compare; indexed first if needed.
+            max_distance (int): Largest Hamming distance between perceptual hashes to report.
+
+        Returns:
+            list[dict]: The matches, closest first, with ``distance`` and ``exact``
+            (identical bytes) besides their metadata.
+
+        Raises:
+            FileNotFoundError: If the image does not exist.
+            ValueError: If the path is outside the root or not a readable image.
+        """
+        entry = self.add(path)
+        if entry is None:
+            raise ValueError(f"{path} is not under {self.root} or is excluded from the index.")
+        if not entry.get("phash"):
+            raise ValueError(f"{path} is not a readable image: {entry.get('error')}")
+
+        with self.lock:
+            paths, hashes = self._hashes()
+            distances = hamming_distances(hashes, int(entry["phash"], 16))
+            matches = []
+            for i in distances.argsort(kind='stable'):
+                if distances[i] > max_distance:
+                    break
+                if paths[i] == entry["path"]:
+                    continue
+                match = self._summary(paths[i], int(distances[i]))
+                match["exact"] = self.entries[paths[i]].get("sha256") == entry.get("sha256")
+                matches.append(match)
+        return matches
+
+    def duplicate_groups(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """Group the indexed images into sets of duplicates and near-duplicates.
+
+        Images are linked when their perceptual hashes are within
+        ``max_distance`` bits, and groups are the connected sets of links.
+
+        Args:
+            max_distance (int): Largest Hamming distance between linked images.
+
+        Returns:
+            list[dict]: Groups of two or more images, the most wasteful first, each with
+            ``images`` (largest first), ``exact`` (all identical bytes) and
+            ``wasted_bytes`` (the bytes freed by keeping only the largest image).
+        """
+        import numpy as np
+
+        with self.lock:
+            paths, hashes = self._hashes()
+            parent = list(range(len(paths)))
+
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]
+                    i = parent[i]
+                return i
+
+            for start in range(0, len(paths), DISTANCE_CHUNK):
+                block = hamming_distances(hashes[start:start + DISTANCE_CHUNK, None], hashes[None, :])
+                rows, cols = np.nonzero(block <= max_distance)
+                for row, col in zip(rows.tolist(), cols.tolist()):
+                    if start + row < col:
+                        parent[find(start + row)] = find(col)
+
+            members = {}
+            for i in range(len(paths)):
+                members.setdefault(find(i), []).append(paths[i])
+
+            groups = []
+            for group in members.values():
+                if len(group) < 2:
+                    continue
+                images = sorted((self._summary(rel_path) for rel_path in group), key=lambda image: -image["size"])
+                groups.append({
+                    "images": images,
+                    "exact": len({self.entries[rel_path].get("sha256") for rel_path in group}) == 1,
+                    "wasted_bytes": sum(image["size"] for image in images[1:]),
+                })
+        return sorted(groups, key=lambda group: -group["wasted_bytes"])
+
+    def metadata(self, path):
+        """Return an image's indexed entry, indexing it first if it is new or changed.
+
+        Raises:
+            FileNotFoundError: If the image does not exist.
+            ValueError: If the path is outside the root or excluded.
+        """
+        entry = self.add(path)
+        if entry is None:
+            raise ValueError(f"{path} is not under {self.root} or is excluded from the index.")
+        return dict(entry)
+
+
+def get_image_index(root, exclude=None):
+    """Return the shared image index for ``root``, loading it from disk on first use.
+
+    Args:
+        root (str): The directory to index.
+        exclude (list[str]): Gitignore-style patterns to skip; defaults to ``DEFAULT_EXCLUDES``.
+
+    Returns:
+        ImageIndex: The index.
+    """
+    key = (os.path.abspath(root), tuple(exclude) if exclude is not None else None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ImageIndex(root, exclude=exclude)
+        return index
+
+
+def _index_for(path):
+    """Return the loaded index with the deepest root covering ``path``, or the index of its directory."""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        covering = [index for index in _indexes.values() if path.startswith(index.root + os.sep)]
+    if covering:
+        return max(covering, key=lambda index: len(index.root))
+    return get_image_index(os.path.dirname(path))
+
+
+def record_image(path):
+    """Add a newly saved image to the image index; failures are reported, not raised.
+
+    Args:
+        path (str): The saved image.
+    """
+    try:
+        _index_for(path).add(path)
+    except (OSError, ValueError) as e:
+        event("image_index_failed", f"Could not index {path}: {e}", path=path)
+
+
+@tool(description="Find duplicate and near-duplicate images under a directory, or the images that look like a given image, using a persistent index of perceptual hashes.")
+def find_duplicate_images(path='.', image=None, max_distance=DEFAULT_MAX_DISTANCE):
+    """Find duplicate and near-duplicate images.
+
+    The index under ``path`` is refreshed incrementally from file mtimes, so
+    only new or changed images are decoded.
+
+    Args:
+        path (str): The directory to search.
+        image (str): Only list the images that look like this one.
+        max_distance (int): How different two images may be, as the number of differing bits of their 64-bit perceptual hashes; 0 finds only visually identical images.
+
+    Returns:
+        dict: With ``image``, ``matches`` (closest first, each with ``distance`` and ``exact``);
+        otherwise ``groups`` of similar images (largest first) with ``exact`` and ``wasted_bytes``.
+        Paths are relative to ``path``.
+
+    Raises:
+        NotADirectoryError: If the path is not a directory.
+        FileNotFoundError: If ``image`` does not exist.
+        ValueError: If ``image`` is outside ``path`` or not a readable image.
+    """
+    if not os.path.isdir(path):
+        raise NotADirectoryError(f"{path} is not a directory.")
+    index = get_image_index(path)
+    index.refresh()
+    if image is not None:
+        return {"image": image, "matches": index.similar(image, max_distance)}
+    return {"groups": index.duplicate_groups(max_distance)}
+
+
+@tool(description="Return an image's format, dimensions, color mode, byte size, SHA-256 and perceptual hash without reading its bytes into the conversation.")
+def get_image_metadata(path):
+    """Return the metadata of an image, from the image index when it is up to date.
+
+    Args:
+        path (str): The image file.
+
+    Returns:
+        dict: ``path``, ``format``, ``width``, ``height``, ``mode``, ``size``, ``sha256`` and ``phash``
+        (or ``error`` if the file is not a readable image).
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"The file at {path} does not exist.")
+    try:
+        entry = _index_for(path).metadata(path)
+    except ValueError:
+        # Excluded from the index (e.g. a thumbnail); describe it without recording it.
+        records = [_describe(path, os.stat(path), path)]
+        _hash_batch(records)
+        entry = records[0][0]
+    entry.pop("mtime_ns", None)
+    entry["path"] = path
+    return entry
+
+
+IMAGE_INDEX_TOOLS = tool_schemas(__name__)
@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+
+# Output format name -> (file extension, PIL format).
+OUTPUT_FORMATS = {
+    "png": (".png", "PNG"),
+    "jpeg": (".jpg", "JPEG"),
+    "jpg": (".jpg", "JPEG"),
+    "webp": (".webp", "WEBP"),
+    "avif": (".avif", "AVIF"),
+}
+FITS = ("cover", "contain", "stretch", "none")
+DEFAULT_QUALITY = {"JPEG": 85, "WEBP": 80, "AVIF": 60}
+THUMBNAIL_SUFFIX = ".thumb"
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_dimensions(text):
+    """Extract a target size from a free-form dimensions string.
+
+    Accepts forms such as ``"512x512"``, ``"1024 X 768 pixels"`` or ``"256"``
+    (a square).
+
+    Args:
+        text (str): The dimensions or dimensional preference given by the caller.
+
+    Returns:
+        tuple[int, int] | None: (width, height), or None if no size can be read.
+    """
+    if not text:
+        return None
+    match = re.search(r'(\d+)\s*[x×*]\s*(\d+)', text, re.IGNORECASE)
+    if match:
+        width, height = int(match.group(1)), int(match.group(2))
+    else:
+        match = re.fullmatch(r'\s*(\d+)\s*(?:px|pixels)?\s*', text, re.IGNORECASE)
+        if not match:
+            return None
+        width = height = int(match.group(1))
+    if not width or not height:
+        return None
+    return width, height
+
+
+def output_extension(output_format):
+    """Return the file extension for an output format name.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    try:
+        return OUTPUT_FORMATS[output_format.lower()][0]
+    except KeyError:
+        raise ValueError(f"Unsupported output format {output_format!r}; choose from {', '.join(OUTPUT_FORMATS)}.") from None
+
+
+def check_output_format(output_format):
+    """Fail early if an output format cannot be written by this installation.
+
+    Raises:
+        ValueError: If the format is unknown or its encoder is not available.
+    """
+    output_extension(output_format)
+    _check_encoder(OUTPUT_FORMATS[output_format.lower()][1])
+
+
+def thumbnail_path(save_path):
+    """Return the path of the thumbnail written next to ``save_path``."""
+    stem, extension = os.path.splitext(save_path)
+    return f"{stem}{THUMBNAIL_SUFFIX}{extension}"
+
+
+def _pil_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    for ext, pil_format in OUTPUT_FORMATS.values():
+        if ext == extension or (extension == ".jpeg" and pil_format == "JPEG"):
+            return pil_format
+    raise ValueError(f"Unsupported output extension {extension!r}.")
+
+
+def _check_encoder(pil_format):
+    if pil_format != "AVIF":
+        return
+    from PIL import features
+
+    if not features.check("avif"):
+        try:
+            import pillow_avif  # noqa: F401  (registers the AVIF plugin on older Pillow)
+        except ImportError:
+            raise ValueError("AVIF output needs Pillow built with AVIF support or the pillow-avif-plugin package.") from None
+
+
+def _encode(image, path, quality):
+    pil_format = _pil_format(path)
+    _check_encoder(pil_format)
+
+    options = {}
+    if pil_format in DEFAULT_QUALITY:
+        options["quality"] = quality or DEFAULT_QUALITY[pil_format]
+    if pil_format == "JPEG":
+        options.update(optimize=True, progressive=True)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+    elif pil_format == "WEBP":
+        options["method"] = 4
+
+    # Batch jobs may encode in threads of one process, so the name is unique per thread too.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        image.save(tmp_path, format=pil_format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+def process_image(data, save_path, size=None, fit="cover", quality=None, thumbnail_size=None):
+    """Resize and encode image bytes, writing the result (and a thumbnail) to disk.
+
+    Runs in a worker process; only the encoded input and a small result dict
+    cross the process boundary.
+
+    Args:
+        data (bytes): The encoded source image.
+        save_path (str): The output path; its extension selects the format.
+        size (tuple[int, int]): Target (width, height), or None to keep the source size.
+        fit (str): "cover" scales and center-crops to exactly ``size``, "contain" scales to fit
+            inside it, "stretch" ignores the aspect ratio and "none" keeps the source size.
+        quality (int): Encoder quality for JPEG, WebP and AVIF (1-100); a format default if None.
+        thumbnail_size (int): If set, also write a thumbnail whose longest edge is at most this many pixels.
+
+    Returns:
+        dict: ``path``, ``width``, ``height``, ``bytes`` and ``thumbnail_path`` (or None).
+
+    Raises:
+        ValueError: If ``fit`` or the output format is not supported.
+    """
+    from PIL import Image, ImageOps
+
+    if fit not in FITS:
+        raise ValueError(f"Unsupported fit {fit!r}; choose from {', '.join(FITS)}.")
+
+    image = Image.open(BytesIO(data))
+    image.load()
+
+    if size is not None and fit != "none" and image.size != tuple(size):
+        if fit == "cover":
+            image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+        elif fit == "contain":
+            image = ImageOps.contain(image, size, Image.Resampling.LANCZOS)
+        else:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+
+    written = _encode(image, save_path, quality)
+
+    thumb_path = None
+    if thumbnail_size:
+        thumb = image.copy()
+        thumb.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        thumb_path = thumbnail_path(save_path)
+        _encode(thumb, thumb_path, quality)
+
+    return {
+        "path": save_path,
+        "width": image.width,
+        "height": image.height,
+        "bytes": written,
+        "thumbnail_path": thumb_path,
+    }
+
+
+def get_process_pool():
+    """Return the shared worker pool for image encoding, or None if disabled.
+
+    Encoding is CPU-bound and holds the GIL, so it runs in separate processes
+    to keep the agent's threads responsive. The pool size is set with the
+    ``IMAGE_POSTPROCESS_WORKERS`` environment variable; 0 processes images in
+    the calling thread. Workers are started by a fork server, since forking
+    the multi-threaded agent process directly is unsafe.
+
+    Returns:
+        ProcessPoolExecutor | None: The pool.
+    """
+    global _pool
+
+    workers = int(os.environ.get("IMAGE_POSTPROCESS_WORKERS", DEFAULT_WORKERS))
+    if workers <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def postprocess(data, save_path, size=None, fit="cover", quality=None, thumbnail_size=None):
+    """Run ``process_image`` in the worker pool and wait for it.
+
+    Args:
+        data (bytes): The encoded source image.
+        save_path (str): The output path; its extension selects the format.
+        size (tuple[int, int]): Target (width, height), or None to keep the source size.
+        fit (str): How to reach ``size`` (see ``process_image``).
+        quality (int): Encoder quality for lossy formats.
+        thumbnail_size (int): Longest edge of an optional thumbnail.
+
+    Returns:
+        dict: See ``process_image``.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return process_image(data, save_path, size, fit, quality, thumbnail_size)
+    return pool.submit(process_image, data, save_path, size, fit, quality, thumbnail_size).result()
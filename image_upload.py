@@ -0,0 +1,163 @@
+import datetime
+import mimetypes
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+from google.genai import types
+
+from gemini_client import get_client
+from image_cache import hash_file
+from instrumentation import span
+from scheduler import get_scheduler
+
+
+# Requests above this size must go through the Files API instead of inline data.
+INLINE_LIMIT_BYTES = 18 * 1024 * 1024
+MAX_PREPARED_BYTES = 256 * 1024 * 1024
+QUALITIES = (85, 75, 65, 50, 35)
+
+_prepared = OrderedDict()
+_prepared_bytes = 0
+_lock = threading.Lock()
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in image.info
+
+
+def _encode(image, quality, alpha):
+    buf = BytesIO()
+    if alpha:
+        # JPEG has no alpha channel; lossy WebP keeps it and still takes a quality.
+        if image.mode not in ("RGBA", "LA"):
+            image = image.convert("RGBA")
+        image.save(buf, format="WEBP", quality=quality)
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def shrink_image(data, max_edge=None, max_bytes=None):
+    """Downscale and recompress image bytes to fit an edge and byte budget.
+
+    The original bytes are returned untouched when they already fit. Otherwise
+    the image is resized so its longest edge is at most ``max_edge`` and
+    re-encoded at decreasing quality (and, if needed, smaller sizes) until it
+    is at most ``max_bytes``: as WebP when the source has transparency, so the
+    alpha channel survives, and as JPEG otherwise.
+
+    Args:
+        data (bytes): The encoded source image.
+        max_edge (int): Maximum length of the longest edge in pixels, or None for no limit.
+        max_bytes (int): Maximum encoded size in bytes, or None for no limit.
+
+    Returns:
+        tuple[bytes, str]: The image bytes and their MIME type, or (data, None) if unchanged.
+    """
+    image = Image.open(BytesIO(data))
+    too_large = max_edge is not None and max(image.size) > max_edge
+    too_heavy = max_bytes is not None and len(data) > max_bytes
+    if not too_large and not too_heavy:
+        return data, None
+
+    alpha = _has_alpha(image)
+    mime_type = "image/webp" if alpha else "image/jpeg"
+    if too_large:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    while True:
+        for quality in QUALITIES:
+            encoded = _encode(image, quality, alpha)
+            if max_bytes is None or len(encoded) <= max_bytes:
+                return encoded, mime_type
+
+        if min(image.size) <= 64:
+            return encoded, mime_type
+        image = image.resize((max(1, int(image.width * 0.75)), max(1, int(image.height * 0.75))), Image.Resampling.LANCZOS)
+
+
+def _is_expired(file):
+    expiration = getattr(file, "expiration_time", None)
+    if expiration is None:
+        return False
+    return expiration <= datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5)
+
+
+def _forget(key):
+    global _prepared_bytes
+    _, _, size = _prepared.pop(key)
+    _prepared_bytes -= size
+
+
+def prepare_image_part(path, max_edge=None, max_bytes=None, content_hash=None):
+    """Build the content part that sends an image's pixels to the model.
+
+    The image is optionally shrunk with ``shrink_image``, then sent inline, or
+    uploaded through the Files API when it is too large to inline. Prepared
+    parts are cached by content hash and settings, so repeated edits of the
+    same source neither re-encode nor re-upload it.
+
+    Args:
+        path (str): Path to the source image.
+        max_edge (int): Maximum length of the longest edge in pixels, or None for no limit.
+        max_bytes (int): Maximum upload size in bytes, or None for no limit.
+        content_hash (str): SHA-256 of the file, if the caller already computed it.
+
+    Returns:
+        types.Part: The part to include in ``contents``.
+
+    Raises:
+        FileNotFoundError: If the image does not exist.
+    """
+    global _prepared_bytes
+
+    if content_hash is None:
+        content_hash = hash_file(path)
+    key = (content_hash, max_edge, max_bytes)
+
+    with _lock:
+        cached = _prepared.get(key)
+        if cached is not None:
+            part, file, _ = cached
+            if file is None or not _is_expired(file):
+                _prepared.move_to_end(key)
+                return part
+            _forget(key)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    mime_type = mimetypes.guess_type(path)[0] or "image/png"
+    if max_edge is not None or max_bytes is not None:
+        data, shrunk_mime_type = shrink_image(data, max_edge, max_bytes)
+        mime_type = shrunk_mime_type or mime_type
+
+    file = None
+    if len(data) > INLINE_LIMIT_BYTES:
+        with span("gemini", "files.upload", bytes_written=len(data)):
+            file = get_scheduler().call(
+                lambda: get_client().files.upload(
+                    file=BytesIO(data),
+                    config=types.UploadFileConfig(mime_type=mime_type),
+                ),
+                tokens=0,
+            )
+        part = types.Part.from_uri(file_uri=file.uri, mime_type=mime_type)
+    else:
+        part = types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    # Files API uploads only keep their URI in memory.
+    size = len(data) if file is None else 0
+    with _lock:
+        if key in _prepared:
+            _forget(key)
+        _prepared[key] = (part, file, size)
+        _prepared_bytes += size
+        while _prepared_bytes > MAX_PREPARED_BYTES and len(_prepared) > 1:
+            _forget(next(iter(_prepared)))
+
+    return part
@@ -0,0 +1,304 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+METRIC_PREFIX = "agent"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+TOKEN_BUCKETS = tuple(16 * 4 ** i for i in range(9))
+
+# Numeric span fields that are summed into per-name counters.
+COUNTED_FIELDS = ("bytes_read", "bytes_written", "input_tokens", "output_tokens", "image_bytes")
+# Numeric span fields that also get a histogram, with its buckets.
+HISTOGRAM_FIELDS = {
+    "input_tokens": TOKEN_BUCKETS,
+    "output_tokens": TOKEN_BUCKETS,
+    "image_bytes": SIZE_BUCKETS,
+}
+
+_metrics = None
+_metrics_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """A cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float | None: The estimate, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """In-process counters, histograms and an optional JSONL trace.
+
+    Every finished span and every event is written to the trace file as one
+    JSON object per line, and folded into the counters and histograms that
+    ``prometheus_text`` exports.
+    """
+
+    def __init__(self, trace_path=None, echo=True):
+        self.echo = echo
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.trace_path = None
+        self._trace = None
+        if trace_path:
+            self.open_trace(trace_path)
+
+    def open_trace(self, path):
+        """Append trace records to ``path`` from now on."""
+        with self.lock:
+            if self._trace is not None:
+                self._trace.close()
+            self.trace_path = path
+            self._trace = open(path, 'a', buffering=1, encoding='utf-8')
+
+    def close(self):
+        """Close the trace file."""
+        with self.lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, metric, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def trace(self, record):
+        if self._trace is None:
+            return
+        line = json.dumps(record, default=str)
+        with self.lock:
+            if self._trace is not None:
+                self._trace.write(line + '\n')
+
+    def record_span(self, record):
+        """Fold a finished span into the metrics and write it to the trace."""
+        kind, name = record["kind"], record["name"]
+        self.inc(f"{kind}_calls_total", name=name)
+        self.observe(f"{kind}_duration_seconds", record["duration"], name=name)
+        if "error" in record:
+            self.inc(f"{kind}_errors_total", name=name)
+        if "cache" in record:
+            self.inc(f"{kind}_cache_total", name=name, result=record["cache"])
+        for field in COUNTED_FIELDS:
+            value = record.get(field)
+            if value:
+                self.inc(f"{kind}_{field}_total", value, name=name)
+                if field in HISTOGRAM_FIELDS:
+                    self.observe(f"{kind}_{field}", value, HISTOGRAM_FIELDS[field], name=name)
+        self.trace(record)
+
+    def summary(self):
+        """Return count, mean and p50/p95/p99 of every histogram.
+
+        Returns:
+            dict: Keyed by ``metric{labels}``.
+        """
+        with self.lock:
+            return {
+                name + _label_text(labels): {
+                    "count": h.count,
+                    "mean": h.sum / h.count if h.count else None,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                }
+                for (name, labels), h in self.histograms.items()
+            }
+
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {full_name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{full_name}{_label_text(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.gauges}):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {full_name} gauge")
+                for (gauge_name, labels), value in sorted(self.gauges.items()):
+                    if gauge_name == name:
+                        lines.append(f"{full_name}{_label_text(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {full_name} histogram")
+                for (histogram_name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{_label_text(labels + (('le', repr(float(bound))),))} {cumulative}")
+                    lines.append(f"{full_name}_bucket{_label_text(labels + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{full_name}_sum{_label_text(labels)} {h.sum}")
+                    lines.append(f"{full_name}_count{_label_text(labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write ``prometheus_text`` to ``path`` atomically, e.g. for the node exporter's textfile collector."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        """Drop every counter, gauge and histogram."""
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+def get_metrics():
+    """Return the process-wide metrics.
+
+    The ``AGENT_TRACE_FILE`` environment variable enables the JSONL trace, and
+    ``AGENT_QUIET=1`` stops events from being echoed to stdout.
+
+    Returns:
+        Metrics: The shared metrics.
+    """
+    global _metrics
+
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(os.environ.get("AGENT_TRACE_FILE"), echo=os.environ.get("AGENT_QUIET") != "1")
+        return _metrics
+
+
+@contextmanager
+def span(kind, name, **fields):
+    """Time an operation and record it when it finishes.
+
+    Code running inside the span (in the same thread or task) can add fields
+    to it with ``record``. Exceptions are recorded as ``error`` and re-raised.
+
+    Args:
+        kind (str): The kind of operation, e.g. "tool" or "gemini".
+        name (str): The tool or request name.
+        **fields: Initial fields of the trace record.
+
+    Yields:
+        dict: The span's record.
+    """
+    entry = {"kind": kind, "name": name, "ts": time.time(), **fields}
+    token = _current_span.set(entry)
+    started = time.perf_counter()
+    try:
+        yield entry
+    except BaseException as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        entry["duration"] = time.perf_counter() - started
+        _current_span.reset(token)
+        get_metrics().record_span(entry)
+
+
+def record(**fields):
+    """Add fields to the innermost active span; numeric fields are summed.
+
+    Does nothing outside a span.
+    """
+    current = _current_span.get()
+    if current is None:
+        return
+    for key, value in fields.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(current.get(key), (int, float)):
+            current[key] += value
+        else:
+            current[key] = value
+
+
+def record_usage(response):
+    """Record the token usage reported with a Gemini response on the active span."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    record(input_tokens=usage.prompt_token_count or 0, output_tokens=usage.candidates_token_count or 0)
+
+
+def event(name, message=None, **fields):
+    """Record a structured event, replacing an ad-hoc status print.
+
+    Args:
+        name (str): The event name, e.g. "file_written".
+        message (str): Human-readable text, echoed to stdout unless ``AGENT_QUIET=1``.
+        **fields: Structured fields of the event.
+    """
+    metrics = get_metrics()
+    metrics.inc("events_total", name=name)
+    metrics.trace({"kind": "event", "name": name, "ts": time.time(), "message": message, **fields})
+    if message is not None and metrics.echo:
+        print(message, file=sys.stdout)
@@ -1,16 +1,50 @@
-from google import genai
-from pydantic import BaseModel
-from file_tools import *
-from image_generator import *
-from use_cli import *
+import os
 
-with open("api_key.txt", "r") as f:
-    api_key = f.read().strip()
+from agent import ToolDispatcher, run_turn, stream_turn
+from gemini_client import get_client
+from history import HistoryManager
+from instrumentation import event, get_metrics
+from session_store import get_session_store
 
-client = genai.Client(api_key=api_key)
-chat = client.chats.create(model="gemini-2.5-flash",
-                           contents="")
+# Tool modules, the Gemini SDK and PIL are imported on first use: the
+# registry serves tool declarations from tools.json and loads a tool's
+# module the first time the model calls it.
 
 
+def main():
+    # Set AGENT_TRACE_FILE for a JSONL trace of every tool call and model request,
+    # and AGENT_METRICS_FILE for Prometheus metrics refreshed after each turn.
+    metrics_path = os.environ.get("AGENT_METRICS_FILE")
+    # Replies are streamed as they are generated; AGENT_STREAM=0 waits for whole responses.
+    stream = os.environ.get("AGENT_STREAM", "1") != "0"
+    # The conversation is saved under AGENT_SESSION and resumed on the next start.
+    session_id = os.environ.get("AGENT_SESSION", "default")
+    store = get_session_store()
+    client = get_client()
+    chat = HistoryManager(client, model="gemini-2.5-flash", store=store, session_id=session_id)
+    if chat.resumed:
+        info = store.info(session_id)
+        event("session_resumed", f"Resumed session {session_id} ({info['messages']} messages)", session=session_id, messages=info["messages"])
+    dispatcher = ToolDispatcher()
 
+    while True:
+        try:
+            message = input("> ")
+        except (EOFError, KeyboardInterrupt):
+            break
+        if not message.strip():
+            continue
+        if stream:
+            stream_turn(chat, message, dispatcher, on_text=lambda text: print(text, end='', flush=True))
+            print()
+        else:
+            print(run_turn(chat, message, dispatcher))
+        if metrics_path:
+            get_metrics().write_prometheus(metrics_path)
 
+    dispatcher.close()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import get_metrics, record
+
+
+INTERACTIVE = 0
+BATCH = 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Defaults for the paid tier of the Flash models; override with GEMINI_RPM / GEMINI_TPM.
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+DEFAULT_REQUEST_TOKENS = 1000
+MAX_ATTEMPTS = 6
+MAX_BACKOFF_SECONDS = 60.0
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+_settings = {
+    "rpm": int(os.environ.get("GEMINI_RPM", DEFAULT_RPM)),
+    "tpm": int(os.environ.get("GEMINI_TPM", DEFAULT_TPM)),
+    "max_attempts": MAX_ATTEMPTS,
+    "max_backoff": MAX_BACKOFF_SECONDS,
+}
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at ``per_minute / 60`` tokens per second.
+
+    The level may go negative when a request turns out to cost more than was
+    reserved, which delays later requests until the debt is repaid.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.level = float(per_minute or 0)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        if self.rate is None:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.rate is not None:
+            self._refill()
+            self.level -= amount
+
+
+def _unwrap(exc):
+    # The SDK runs its own tenacity loop and wraps the final error in a RetryError.
+    last_attempt = getattr(exc, "last_attempt", None)
+    if last_attempt is not None and last_attempt.failed:
+        return last_attempt.exception()
+    return exc
+
+
+def is_transient(exc):
+    """Whether a failed Gemini request is worth retrying.
+
+    Args:
+        exc (BaseException): The exception raised by the request.
+
+    Returns:
+        bool: True for rate limiting, server errors, timeouts and connection failures.
+    """
+    exc = _unwrap(exc)
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+
+    import httpx
+
+    return isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError))
+
+
+class RequestScheduler:
+    """Admit Gemini requests within requests- and tokens-per-minute budgets.
+
+    Callers block in ``call`` until their request is admitted. Waiting
+    requests are admitted strictly by priority and then arrival order, so
+    interactive chat requests overtake queued batch image jobs. Each request
+    reserves an estimate of its tokens; ``call`` settles the difference with
+    the usage reported in the response. Transient failures (429, 5xx,
+    timeouts) are retried with jittered exponential backoff, going through
+    admission again on every attempt.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_attempts=MAX_ATTEMPTS, max_backoff=MAX_BACKOFF_SECONDS):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.waiting = []
+        self.cond = threading.Condition()
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.retries = 0
+        self.failures = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+
+    def _publish_depth(self):
+        get_metrics().set_gauge("scheduler_queue_depth", len(self.waiting))
+
+    def admit(self, priority=INTERACTIVE, tokens=DEFAULT_REQUEST_TOKENS):
+        """Block until a request may be sent, then reserve its budget.
+
+        Args:
+            priority (int): Lower values are admitted first.
+            tokens (int): Estimated tokens of the request.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        started = time.monotonic()
+        entry = (priority, next(self._sequence))
+        with self.cond:
+            heapq.heappush(self.waiting, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+            self._publish_depth()
+            try:
+                while True:
+                    timeout = None
+                    if self.waiting[0] == entry:
+                        timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if timeout <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            break
+                    self.cond.wait(timeout)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self._publish_depth()
+                self.cond.notify_all()
+
+            waited = time.monotonic() - started
+            self.admitted += 1
+            self.total_wait += waited
+
+        get_metrics().observe("scheduler_wait_seconds", waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        return waited
+
+    def settle(self, reserved, used):
+        """Charge or refund the difference between reserved and actual tokens."""
+        if used is None:
+            return
+        with self.cond:
+            self.tokens.take(used - reserved)
+            self.cond.notify_all()
+
+    def call(self, func, tokens=None, priority=None):
+        """Run one Gemini request through admission control and retries.
+
+        Args:
+            func (callable): Sends the request and returns the response.
+            tokens (int): Estimated tokens of the request; defaults to ``DEFAULT_REQUEST_TOKENS``.
+            priority (int): Defaults to the priority set with ``request_priority`` (interactive).
+
+        Returns:
+            Any: The return value of ``func``.
+
+        Raises:
+            Exception: The last error, once retries are exhausted or the error is not transient.
+        """
+        from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+        tokens = DEFAULT_REQUEST_TOKENS if tokens is None else tokens
+        priority = _priority.get() if priority is None else priority
+
+        def before_sleep(retry_state):
+            exc = _unwrap(retry_state.outcome.exception())
+            with self.cond:
+                self.retries += 1
+            get_metrics().inc("scheduler_retries_total", reason=str(getattr(exc, "code", None) or type(exc).__name__))
+            record(retries=1)
+
+        def attempt():
+            record(queue_wait=self.admit(priority, tokens))
+            response = func()
+            usage = getattr(response, "usage_metadata", None)
+            self.settle(tokens, getattr(usage, "total_token_count", None))
+            return response
+
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=wait_random_exponential(multiplier=1, max=self.max_backoff),
+            retry=retry_if_exception(is_transient),
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+        try:
+            return retrying(attempt)
+        except Exception:
+            with self.cond:
+                self.failures += 1
+            get_metrics().inc("scheduler_failures_total")
+            raise
+
+    def stream(self, func, tokens=None, priority=None):
+        """Run one streaming Gemini request through admission control and retries.
+
+        The request is admitted and retried like in ``call`` until its first
+        chunk arrives; an error after that is raised to the consumer, which
+        has already seen part of the response. The token reservation is
+        settled with the usage reported in the last chunk.
+
+        Args:
+            func (callable): Starts the request and returns an iterator of response chunks.
+            tokens (int): Estimated tokens of the request; defaults to ``DEFAULT_REQUEST_TOKENS``.
+            priority (int): Defaults to the priority set with ``request_priority`` (interactive).
+
+        Yields:
+            types.GenerateContentResponse: The response chunks.
+        """
+        tokens = DEFAULT_REQUEST_TOKENS if tokens is None else tokens
+        finished = object()
+
+        def first_chunk():
+            chunks = iter(func())
+            return chunks, next(chunks, finished)
+
+        # call() finds no usage on the tuple, so nothing is settled until the stream ends.
+        chunks, chunk = self.call(first_chunk, tokens=tokens, priority=priority)
+        used = None
+        while chunk is not finished:
+            usage = getattr(chunk, "usage_metadata", None)
+            if getattr(usage, "total_token_count", None) is not None:
+                used = usage.total_token_count
+            yield chunk
+            chunk = next(chunks, finished)
+        self.settle(tokens, used)
+
+    def stats(self):
+        """Return queue and retry statistics.
+
+        Returns:
+            dict: ``queue_depth``, ``max_queue_depth``, ``admitted``, ``retries``, ``failures`` and ``mean_wait`` (seconds).
+        """
+        with self.cond:
+            return {
+                "queue_depth": len(self.waiting),
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "failures": self.failures,
+                "mean_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            }
+
+
+def configure_scheduler(**settings):
+    """Set the budgets and retry policy of the shared scheduler.
+
+    Calling it after the scheduler was created replaces it, dropping its
+    accumulated budget state.
+
+    Args:
+        rpm (int): Requests per minute, or None for no limit.
+        tpm (int): Tokens per minute, or None for no limit.
+        max_attempts (int): Attempts per request, including the first.
+        max_backoff (float): Upper bound of a single backoff delay in seconds.
+
+    Raises:
+        ValueError: If an unknown setting is given.
+    """
+    global _scheduler
+
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown scheduler settings: {', '.join(sorted(unknown))}")
+
+    with _scheduler_lock:
+        _settings.update(settings)
+        _scheduler = None
+
+
+def get_scheduler():
+    """Return the process-wide request scheduler.
+
+    Returns:
+        RequestScheduler: The shared scheduler.
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(**_settings)
+        return _scheduler
+
+
+@contextmanager
+def request_priority(priority):
+    """Send the Gemini requests made inside this block (in this thread or task) at ``priority``."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(*texts):
+    """Roughly estimate the tokens of some text, at four characters per token."""
+    return sum(len(text) for text in texts if text) // 4
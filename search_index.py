@@ -0,0 +1,390 @@
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+
+from file_tools import compile_exclude_patterns
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+# Every index is kept here, one file per indexed root, never in the searched directories themselves.
+DEFAULT_INDEX_DIR = ".search_index"
+INDEX_VERSION = 2
+# Larger files are not indexed; they are always scanned when a search runs.
+MAX_INDEXED_FILE_BYTES = 2 * 1024 * 1024
+DEFAULT_EXCLUDES = [".git/", "node_modules/", "__pycache__/", ".venv/", "venv/", ".image_cache/", ".sessions/"]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+# Absolute paths of the directories tools keep their own state in; walks skip
+# them wherever they are, whatever they are called.
+_state_directories = set()
+
+
+def add_state_directory(path):
+    """Keep a directory out of every search index and watcher.
+
+    Args:
+        path (str): The directory, e.g. where an index stores its files.
+    """
+    _state_directories.add(os.path.abspath(path))
+
+
+def index_directory():
+    """Return the directory search indexes are stored in (``SEARCH_INDEX_DIR``, by default ``.search_index``)."""
+    return os.path.abspath(os.environ.get("SEARCH_INDEX_DIR", DEFAULT_INDEX_DIR))
+
+
+def exclude_matcher(root, exclude=None):
+    """Compile the exclude patterns for a walk of ``root``.
+
+    Besides the patterns, the matcher excludes the directories registered
+    with ``add_state_directory``.
+
+    Args:
+        root (str): The directory being walked.
+        exclude (list[str] | str): Gitignore-style patterns; defaults to ``DEFAULT_EXCLUDES``.
+
+    Returns:
+        callable: ``matcher(rel_path, is_dir)`` returning True if the path is excluded.
+    """
+    root = os.path.abspath(root)
+    is_excluded = compile_exclude_patterns(DEFAULT_EXCLUDES if exclude is None else exclude)
+
+    def matcher(rel_path, is_dir):
+        if is_dir and os.path.join(root, rel_path) in _state_directories:
+            return True
+        return is_excluded(rel_path, is_dir)
+
+    return matcher
+
+
+add_state_directory(index_directory())
+
+
+def _trigrams(data):
+    data = data.lower()
+    return frozenset(data[i:i + 3] for i in range(len(data) - 2))
+
+
+def _literal_runs(parsed, runs, current):
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(arg))
+            continue
+
+        if current:
+            runs.append(''.join(current))
+            current.clear()
+
+        if op is sre_parse.SUBPATTERN:
+            _literal_runs(arg[-1], runs, [])
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+            _literal_runs(arg[2], runs, [])
+
+    if current:
+        runs.append(''.join(current))
+        current.clear()
+
+
+def required_trigrams(query, regex=False, case_sensitive=True):
+    """Return the trigrams every matching file must contain.
+
+    For regular expressions only literal runs that are required on every
+    match path are used; alternations contribute nothing, which keeps the
+    filter conservative. The index folds only ASCII case, so non-ASCII
+    trigrams are dropped whenever matching may ignore case.
+
+    Args:
+        query (str): The search query.
+        regex (bool): Whether ``query`` is a regular expression.
+        case_sensitive (bool): Whether matching is case sensitive.
+
+    Returns:
+        set[bytes]: The lower-cased trigrams, possibly empty.
+    """
+    if not regex:
+        runs = [query]
+    else:
+        try:
+            parsed = sre_parse.parse(query)
+        except re.error:
+            return set()
+        runs = []
+        _literal_runs(parsed, runs, [])
+
+    required = set()
+    for run in runs:
+        required |= _trigrams(run.encode('utf-8'))
+
+    if regex or not case_sensitive:
+        required = {trigram for trigram in required if trigram.isascii()}
+    return required
+
+
+def _encode_trigrams(trigrams):
+    # Byte trigrams are stored as one latin-1 string of concatenated triples; None and False pass through.
+    if trigrams is None or trigrams is False:
+        return trigrams
+    return b''.join(trigrams).decode('latin-1')
+
+
+def _decode_trigrams(encoded):
+    if encoded is None or encoded is False:
+        return encoded
+    data = encoded.encode('latin-1')
+    return frozenset(data[i:i + 3] for i in range(0, len(data), 3))
+
+
+class TrigramIndex:
+    """Persistent trigram index over the files under a root directory.
+
+    For every file the index stores its mtime, size and set of lower-cased
+    byte trigrams, plus an in-memory posting list per trigram. ``refresh``
+    re-indexes only files whose mtime or size changed, so repeated searches
+    over an unchanged tree skip reading file contents entirely. Indexes are
+    saved as JSON in ``index_directory()``, named after a hash of the root.
+    """
+
+    def __init__(self, root, index_path=None, exclude=None):
+        self.root = os.path.abspath(root)
+        if index_path is None:
+            name = hashlib.sha256(self.root.encode('utf-8')).hexdigest()[:32]
+            index_path = os.path.join(index_directory(), f"{name}.json")
+        self.index_path = os.path.abspath(index_path)
+        add_state_directory(os.path.dirname(self.index_path))
+        self.is_excluded = exclude_matcher(self.root, exclude)
+        self.files = {}
+        self.postings = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != INDEX_VERSION or state.get("root") != self.root:
+                return
+            files = {rel_path: (mtime_ns, size, _decode_trigrams(trigrams))
+                     for rel_path, (mtime_ns, size, trigrams) in state["files"].items()}
+        except (OSError, ValueError, TypeError, AttributeError, KeyError):
+            return
+
+        self.files = files
+        for rel_path, (_, _, trigrams) in self.files.items():
+            self._add_postings(rel_path, trigrams)
+
+    def save(self):
+        """Write the index to disk atomically."""
+        files = {rel_path: (mtime_ns, size, _encode_trigrams(trigrams))
+                 for rel_path, (mtime_ns, size, trigrams) in self.files.items()}
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "root": self.root, "files": files}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+    def _add_postings(self, rel_path, trigrams):
+        if not trigrams:
+            return
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, set()).add(rel_path)
+
+    def _remove(self, rel_path):
+        _, _, trigrams = self.files.pop(rel_path)
+        if not trigrams:
+            return
+        for trigram in trigrams:
+            paths = self.postings.get(trigram)
+            if paths is not None:
+                paths.discard(rel_path)
+                if not paths:
+                    del self.postings[trigram]
+
+    def _walk(self):
+        stack = [(self.root, '')]
+        while stack:
+            path, rel_dir = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            for entry in entries:
+                rel_path = f"{rel_dir}{entry.name}"
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if self.is_excluded(rel_path, is_dir):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rel_path + '/'))
+                elif entry.is_file(follow_symlinks=False):
+                    yield rel_path, entry
+
+    def _index_file(self, path, size):
+        """Return the file's trigrams, False for binary files, or None if too large to index."""
+        if size > MAX_INDEXED_FILE_BYTES:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        if b'\x00' in data[:8192]:
+            return False
+        return _trigrams(data)
+
+    def refresh(self):
+        """Bring the index up to date with the files on disk.
+
+        Returns:
+            dict: Counts of ``added``, ``updated`` and ``removed`` files.
+        """
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        with self.lock:
+            seen = set()
+            for rel_path, entry in self._walk():
+                seen.add(rel_path)
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                known = self.files.get(rel_path)
+                if known is not None and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+                    continue
+
+                try:
+                    trigrams = self._index_file(entry.path, st.st_size)
+                except OSError:
+                    continue
+
+                if known is not None:
+                    self._remove(rel_path)
+                    counts["updated"] += 1
+                else:
+                    counts["added"] += 1
+                self.files[rel_path] = (st.st_mtime_ns, st.st_size, trigrams)
+                self._add_postings(rel_path, trigrams)
+
+            for rel_path in [rel_path for rel_path in self.files if rel_path not in seen]:
+                self._remove(rel_path)
+                counts["removed"] += 1
+
+            if any(counts.values()):
+                self.save()
+
+        return counts
+
+    def candidates(self, trigrams):
+        """Return the indexed paths that may contain all ``trigrams``.
+
+        Files too large to index are always included; binary files never are.
+
+        Args:
+            trigrams (set[bytes]): Required trigrams.
+
+        Returns:
+            list[str]: Sorted relative paths.
+        """
+        with self.lock:
+            unindexed = {rel_path for rel_path, (_, _, t) in self.files.items() if t is None}
+            if not trigrams:
+                paths = {rel_path for rel_path, (_, _, t) in self.files.items() if t is not False}
+            else:
+                postings = sorted((self.postings.get(trigram, set()) for trigram in trigrams), key=len)
+                paths = set(postings[0])
+                for posting in postings[1:]:
+                    paths &= posting
+                    if not paths:
+                        break
+                paths |= unindexed
+        return sorted(paths)
+
+
+def get_index(root, exclude=None):
+    """Return the shared index for ``root``, loading it from disk on first use.
+
+    Args:
+        root (str): The workspace root.
+        exclude (list[str]): Gitignore-style patterns to skip; defaults to ``DEFAULT_EXCLUDES``.
+
+    Returns:
+        TrigramIndex: The index.
+    """
+    key = (os.path.abspath(root), tuple(exclude) if exclude is not None else None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TrigramIndex(root, exclude=exclude)
+        return index
+
+
+def _matches_glob(rel_path, glob):
+    if '/' in glob:
+        return fnmatch.fnmatch(rel_path, glob)
+    return fnmatch.fnmatch(rel_path.rsplit('/', 1)[-1], glob)
+
+
+def search(root, query, regex=False, glob=None, case_sensitive=True, max_results=50, context_lines=0, exclude=None):
+    """Search file contents under ``root`` using the trigram index.
+
+    Args:
+        root (str): The directory to search.
+        query (str): A literal string or regular expression.
+        regex (bool): Treat ``query`` as a regular expression.
+        glob (str): Only search files whose relative path (or name, if the glob has no '/') matches.
+        case_sensitive (bool): Whether matching is case sensitive.
+        max_results (int): Maximum number of matching lines to return.
+        context_lines (int): Lines of context to include before and after each match.
+        exclude (list[str]): Gitignore-style patterns to skip.
+
+    Returns:
+        tuple[list[dict], bool]: The matches (``path``, ``line``, ``text``, ``before``, ``after``)
+        and whether the result was cut at ``max_results``.
+
+    Raises:
+        re.error: If ``query`` is not a valid regular expression.
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    pattern = re.compile(query if regex else re.escape(query), flags)
+
+    index = get_index(root, exclude)
+    index.refresh()
+
+    matches = []
+    for rel_path in index.candidates(required_trigrams(query, regex, case_sensitive)):
+        if glob and not _matches_glob(rel_path, glob):
+            continue
+
+        try:
+            with open(os.path.join(index.root, rel_path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+
+        if b'\x00' in data[:8192]:
+            continue
+
+        text = data.decode('utf-8', errors='replace')
+        if not pattern.search(text):
+            continue
+
+        lines = text.splitlines()
+        for lineno, line in enumerate(lines):
+            if not pattern.search(line):
+                continue
+            matches.append({
+                "path": rel_path,
+                "line": lineno + 1,
+                "text": line,
+                "before": lines[max(0, lineno - context_lines):lineno],
+                "after": lines[lineno + 1:lineno + 1 + context_lines],
+            })
+            if len(matches) >= max_results:
+                return matches, True
+
+    return matches, False
@@ -0,0 +1,362 @@
+import argparse
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from agent import DEFAULT_MODEL, run_turn, stream_turn
+from fs_watcher import close_watchers
+from gemini_client import get_client
+from history import HistoryManager
+from instrumentation import event, get_metrics
+from search_index import add_state_directory
+from session_store import get_session_store
+from use_cli import close_shell_session
+from workspace import WorkspaceDispatcher
+
+# One process serves every session: sessions share the Gemini client, the
+# request scheduler's rate budget and the session store, which has a single
+# writer. Turns run on a bounded pool so a burst of requests queues instead
+# of starting unbounded threads; their tool calls share a second pool.
+
+DEFAULT_WORKSPACE_DIR = "workspaces"
+MAX_SESSIONS = 256
+TOOL_WORKERS = 32
+TURN_WORKERS = 16
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+_finished = object()
+
+
+class Session:
+    """A chat session loaded in memory: its history and its workspace-scoped dispatcher."""
+
+    def __init__(self, session_id, chat, dispatcher):
+        self.id = session_id
+        self.chat = chat
+        self.dispatcher = dispatcher
+        # Held for the duration of a turn; a session runs one turn at a time.
+        self.lock = threading.Lock()
+
+
+class SessionManager:
+    """Load, create and evict the chat sessions of a server.
+
+    Up to ``max_sessions`` sessions are kept in memory; the least recently
+    used idle session is dropped beyond that and reloaded from the store on
+    its next request. Each session works in its own directory under
+    ``workspace_dir``.
+
+    Args:
+        client (genai.Client): The shared Gemini client.
+        store (SessionStore): Where histories are persisted.
+        workspace_dir (str): Parent directory of the session workspaces.
+        tool_pool (Executor): The pool every session's tool calls run on.
+        max_sessions (int): Sessions kept in memory.
+        model (str): The chat model.
+    """
+
+    def __init__(self, client, store, workspace_dir=DEFAULT_WORKSPACE_DIR, tool_pool=None, max_sessions=MAX_SESSIONS,
+                 model=DEFAULT_MODEL):
+        self.client = client
+        self.store = store
+        self.workspace_dir = os.path.abspath(workspace_dir)
+        # Searches and watchers of a directory containing the workspaces must not descend into them.
+        add_state_directory(self.workspace_dir)
+        self.tool_pool = tool_pool
+        self.max_sessions = max_sessions
+        self.model = model
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def workspace(self, session_id):
+        """Return the workspace directory of a session."""
+        return os.path.join(self.workspace_dir, session_id)
+
+    def exists(self, session_id):
+        with self.lock:
+            return session_id in self.sessions or session_id in self.store
+
+    def get(self, session_id, create=False):
+        """Return a session, loading it from the store if needed.
+
+        Args:
+            session_id (str): The session id.
+            create (bool): Start a new session if it does not exist.
+
+        Returns:
+            Session: The session, or None if it does not exist and ``create`` is False.
+        """
+        with self.lock:
+            session, evicted = self._get(session_id, create)
+        self._unload(*evicted)
+        return session
+
+    def acquire(self, session_id):
+        """Return a session with its turn lock taken, if it is free.
+
+        The lookup and the lock are taken together under the manager's lock,
+        so the session cannot be evicted in between and loaded a second time.
+
+        Returns:
+            tuple[Session, bool]: The session (None if it does not exist) and
+            whether its lock was acquired; the caller must release it.
+        """
+        with self.lock:
+            session, evicted = self._get(session_id)
+            acquired = session is not None and session.lock.acquire(blocking=False)
+        self._unload(*evicted)
+        return session, acquired
+
+    def _get(self, session_id, create=False):
+        """Return the session and the sessions evicted to make room for it; call with the lock held."""
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            return session, []
+        if not create and session_id not in self.store:
+            return None, []
+
+        chat = HistoryManager(self.client, model=self.model, store=self.store, session_id=session_id)
+        if not chat.resumed:
+            # Record the session so it is listed before its first message.
+            self.store.replace(session_id, [])
+        dispatcher = WorkspaceDispatcher(self.workspace(session_id), pool=self.tool_pool)
+        session = self.sessions[session_id] = Session(session_id, chat, dispatcher)
+        return session, self._evict(keep=session_id)
+
+    def _evict(self, keep):
+        """Drop idle sessions beyond ``max_sessions``, least recently used first, and return them."""
+        evicted = []
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            session = self.sessions[session_id]
+            if session_id != keep and not session.lock.locked():
+                evicted.append(self.sessions.pop(session_id))
+        return evicted
+
+    def _unload(self, *sessions):
+        """Release what sessions hold outside the manager: shell sessions and file watchers."""
+        for session in sessions:
+            session.dispatcher.close()
+            close_shell_session(session.dispatcher.root)
+            close_watchers(session.dispatcher.root)
+
+    def delete(self, session_id):
+        """Delete a session, its stored history and its workspace.
+
+        Returns:
+            bool: False if the session did not exist.
+        """
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            stored = session_id in self.store
+            if session is None and not stored:
+                return False
+            if stored:
+                self.store.delete(session_id)
+        if session is not None:
+            self._unload(session)
+        shutil.rmtree(self.workspace(session_id), ignore_errors=True)
+        return True
+
+    def info(self, session_id):
+        """Return a session's stored ``info``, plus whether it is loaded and busy."""
+        with self.lock:
+            info = self.store.info(session_id)
+            session = self.sessions.get(session_id)
+        info["loaded"] = session is not None
+        info["busy"] = session is not None and session.lock.locked()
+        return info
+
+    def list_sessions(self):
+        """Return ``info`` for every stored session, most recently updated first."""
+        with self.lock:
+            loaded = {session_id: session.lock.locked() for session_id, session in self.sessions.items()}
+        infos = self.store.list_sessions()
+        for info in infos:
+            info["loaded"] = info["id"] in loaded
+            info["busy"] = loaded.get(info["id"], False)
+        return infos
+
+    def close(self):
+        """Unload every session."""
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        self._unload(*sessions)
+
+
+def _sse(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+def create_app(client=None, store=None, workspace_dir=None, max_sessions=MAX_SESSIONS, tool_workers=TOOL_WORKERS,
+               turn_workers=TURN_WORKERS, model=DEFAULT_MODEL):
+    """Create the Flask app serving chat sessions over HTTP.
+
+    Endpoints:
+
+    * ``POST /sessions`` (optional JSON ``{"id": ...}``) starts a session;
+    * ``GET /sessions`` lists sessions and ``GET /sessions/<id>`` describes one;
+    * ``DELETE /sessions/<id>`` deletes a session and its workspace;
+    * ``POST /sessions/<id>/messages`` with JSON ``{"message": ..., "stream": false}``
+      runs a turn and returns ``{"reply": ...}``, or with ``"stream": true``
+      sends Server-Sent Events: ``text`` events as the reply is generated,
+      then ``done`` with the whole reply or ``error``. A session runs one turn
+      at a time; a message sent while a turn is running gets a 409;
+    * ``GET /healthz`` and ``GET /metrics`` (Prometheus text format).
+
+    Args:
+        client (genai.Client): Defaults to the shared client.
+        store (SessionStore): Defaults to the shared session store.
+        workspace_dir (str): Parent directory of the session workspaces; defaults
+            to ``AGENT_WORKSPACE_DIR`` or ``workspaces``.
+        max_sessions (int): Sessions kept in memory.
+        tool_workers (int): Threads running tool calls, shared by all sessions.
+        turn_workers (int): Turns running at once; further turns wait for a free worker.
+        model (str): The chat model.
+
+    Returns:
+        flask.Flask: The app. Its ``SessionManager`` is ``app.extensions["sessions"]``.
+    """
+    from flask import Flask, Response, jsonify, request
+
+    client = get_client() if client is None else client
+    store = get_session_store() if store is None else store
+    if workspace_dir is None:
+        workspace_dir = os.environ.get("AGENT_WORKSPACE_DIR", DEFAULT_WORKSPACE_DIR)
+    tool_pool = ThreadPoolExecutor(max_workers=tool_workers, thread_name_prefix="tool")
+    turn_pool = ThreadPoolExecutor(max_workers=turn_workers, thread_name_prefix="turn")
+    manager = SessionManager(client, store, workspace_dir, tool_pool, max_sessions, model)
+
+    app = Flask(__name__)
+    app.extensions["sessions"] = manager
+
+    def error(status, message):
+        return jsonify({"error": message}), status
+
+    def json_body():
+        body = request.get_json(silent=True)
+        return body if isinstance(body, dict) else {}
+
+    def run(session, message, on_text=None):
+        """Run a turn on a turn worker, holding the session's lock until it ends."""
+        started = time.monotonic()
+        status = "ok"
+        try:
+            if on_text is None:
+                return run_turn(session.chat, message, session.dispatcher)
+            return stream_turn(session.chat, message, session.dispatcher, on_text=on_text)
+        except Exception as e:
+            status = "error"
+            event("turn_failed", f"Turn of session {session.id} failed: {type(e).__name__}: {e}", session=session.id)
+            raise
+        finally:
+            session.lock.release()
+            get_metrics().inc("server_turns_total", status=status)
+            get_metrics().observe("server_turn_seconds", time.monotonic() - started)
+
+    @app.post("/sessions")
+    def create_session():
+        session_id = json_body().get("id") or uuid.uuid4().hex
+        if not isinstance(session_id, str) or not SESSION_ID.fullmatch(session_id):
+            return error(400, "Session ids are 1 to 64 letters, digits, '-' or '_'.")
+        if manager.exists(session_id):
+            return error(409, f"Session {session_id} already exists.")
+        manager.get(session_id, create=True)
+        return jsonify(manager.info(session_id)), 201
+
+    @app.get("/sessions")
+    def list_sessions():
+        return jsonify({"sessions": manager.list_sessions()})
+
+    @app.get("/sessions/<session_id>")
+    def get_session(session_id):
+        if not manager.exists(session_id):
+            return error(404, f"Session {session_id} does not exist.")
+        return jsonify(manager.info(session_id))
+
+    @app.delete("/sessions/<session_id>")
+    def delete_session(session_id):
+        session, acquired = manager.acquire(session_id)
+        if session is None:
+            return error(404, f"Session {session_id} does not exist.")
+        if not acquired:
+            return error(409, f"Session {session_id} is running a turn.")
+        manager.delete(session_id)
+        return "", 204
+
+    @app.post("/sessions/<session_id>/messages")
+    def send_message(session_id):
+        body = json_body()
+        message = body.get("message")
+        if not isinstance(message, str) or not message.strip():
+            return error(400, "The request needs a non-empty 'message'.")
+        session, acquired = manager.acquire(session_id)
+        if session is None:
+            return error(404, f"Session {session_id} does not exist.")
+        if not acquired:
+            return error(409, f"Session {session_id} is already running a turn.")
+
+        if not body.get("stream"):
+            try:
+                reply = turn_pool.submit(run, session, message).result()
+            except Exception as e:
+                return error(500, f"{type(e).__name__}: {e}")
+            return jsonify({"reply": reply})
+
+        chunks = queue.Queue()
+        future = turn_pool.submit(run, session, message, chunks.put)
+        future.add_done_callback(lambda _: chunks.put(_finished))
+
+        def events():
+            # The turn keeps running, and its history is saved, if the caller disconnects.
+            while (chunk := chunks.get()) is not _finished:
+                yield _sse("text", {"text": chunk})
+            try:
+                yield _sse("done", {"reply": future.result()})
+            except Exception as e:
+                yield _sse("error", {"error": f"{type(e).__name__}: {e}"})
+
+        return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.get("/healthz")
+    def healthz():
+        return jsonify({"status": "ok", "sessions_loaded": len(manager.sessions)})
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(get_metrics().prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve chat sessions over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workspace-dir", default=None, help="Parent directory of the session workspaces.")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS, help="Sessions kept in memory.")
+    parser.add_argument("--tool-workers", type=int, default=TOOL_WORKERS, help="Threads running tool calls.")
+    parser.add_argument("--turn-workers", type=int, default=TURN_WORKERS, help="Turns running at once.")
+    args = parser.parse_args()
+
+    app = create_app(workspace_dir=args.workspace_dir, max_sessions=args.max_sessions,
+                     tool_workers=args.tool_workers, turn_workers=args.turn_workers)
+    try:
+        app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        app.extensions["sessions"].close()
+        app.extensions["sessions"].store.close()
+
+
+if __name__ == "__main__":
+    main()
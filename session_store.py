@@ -0,0 +1,416 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+DEFAULT_SESSION_DIR = ".sessions"
+INDEX_FILE = "index"
+INDEX_VERSION = 2
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+# Compact once this fraction of the sealed segments' bytes is no longer live.
+COMPACT_DEAD_RATIO = 0.5
+# Persist the index after this many records; records written since are replayed on open.
+INDEX_FLUSH_RECORDS = 64
+
+# Every record is framed as (payload length, CRC-32 of the payload).
+_HEADER = struct.Struct(">II")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _segment_name(number):
+    return f"segment-{number:06d}.log"
+
+
+def _content_dicts(contents):
+    return [content if isinstance(content, dict) else content.model_dump(mode="json", exclude_none=True) for content in contents]
+
+
+class SessionStore:
+    """Durable chat histories kept in an append-only log.
+
+    Every change to a session is one framed, checksummed record appended to
+    the current segment file: ``append`` records carry only the messages
+    added since the last write, and ``replace`` records a whole history
+    (after it was compacted, say). The index maps each session to the
+    locations of the records that make up its current history, so loading a
+    session reads exactly those records and nothing else. The index is saved
+    every ``INDEX_FLUSH_RECORDS`` records and on ``close``; records written
+    after the last save are replayed from the log on open, and a record torn
+    by a crash is cut off.
+
+    Segments are sealed once they reach ``max_segment_bytes``. When most of
+    the sealed segments' bytes are superseded (by ``replace``, ``delete`` or
+    later compactions), ``compact`` rewrites every session that still has
+    records in them as a single ``replace`` record and deletes the old
+    segments.
+
+    The store is safe to share between threads, but not between processes.
+    """
+
+    def __init__(self, directory=DEFAULT_SESSION_DIR, max_segment_bytes=MAX_SEGMENT_BYTES, fsync=True):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync = fsync
+        self.sessions = {}
+        self.segment_bytes = {}
+        self.live_bytes = {}
+        self.compactions = 0
+        self._segment = None
+        self._file = None
+        self._unsaved = 0
+        self._compacting = False
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # -- log --------------------------------------------------------------
+
+    def _path(self, number):
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _segments_on_disk(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".log"):
+                numbers.append(int(name[len("segment-"):-len(".log")]))
+        return sorted(numbers)
+
+    def _read_records(self, number, offset):
+        """Yield (offset, length, record) from ``offset`` to the last intact record of a segment."""
+        with open(self._path(number), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, checksum = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    return
+                yield offset, _HEADER.size + length, json.loads(payload)
+                offset += _HEADER.size + length
+
+    def _read_locations(self, locations):
+        """Return the records at (segment, offset, length) locations, opening each segment once."""
+        files = {}
+        try:
+            records = []
+            for number, offset, length in locations:
+                f = files.get(number)
+                if f is None:
+                    f = files[number] = open(self._path(number), 'rb')
+                f.seek(offset)
+                records.append(json.loads(f.read(length)[_HEADER.size:]))
+            return records
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _open(self):
+        state = self._load_index()
+        numbers = self._segments_on_disk()
+        if state is not None and set(state["segment_bytes"]) <= set(numbers):
+            self.sessions = state["sessions"]
+            self.segment_bytes = state["segment_bytes"]
+            self.live_bytes = state["live_bytes"]
+            replay = [(number, self.segment_bytes.get(number, 0)) for number in numbers if number >= state["segment"]]
+            # Segments a compaction had already dropped from the index when it was interrupted.
+            for number in numbers:
+                if number < state["segment"] and number not in self.segment_bytes:
+                    os.remove(self._path(number))
+            numbers = [number for number in numbers if number in self.segment_bytes or number >= state["segment"]]
+        else:
+            replay = [(number, 0) for number in numbers]
+
+        for number, offset in replay:
+            end = offset
+            for record_offset, length, record in self._read_records(number, offset):
+                self._apply(record, (number, record_offset, length))
+                end = record_offset + length
+            # Cut off a record torn by a crash, so new records follow intact ones.
+            if os.path.getsize(self._path(number)) > end:
+                with open(self._path(number), 'r+b') as f:
+                    f.truncate(end)
+            self.segment_bytes[number] = end
+
+        self._segment = numbers[-1] if numbers else 1
+        self.segment_bytes.setdefault(self._segment, 0)
+        self._file = open(self._path(self._segment), 'ab')
+        if replay:
+            self.save_index()
+
+    def _apply(self, record, location):
+        """Update the index for one record stored at ``location`` (segment, offset, length)."""
+        session_id = record["session"]
+        number, _, length = location
+        self.live_bytes[number] = self.live_bytes.get(number, 0) + length
+        op = record["op"]
+
+        if op in ("replace", "delete"):
+            old = self.sessions.pop(session_id, None)
+            if old is not None:
+                for old_number, _, old_length in old["records"]:
+                    self.live_bytes[old_number] -= old_length
+
+        if op == "delete":
+            # The tombstone itself is dead once applied.
+            self.live_bytes[number] -= length
+            return
+
+        info = self.sessions.setdefault(session_id, {"records": [], "messages": 0, "created": record["ts"]})
+        info["records"].append(location)
+        info["messages"] += len(record["contents"])
+        info["updated"] = record["ts"]
+
+    def _write(self, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        if self.segment_bytes[self._segment] and self.segment_bytes[self._segment] + _HEADER.size + len(payload) > self.max_segment_bytes:
+            self._rotate()
+
+        offset = self.segment_bytes[self._segment]
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        length = _HEADER.size + len(payload)
+        self.segment_bytes[self._segment] = offset + length
+        self._apply(record, (self._segment, offset, length))
+
+        self._unsaved += 1
+        if self._unsaved >= INDEX_FLUSH_RECORDS:
+            self.save_index()
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        self.segment_bytes[self._segment] = 0
+        self._file = open(self._path(self._segment), 'ab')
+        self.save_index()
+        if not self._compacting:
+            self.compact()
+
+    # -- index ------------------------------------------------------------
+
+    def _load_index(self):
+        """Return the saved index, or None if it is missing or unreadable (the log is then replayed)."""
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != INDEX_VERSION:
+                return None
+            # JSON object keys are strings and tuples come back as lists.
+            return {
+                "segment": int(state["segment"]),
+                "segment_bytes": {int(number): int(size) for number, size in state["segment_bytes"].items()},
+                "live_bytes": {int(number): int(size) for number, size in state["live_bytes"].items()},
+                "sessions": {
+                    session_id: dict(info, records=[(int(number), int(offset), int(length)) for number, offset, length in info["records"]])
+                    for session_id, info in state["sessions"].items()
+                },
+            }
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+    def save_index(self):
+        """Write the index to disk atomically."""
+        with self._lock:
+            path = os.path.join(self.directory, INDEX_FILE)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "segment": self._segment,
+                    "segment_bytes": self.segment_bytes,
+                    "live_bytes": self.live_bytes,
+                    "sessions": self.sessions,
+                }, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+            self._unsaved = 0
+
+    # -- sessions ---------------------------------------------------------
+
+    def append(self, session_id, contents):
+        """Add messages to the end of a session, creating it if needed.
+
+        Args:
+            session_id (str): The session.
+            contents (list[types.Content]): The new messages only.
+        """
+        if not contents:
+            return
+        with self._lock:
+            self._write({"op": "append", "session": session_id, "ts": time.time(), "contents": _content_dicts(contents)})
+
+    def replace(self, session_id, contents):
+        """Replace the whole history of a session.
+
+        Args:
+            session_id (str): The session.
+            contents (list[types.Content]): The complete history.
+        """
+        with self._lock:
+            self._write({"op": "replace", "session": session_id, "ts": time.time(), "contents": _content_dicts(contents)})
+
+    def delete(self, session_id):
+        """Delete a session.
+
+        Raises:
+            KeyError: If the session does not exist.
+        """
+        with self._lock:
+            if session_id not in self.sessions:
+                raise KeyError(session_id)
+            self._write({"op": "delete", "session": session_id, "ts": time.time()})
+
+    def _load_dicts(self, session_id):
+        with self._lock:
+            info = self.sessions.get(session_id)
+            if info is None:
+                raise KeyError(session_id)
+            records = self._read_locations(info["records"])
+        return [content for record in records for content in record["contents"]]
+
+    def load(self, session_id):
+        """Return the history of a session.
+
+        Args:
+            session_id (str): The session.
+
+        Returns:
+            list[types.Content]: The messages, oldest first.
+
+        Raises:
+            KeyError: If the session does not exist.
+        """
+        from google.genai import types
+
+        return [types.Content.model_validate(content) for content in self._load_dicts(session_id)]
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self.sessions
+
+    def info(self, session_id):
+        """Return a session's message count and timestamps without reading its history.
+
+        Returns:
+            dict: ``id``, ``messages``, ``created``, ``updated`` and ``records``.
+
+        Raises:
+            KeyError: If the session does not exist.
+        """
+        with self._lock:
+            info = self.sessions[session_id]
+            return {
+                "id": session_id,
+                "messages": info["messages"],
+                "created": info["created"],
+                "updated": info["updated"],
+                "records": len(info["records"]),
+            }
+
+    def list_sessions(self):
+        """Return ``info`` for every session, most recently updated first."""
+        with self._lock:
+            infos = [self.info(session_id) for session_id in self.sessions]
+        return sorted(infos, key=lambda info: info["updated"], reverse=True)
+
+    # -- compaction -------------------------------------------------------
+
+    def compact(self, force=False):
+        """Rewrite the live records of sealed segments and delete those segments.
+
+        Runs when at least ``COMPACT_DEAD_RATIO`` of the sealed segments'
+        bytes are dead, or always with ``force``; with ``force`` the current
+        segment is sealed first so that every segment is compacted.
+
+        Args:
+            force (bool): Compact regardless of the dead ratio.
+
+        Returns:
+            dict: ``segments`` removed, ``sessions`` rewritten and ``bytes_before``/``bytes_after``
+            of the log (both None if nothing was compacted).
+        """
+        with self._lock:
+            if force and self.segment_bytes[self._segment]:
+                self._file.close()
+                self._segment += 1
+                self.segment_bytes[self._segment] = 0
+                self._file = open(self._path(self._segment), 'ab')
+
+            sealed = [number for number in self.segment_bytes if number != self._segment]
+            total = sum(self.segment_bytes[number] for number in sealed)
+            dead = total - sum(self.live_bytes.get(number, 0) for number in sealed)
+            report = {"segments": 0, "sessions": 0, "bytes_before": None, "bytes_after": None}
+            if not sealed or not (force or (total and dead / total >= COMPACT_DEAD_RATIO)):
+                return report
+
+            report["bytes_before"] = sum(self.segment_bytes.values())
+            sealed_set = set(sealed)
+            affected = [
+                session_id for session_id, info in self.sessions.items()
+                if any(number in sealed_set for number, _, _ in info["records"])
+            ]
+            self._compacting = True
+            try:
+                for session_id in affected:
+                    info = self.sessions[session_id]
+                    created = info["created"]
+                    self._write({"op": "replace", "session": session_id, "ts": info["updated"], "contents": self._load_dicts(session_id)})
+                    self.sessions[session_id]["created"] = created
+            finally:
+                self._compacting = False
+
+            for number in sealed:
+                del self.segment_bytes[number]
+                self.live_bytes.pop(number, None)
+            self.save_index()
+            for number in sealed:
+                os.remove(self._path(number))
+
+            self.compactions += 1
+            report.update(segments=len(sealed), sessions=len(affected), bytes_after=sum(self.segment_bytes.values()))
+            return report
+
+    def stats(self):
+        """Return the number of sessions and the log size.
+
+        Returns:
+            dict: ``sessions``, ``segments``, ``bytes``, ``live_bytes`` and ``compactions``.
+        """
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "segments": len(self.segment_bytes),
+                "bytes": sum(self.segment_bytes.values()),
+                "live_bytes": sum(self.live_bytes.values()),
+                "compactions": self.compactions,
+            }
+
+    def close(self):
+        """Save the index and close the current segment."""
+        with self._lock:
+            if self._file is not None and not self._file.closed:
+                self.save_index()
+                self._file.close()
+
+
+def get_session_store():
+    """Return the process-wide session store.
+
+    Its location can be set with the ``AGENT_SESSION_DIR`` environment variable.
+
+    Returns:
+        SessionStore: The shared store.
+    """
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(os.environ.get("AGENT_SESSION_DIR", DEFAULT_SESSION_DIR))
+        return _store
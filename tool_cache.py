@@ -0,0 +1,222 @@
+import functools
+import inspect
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from instrumentation import record
+
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_CACHE_ENTRIES = 4096
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def file_stamp(path):
+    """Return a value that changes whenever the file or directory at ``path`` changes.
+
+    For a directory this covers entries being added, removed or renamed
+    directly inside it, not changes further down.
+
+    Args:
+        path (str): The path to stat.
+
+    Returns:
+        tuple | None: (mtime_ns, size, inode), or None if nothing exists at ``path``.
+    """
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def parent_stamp(path):
+    """Return the stamp of the directory containing ``path``, which changes when ``path`` appears or disappears."""
+    return file_stamp(os.path.dirname(os.path.abspath(path)))
+
+
+def _related(a, b):
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+class ToolResultCache:
+    """In-memory LRU cache of read-only tool results.
+
+    Every entry is keyed on the tool and its arguments and stores the stamp
+    of the path it was computed from; a lookup whose current stamp differs is
+    a miss. Tools that modify files invalidate entries for the paths they
+    touch (including parent directories and anything below), so results stay
+    correct even when a stamp would not notice the change.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, stamp):
+        """Return ``(True, result)`` for a fresh entry, else ``(False, None)``."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == stamp:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, path, stamp, result):
+        """Store a result computed from ``path`` while it had ``stamp``."""
+        size = sys.getsizeof(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[3]
+            self.entries[key] = (path, stamp, result, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                _, (_, _, _, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drop every entry for ``path``, its ancestors and anything below it."""
+        path = os.path.abspath(path)
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if _related(entry[0], path)]
+            for key in stale:
+                self.total_bytes -= self.entries.pop(key)[3]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Drop every entry."""
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """Return hit/miss counts, the hit rate and memory use.
+
+        Returns:
+            dict: ``hits``, ``misses``, ``hit_rate``, ``invalidations``, ``evictions``, ``entries`` and ``bytes``.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+            }
+
+
+def get_tool_cache():
+    """Return the process-wide tool result cache.
+
+    Its size can be set with the ``TOOL_CACHE_MAX_BYTES`` environment variable.
+
+    Returns:
+        ToolResultCache: The shared cache.
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ToolResultCache(int(os.environ.get("TOOL_CACHE_MAX_BYTES", MAX_CACHE_BYTES)))
+        return _cache
+
+
+def memoized(stamp, path_arg="path", bypass=None):
+    """Cache a read-only tool's results, keyed on its arguments and a path stamp.
+
+    Args:
+        stamp (callable): Maps the path to a value that changes when the result may change.
+        path_arg (str): The argument holding the path the result depends on.
+        bypass (callable): Called with the bound arguments; if it returns True the call is not cached.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if bypass is not None and bypass(bound.arguments):
+                return func(*args, **kwargs)
+
+            path = os.path.abspath(bound.arguments[path_arg])
+            key = (func.__name__, path, repr([value for name, value in bound.arguments.items() if name != path_arg]))
+            current = stamp(path)
+            cache = get_tool_cache()
+            hit, result = cache.get(key, current)
+            record(cache="hit" if hit else "miss")
+            if hit:
+                return result
+
+            result = func(*args, **kwargs)
+            cache.put(key, path, current, result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def invalidates(*path_args):
+    """Invalidate cached results for the paths in ``path_args`` after the call, even if it fails.
+
+    Args:
+        *path_args (str): Names of the arguments holding modified paths.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                cache = get_tool_cache()
+                for name in path_args:
+                    path = bound.arguments.get(name)
+                    if isinstance(path, str):
+                        cache.invalidate(path)
+
+        return wrapper
+
+    return decorate
+
+
+def clears_cache(func):
+    """Clear the whole cache after the call, for tools that may modify any path."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            get_tool_cache().clear()
+
+    return wrapper
@@ -0,0 +1,474 @@
+import importlib
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+from typing import Any, Optional
+
+from instrumentation import span
+
+
+TOOL_MODULES = ("file_tools", "image_generator", "use_cli", "fs_watcher", "image_index")
+SCHEMAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools.json")
+TXT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools.txt")
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool_manifest.json")
+SECTION_HEADERS = ("Args:", "Returns:", "Raises:", "Yields:", "Example:", "Examples:", "Note:")
+
+_SIMPLE_TYPES = {
+    "str": "string",
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "dict": "object",
+    "list": "array",
+}
+_PYTHON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class ToolArgumentError(ValueError):
+    """Raised when a tool call's arguments do not match the tool's schema."""
+
+
+def tool(description=None, hidden=(), **parameters):
+    """Mark a function as an agent tool.
+
+    The tool's schema is derived from the function's signature and docstring
+    (see ``derive_schema``); the decorator only adds what those cannot express.
+
+    Args:
+        description (str): Description for the model, instead of the docstring summary.
+        hidden (tuple[str]): Parameters that are not exposed to the model.
+        **parameters: Per-parameter schema fragments merged over the derived ones,
+            e.g. an ``items`` schema for a list of objects.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorate(func):
+        func.__tool__ = {"description": description, "hidden": tuple(hidden), "parameters": parameters}
+        return func
+    return decorate
+
+
+def parse_docstring(doc):
+    """Split a Google-style docstring into its summary and argument descriptions.
+
+    Args:
+        doc (str): The docstring.
+
+    Returns:
+        tuple[str, dict]: The first paragraph as one line, and ``{name: (type, description)}``.
+    """
+    lines = inspect.cleandoc(doc or '').splitlines()
+
+    summary = []
+    for line in lines:
+        if not line.strip() or line.strip() in SECTION_HEADERS:
+            break
+        summary.append(line.strip())
+
+    args = {}
+    in_args = False
+    entry_indent = None
+    current = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped in SECTION_HEADERS:
+            in_args = stripped == "Args:"
+            entry_indent = None
+            continue
+        if not in_args or not stripped:
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        if entry_indent is None:
+            entry_indent = indent
+
+        match = re.match(r'^\*{0,2}(\w+) \((.+?)\): ?(.*)$', stripped)
+        if indent == entry_indent and match:
+            current = match.group(1)
+            args[current] = [match.group(2), match.group(3)]
+        elif current is not None and indent > entry_indent:
+            args[current][1] += ' ' + stripped
+
+    return ' '.join(summary), {name: (type_str, text.replace('``', '')) for name, (type_str, text) in args.items()}
+
+
+def _split_top_level(text, separator):
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    parts.append(current.strip())
+    return parts
+
+
+def type_to_schema(type_str):
+    """Translate a docstring type such as ``list[str] | str`` into a JSON schema.
+
+    For unions the first alternative is used, as function declarations only
+    take a single type.
+
+    Args:
+        type_str (str): The type from the docstring.
+
+    Returns:
+        dict: The JSON schema fragment.
+    """
+    type_str = _split_top_level(type_str, '|')[0]
+    match = re.match(r'^(\w+)(?:\[(.*)\])?$', type_str)
+    if not match or match.group(1) not in _SIMPLE_TYPES:
+        return {"type": "string"}
+
+    schema = {"type": _SIMPLE_TYPES[match.group(1)]}
+    if schema["type"] == "array":
+        schema["items"] = type_to_schema(match.group(2)) if match.group(2) else {"type": "string"}
+    return schema
+
+
+def derive_schema(func):
+    """Build a tool's function declaration from its signature and docstring.
+
+    Args:
+        func (callable): The tool handler, optionally marked with ``tool``.
+
+    Returns:
+        dict: ``name``, ``description`` and ``parameters`` in Gemini function declaration form.
+
+    Raises:
+        ValueError: If an exposed parameter is not documented in the docstring.
+    """
+    options = getattr(func, "__tool__", {"description": None, "hidden": (), "parameters": {}})
+    summary, documented = parse_docstring(func.__doc__)
+
+    properties = {}
+    required = []
+    for name, param in inspect.signature(func).parameters.items():
+        if name in options["hidden"] or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        if name not in documented:
+            raise ValueError(f"Parameter {name!r} of tool {func.__name__} is not documented.")
+
+        type_str, description = documented[name]
+        prop = type_to_schema(type_str)
+        prop["description"] = description
+        if param.default is param.empty:
+            required.append(name)
+        elif param.default is not None:
+            prop["default"] = param.default
+        prop.update(options["parameters"].get(name, {}))
+        properties[name] = prop
+
+    return {
+        "name": func.__name__,
+        "description": options["description"] or summary,
+        "parameters": {"type": "object", "properties": properties, "required": required},
+    }
+
+
+def tool_schemas(module_name):
+    """Derive the schemas of every ``tool``-marked function in a module.
+
+    Args:
+        module_name (str): The module's ``__name__``.
+
+    Returns:
+        dict: Tool name to schema, in definition order.
+    """
+    module = sys.modules[module_name]
+    return {
+        name: derive_schema(value)
+        for name, value in vars(module).items()
+        if callable(value) and hasattr(value, '__tool__') and getattr(value, '__module__', None) == module_name
+    }
+
+
+def _python_type(schema, model_name):
+    json_type = schema.get("type")
+    if json_type == "array":
+        return list[_python_type(schema.get("items", {}), model_name + "Item")]
+    if json_type == "object":
+        if "properties" in schema:
+            return _build_model(model_name, schema)
+        return dict[str, Any]
+    return _PYTHON_TYPES.get(json_type, Any)
+
+
+def _build_model(model_name, schema):
+    from pydantic import ConfigDict, create_model
+
+    fields = {}
+    required = set(schema.get("required", []))
+    for name, prop in schema.get("properties", {}).items():
+        field_type = _python_type(prop, model_name + name.title().replace('_', ''))
+        if name in required:
+            fields[name] = (field_type, ...)
+        else:
+            fields[name] = (Optional[field_type], prop.get("default"))
+    return create_model(model_name, __config__=ConfigDict(extra='forbid'), **fields)
+
+
+class ToolRegistry:
+    """The single source of tool handlers, schemas and argument validators.
+
+    Handlers are imported from their module on first call, so a registry
+    loaded from the generated manifest offers every tool's metadata without
+    importing any handler (or heavy dependencies such as PIL). Validators are
+    pydantic models compiled once per tool on its first call, so each call is
+    validated and coerced (e.g. ``"3"`` or ``3.0`` to ``3`` for integers)
+    before its handler runs.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self.handlers = {}
+        self.schemas = {}
+        self.validators = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_manifest(cls, manifest_path=MANIFEST_FILE, schemas_path=SCHEMAS_FILE):
+        """Load tool metadata from the files written by ``write_tool_files``.
+
+        Args:
+            manifest_path (str): The tool name to module mapping.
+            schemas_path (str): The tool schemas.
+
+        Returns:
+            ToolRegistry: A registry whose handlers are imported on first use.
+        """
+        registry = cls()
+        with open(manifest_path) as f:
+            registry.modules = json.load(f)["modules"]
+        with open(schemas_path) as f:
+            registry.schemas = json.load(f)
+        return registry
+
+    def register(self, func, schema=None):
+        """Add a handler, deriving its schema if none is given."""
+        schema = schema or derive_schema(func)
+        self.modules[schema["name"]] = func.__module__
+        self.handlers[schema["name"]] = func
+        self.schemas[schema["name"]] = schema
+
+    def register_module(self, module):
+        """Add every ``tool``-marked function of a module."""
+        for name, schema in tool_schemas(module.__name__).items():
+            self.register(getattr(module, name), schema)
+
+    def handler(self, name):
+        """Return a tool's handler, importing its module on first use.
+
+        Raises:
+            KeyError: If the tool is not registered.
+        """
+        handler = self.handlers.get(name)
+        if handler is None:
+            if name not in self.modules:
+                raise KeyError(f"Unknown tool: {name}")
+            handler = self.handlers[name] = getattr(importlib.import_module(self.modules[name]), name)
+        return handler
+
+    def _validator(self, name):
+        validator = self.validators.get(name)
+        if validator is None:
+            with self._lock:
+                validator = self.validators.get(name)
+                if validator is None:
+                    model_name = ''.join(part.title() for part in name.split('_')) + "Args"
+                    validator = self.validators[name] = _build_model(model_name, self.schemas[name]["parameters"])
+        return validator
+
+    def compile_validators(self):
+        """Build the pydantic validator of every registered tool up front."""
+        for name in self.schemas:
+            self._validator(name)
+
+    def validate(self, name, args):
+        """Validate and coerce a call's arguments.
+
+        Args:
+            name (str): The tool name.
+            args (dict): The arguments supplied by the model.
+
+        Returns:
+            dict: The coerced arguments, without defaults the caller did not set.
+
+        Raises:
+            KeyError: If the tool is not registered.
+            ToolArgumentError: If the arguments do not match the schema.
+        """
+        from pydantic import ValidationError
+
+        if name not in self.schemas:
+            raise KeyError(f"Unknown tool: {name}")
+
+        try:
+            return self._validator(name).model_validate(args).model_dump(exclude_unset=True)
+        except ValidationError as e:
+            problems = '; '.join(
+                f"{'.'.join(str(part) for part in error['loc']) or 'arguments'}: {error['msg']}"
+                for error in e.errors()
+            )
+            raise ToolArgumentError(f"Invalid arguments for {name}: {problems}") from None
+
+    def call(self, name, args, hidden=None):
+        """Validate the arguments and run the tool.
+
+        Args:
+            name (str): The tool name.
+            args (dict): The arguments supplied by the model.
+            hidden (dict): Values for the tool's hidden parameters, supplied
+                by the caller rather than the model and not validated.
+
+        Raises:
+            KeyError: If the tool is not registered.
+            ToolArgumentError: If the arguments do not match the schema.
+        """
+        handler = self.handler(name)
+        with span("tool", name):
+            return handler(**self.validate(name, args), **(hidden or {}))
+
+    def function_declarations(self, names=None):
+        """Return Gemini function declarations for the registered tools.
+
+        Args:
+            names (list[str]): Only include these tools; defaults to all.
+
+        Returns:
+            list[types.FunctionDeclaration]: The declarations.
+        """
+        from google.genai import types
+
+        return [
+            types.FunctionDeclaration(**schema)
+            for name, schema in self.schemas.items()
+            if names is None or name in names
+        ]
+
+
+def build_registry():
+    """Build a registry by importing every module in ``TOOL_MODULES``.
+
+    Returns:
+        ToolRegistry: The registry with every handler loaded.
+    """
+    registry = ToolRegistry()
+    for module_name in TOOL_MODULES:
+        registry.register_module(importlib.import_module(module_name))
+    return registry
+
+
+def get_registry():
+    """Return the process-wide registry.
+
+    It is loaded from the generated manifest when available, so no tool
+    module is imported until one of its tools is called; otherwise it is
+    built by importing the tool modules.
+
+    Returns:
+        ToolRegistry: The registry.
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            try:
+                _registry = ToolRegistry.from_manifest()
+            except FileNotFoundError:
+                _registry = build_registry()
+        return _registry
+
+
+def _is_flat(value):
+    scalars = (str, int, float, bool, type(None))
+    if isinstance(value, list):
+        return all(isinstance(item, scalars) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(item, scalars) or (isinstance(item, list) and _is_flat(item)) for item in value.values())
+    return True
+
+
+def _format(value, indent, python, level=0):
+    """Render like ``json.dumps(indent=...)``, but keep flat objects and lists on one line."""
+    if not isinstance(value, (dict, list)):
+        if python and (isinstance(value, bool) or value is None):
+            return {True: "True", False: "False", None: "None"}[value]
+        return json.dumps(value, ensure_ascii=False)
+
+    if isinstance(value, list):
+        items = [_format(item, indent, python, level + 1) for item in value]
+        if _is_flat(value):
+            return "[" + ", ".join(items) + "]"
+    else:
+        items = [f"{json.dumps(key)}: {_format(item, indent, python, level + 1)}" for key, item in value.items()]
+        if _is_flat(value) and level > 1:
+            return "{" + ", ".join(items) + "}"
+
+    if not items:
+        return "[]" if isinstance(value, list) else "{}"
+    pad = " " * (indent * (level + 1))
+    brackets = "[]" if isinstance(value, list) else "{}"
+    return brackets[0] + "\n" + ",\n".join(pad + item for item in items) + "\n" + " " * (indent * level) + brackets[1]
+
+
+def _render_tool_files(registry):
+    return {
+        SCHEMAS_FILE: _format(registry.schemas, 2, python=False) + '\n',
+        TXT_FILE: "TOOLS = " + _format(registry.schemas, 4, python=True) + '\n',
+        MANIFEST_FILE: _format({"modules": registry.modules}, 2, python=False) + '\n',
+    }
+
+
+def write_tool_files():
+    """Regenerate tools.json, tools.txt and the tool manifest from the handlers."""
+    files = _render_tool_files(build_registry())
+    for path, content in files.items():
+        with open(path, 'w') as f:
+            f.write(content)
+
+    print(f"Wrote tool schemas to {', '.join(os.path.basename(path) for path in files)}")
+
+
+def check_tool_files():
+    """Report whether the generated files match the handlers.
+
+    Returns:
+        bool: True if every file is up to date.
+    """
+    stale = []
+    for path, content in _render_tool_files(build_registry()).items():
+        try:
+            with open(path) as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != content:
+            stale.append(os.path.basename(path))
+
+    if stale:
+        print(f"Out of date: {', '.join(stale)}; run python tool_registry.py")
+    return not stale
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv[1:]:
+        sys.exit(0 if check_tool_files() else 1)
+    write_tool_files()
@@ -1,6 +1,373 @@
+import asyncio
+import codecs
+import os
+import signal
 import subprocess
+import threading
+import time
+import uuid
+from collections import deque
 
-def run_command(command):
-    """Run a terminal command and return its output."""
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    return result.stdout, result.stderr, result.returncode
\ No newline at end of file
+from tool_cache import clears_cache
+from tool_registry import tool, tool_schemas
+
+
+DEFAULT_MAX_OUTPUT_BYTES = 256 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+_loop = None
+_loop_lock = threading.Lock()
+_sessions = {}
+
+
+def _background_loop():
+    """Return the event loop that runs commands for the synchronous helpers.
+
+    A single long-lived loop on a daemon thread lets the sync wrappers be
+    called from any thread (including from inside another event loop) and
+    keeps the persistent shell session bound to one loop.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="run-command-loop", daemon=True).start()
+        return _loop
+
+
+def _run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+class _CappedOutput:
+    """Collect a stream's output, keeping only its head and tail past a byte cap."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.head = bytearray()
+        self.tail = deque()
+        self.tail_bytes = 0
+        self.dropped = 0
+
+    def feed(self, data):
+        if self.max_bytes is None:
+            self.head += data
+            return
+
+        head_room = self.max_bytes // 2 - len(self.head)
+        if head_room > 0:
+            self.head += data[:head_room]
+            data = data[head_room:]
+        if not data:
+            return
+
+        self.tail.append(data)
+        self.tail_bytes += len(data)
+        tail_cap = self.max_bytes - self.max_bytes // 2
+        while self.tail_bytes > tail_cap:
+            excess = self.tail_bytes - tail_cap
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                self.tail_bytes -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[excess:]
+                self.tail_bytes -= excess
+                self.dropped += excess
+
+    def text(self):
+        head = bytes(self.head).decode('utf-8', errors='replace')
+        if not self.dropped:
+            return head + b''.join(self.tail).decode('utf-8', errors='replace')
+        tail = b''.join(self.tail).decode('utf-8', errors='replace')
+        return f"{head}\n... [{self.dropped} bytes omitted] ...\n{tail}"
+
+
+async def _pump(stream, name, output, on_output):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        output.feed(chunk)
+        if on_output is not None:
+            on_output(name, decoder.decode(chunk))
+
+
+def _kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def arun_command(command, timeout=None, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, on_output=None, cwd=None, env=None):
+    """Run a shell command asynchronously, streaming its output.
+
+    stdout and stderr are read incrementally; when either exceeds
+    ``max_output_bytes`` only its head and tail are kept. On timeout the whole
+    process group is killed.
+
+    Args:
+        command (str): The shell command to run.
+        timeout (float): Wall-clock limit in seconds, or None for no limit.
+        max_output_bytes (int): Cap on the bytes kept per stream, or None to keep everything.
+        on_output (callable): Called as ``on_output(stream_name, text)`` for each chunk as it arrives.
+        cwd (str): Working directory for the command.
+        env (dict): Environment for the command; defaults to the current one.
+
+    Returns:
+        dict: ``stdout``, ``stderr``, ``returncode``, ``timed_out`` and ``duration`` (seconds).
+    """
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        start_new_session=True,
+    )
+
+    stdout, stderr = _CappedOutput(max_output_bytes), _CappedOutput(max_output_bytes)
+    readers = asyncio.gather(
+        _pump(process.stdout, "stdout", stdout, on_output),
+        _pump(process.stderr, "stderr", stderr, on_output),
+        process.wait(),
+    )
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(readers, timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill_process_group(process)
+        await process.wait()
+    except asyncio.CancelledError:
+        _kill_process_group(process)
+        raise
+
+    return {
+        "stdout": stdout.text(),
+        "stderr": stderr.text(),
+        "returncode": process.returncode,
+        "timed_out": timed_out,
+        "duration": time.monotonic() - started,
+    }
+
+
+async def arun_commands(commands, max_concurrency=4, timeout=None, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, cwd=None):
+    """Run several shell commands concurrently, at most ``max_concurrency`` at a time.
+
+    Args:
+        commands (list[str]): The shell commands to run.
+        max_concurrency (int): Maximum number of commands running at once.
+        timeout (float): Wall-clock limit per command in seconds.
+        max_output_bytes (int): Cap on the bytes kept per stream of each command.
+        cwd (str): Working directory for the commands.
+
+    Returns:
+        list[dict]: One result per command, in input order (see ``arun_command``).
+
+    Raises:
+        ValueError: If max_concurrency is less than 1.
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1.")
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(command):
+        async with semaphore:
+            return await arun_command(command, timeout, max_output_bytes, cwd=cwd)
+
+    return list(await asyncio.gather(*(run(command) for command in commands)))
+
+
+class ShellSession:
+    """A long-lived ``bash`` process that runs commands one after another.
+
+    The working directory, environment variables and shell functions carry
+    over between commands, and each command avoids process and shell startup
+    cost. Every command is followed by a unique marker on stdout and stderr
+    that carries its exit status. Commands run with stdin redirected from
+    ``/dev/null``, as in ``run_command``, so a command that reads stdin gets
+    end-of-file instead of consuming the rest of the session's input. If a
+    command times out, the session is killed and restarted, losing its
+    state.
+    """
+
+    def __init__(self, shell="/bin/bash", cwd=None, env=None):
+        self.shell = shell
+        self.cwd = cwd
+        self.env = env
+        self.process = None
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        """Start the shell if it is not running."""
+        if self.process is not None and self.process.returncode is None:
+            return
+        self.process = await asyncio.create_subprocess_exec(
+            self.shell, "--noprofile", "--norc",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+            start_new_session=True,
+            limit=READ_CHUNK_BYTES,
+        )
+
+    async def close(self):
+        """Terminate the shell."""
+        if self.process is not None and self.process.returncode is None:
+            _kill_process_group(self.process)
+            await self.process.wait()
+        self.process = None
+
+    async def _read_until_marker(self, stream, marker, output):
+        pending = None
+        while True:
+            try:
+                line = await stream.readuntil(b'\n')
+            except asyncio.LimitOverrunError as e:
+                # A line longer than the buffer cannot hold the marker; pass it through.
+                line = await stream.readexactly(e.consumed)
+            except asyncio.IncompleteReadError as e:
+                if pending is not None:
+                    output.feed(pending)
+                output.feed(e.partial)
+                raise ConnectionError("The shell session exited unexpectedly.")
+
+            if line.startswith(marker):
+                if pending is not None:
+                    # Drop the newline printed in front of the marker.
+                    output.feed(pending[:-1] if pending.endswith(b'\n') else pending)
+                return line[len(marker):].strip()
+
+            if pending is not None:
+                output.feed(pending)
+            pending = line
+
+    async def run(self, command, timeout=None, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES):
+        """Run a command in the session.
+
+        Args:
+            command (str): The shell command to run.
+            timeout (float): Wall-clock limit in seconds, or None for no limit.
+            max_output_bytes (int): Cap on the bytes kept per stream.
+
+        Returns:
+            dict: ``stdout``, ``stderr``, ``returncode``, ``timed_out`` and ``duration`` (seconds).
+        """
+        async with self.lock:
+            await self.start()
+            started = time.monotonic()
+            marker = f"__RUN_COMMAND_DONE_{uuid.uuid4().hex}__".encode()
+            # The group keeps cd and export in this shell; the newline before } ends a trailing comment.
+            script = (
+                f"{{ {command}\n}} </dev/null\n"
+                f"__rc=$?; printf '\\n%s %s\\n' '{marker.decode()}' \"$__rc\"; printf '\\n%s\\n' '{marker.decode()}' >&2\n"
+            )
+            self.process.stdin.write(script.encode())
+            await self.process.stdin.drain()
+
+            stdout, stderr = _CappedOutput(max_output_bytes), _CappedOutput(max_output_bytes)
+            timed_out = False
+            returncode = None
+            try:
+                status, _ = await asyncio.wait_for(asyncio.gather(
+                    self._read_until_marker(self.process.stdout, marker, stdout),
+                    self._read_until_marker(self.process.stderr, marker, stderr),
+                ), timeout)
+                returncode = int(status or 0)
+            except asyncio.TimeoutError:
+                timed_out = True
+                await self.close()
+            except ConnectionError:
+                returncode = self.process.returncode
+                await self.close()
+
+            return {
+                "stdout": stdout.text(),
+                "stderr": stderr.text(),
+                "returncode": returncode,
+                "timed_out": timed_out,
+                "duration": time.monotonic() - started,
+            }
+
+
+def get_shell_session(cwd=None):
+    """Return the persistent shell session used by ``run_command``.
+
+    Args:
+        cwd (str): The directory the session starts in; each directory has its own session.
+
+    Returns:
+        ShellSession: The shared session.
+    """
+    with _loop_lock:
+        session = _sessions.get(cwd)
+        if session is None:
+            session = _sessions[cwd] = ShellSession(cwd=cwd)
+        return session
+
+
+def close_shell_session(cwd=None):
+    """Stop the persistent shell session started in ``cwd``, if there is one."""
+    with _loop_lock:
+        session = _sessions.pop(cwd, None)
+    if session is not None:
+        _run_sync(session.close())
+
+
+@tool(hidden=("cwd",))
+@clears_cache
+def run_command(command, timeout=None, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, persistent=False, cwd=None):
+    """Run a terminal command and return its output.
+
+    Args:
+        command (str): The shell command to run.
+        timeout (float): Wall-clock limit in seconds; the command is killed when it expires. None for no limit.
+        max_output_bytes (int): Cap on the bytes kept per stream; longer output keeps its head and tail.
+        persistent (bool): Run in the shared long-lived shell session, so the working directory and environment carry over.
+        cwd (str): Working directory for the command; the persistent session of this directory is used.
+
+    Returns:
+        tuple[str, str, int]: stdout, stderr and the return code (None if the command timed out).
+    """
+    if persistent:
+        result = _run_sync(get_shell_session(cwd).run(command, timeout, max_output_bytes))
+    else:
+        result = _run_sync(arun_command(command, timeout, max_output_bytes, cwd=cwd))
+
+    if result["timed_out"]:
+        result["stderr"] += f"\n[command timed out after {timeout} seconds]"
+        return result["stdout"], result["stderr"], None
+    return result["stdout"], result["stderr"], result["returncode"]
+
+
+@tool(description="Run several independent shell commands concurrently and return a result for each.", hidden=("cwd",))
+@clears_cache
+def run_commands(commands, max_concurrency=4, timeout=None, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES, cwd=None):
+    """Run several terminal commands concurrently.
+
+    Args:
+        commands (list[str]): The shell commands to run.
+        max_concurrency (int): Maximum number of commands running at once.
+        timeout (float): Wall-clock limit per command in seconds.
+        max_output_bytes (int): Cap on the bytes kept per stream of each command.
+        cwd (str): Working directory for the commands.
+
+    Returns:
+        list[dict]: One result per command, in input order, with ``stdout``, ``stderr``,
+        ``returncode``, ``timed_out`` and ``duration`` keys.
+    """
+    return _run_sync(arun_commands(commands, max_concurrency, timeout, max_output_bytes, cwd=cwd))
+
+
+CLI_TOOLS = tool_schemas(__name__)
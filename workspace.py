@@ -0,0 +1,142 @@
+import copy
+import os
+
+from agent import ToolDispatcher
+from tool_registry import ToolArgumentError
+
+
+# Path-valued arguments of each tool, resolved against the workspace root.
+# "specs[].path" names the ``path`` key of every item of the ``specs`` list.
+WORKSPACE_PATH_ARGS = {
+    "create_file": ("path",),
+    "create_directory": ("path",),
+    "delete_file": ("path",),
+    "does_file_exist": ("path",),
+    "get_directory_tree": ("path",),
+    "read_file": ("path",),
+    "search_files": ("path",),
+    "write_file": ("path",),
+    "edit_file": ("path",),
+    "edit_files": ("files[].path",),
+    "append_to_file": ("path",),
+    "copy_file": ("src", "dst"),
+    "move_file": ("src", "dst"),
+    "copy_files": ("operations[].src", "operations[].dst"),
+    "move_files": ("operations[].src", "operations[].dst"),
+    "open_an_image": ("path",),
+    "move_the_image": ("path_before", "path_after"),
+    "generate_image": ("path",),
+    "modify_image": ("path_of_the_image_to_modify", "path_to_save_the_image"),
+    "generate_images_batch": ("specs[].path", "specs[].path_of_the_image_to_modify", "specs[].path_to_save_the_image"),
+    "get_changes_since": ("path",),
+    "get_image_metadata": ("path",),
+    "find_duplicate_images": ("path", "image"),
+}
+# Optional path arguments that default to the working directory; they are set to the root instead.
+WORKSPACE_DEFAULT_ARGS = {
+    "search_files": ("path",),
+    "generate_image": ("path",),
+    "modify_image": ("path_to_save_the_image",),
+    "generate_images_batch": ("specs[].path", "specs[].path_to_save_the_image"),
+    "get_changes_since": ("path",),
+    "find_duplicate_images": ("path",),
+}
+# File name arguments joined to a directory by the tool; they must not contain a path.
+WORKSPACE_NAME_ARGS = {
+    "generate_image": ("name_of_image",),
+    "modify_image": ("name_of_image",),
+    "generate_images_batch": ("specs[].name_of_image",),
+}
+# Tools that take the workspace root as a hidden argument.
+WORKSPACE_ROOT_ARGS = {
+    "run_command": "cwd",
+    "run_commands": "cwd",
+    "apply_patch": "root",
+}
+
+
+def resolve_path(root, path):
+    """Resolve a path against a workspace root, refusing paths outside it.
+
+    Symlinks are followed for the check, so a link inside the workspace
+    cannot be used to reach files outside it.
+
+    Args:
+        root (str): The workspace root.
+        path (str): An absolute path, or a path relative to ``root``.
+
+    Returns:
+        str: The absolute, normalized path.
+
+    Raises:
+        ValueError: If the path lies outside the workspace.
+    """
+    resolved = os.path.normpath(os.path.join(root, path))
+    real_root = os.path.realpath(root)
+    real_path = os.path.realpath(resolved)
+    if real_path != real_root and not real_path.startswith(real_root + os.sep):
+        raise ValueError(f"{path} is outside the workspace.")
+    return resolved
+
+
+def _fields(args, spec):
+    """Yield the (dict, key) pairs a WORKSPACE_PATH_ARGS entry refers to."""
+    if "[]." in spec:
+        list_name, _, key = spec.partition("[].")
+        for item in args.get(list_name) or []:
+            if isinstance(item, dict):
+                yield from _fields(item, key)
+    else:
+        yield args, spec
+
+
+def check_file_name(name):
+    """Refuse file names that would place a file in another directory.
+
+    Raises:
+        ValueError: If ``name`` contains a path separator or is ``..``.
+    """
+    if os.sep in name or (os.altsep and os.altsep in name) or name in (".", ".."):
+        raise ValueError(f"{name} is not a plain file name.")
+
+
+class WorkspaceDispatcher(ToolDispatcher):
+    """A ``ToolDispatcher`` that confines every tool call to one directory.
+
+    Relative paths in tool arguments are resolved against ``root`` rather
+    than the process's working directory, paths outside it are rejected,
+    and shell commands and patches run in it, so sessions sharing a process
+    each get their own workspace.
+
+    Args:
+        root (str): The workspace directory; created if missing.
+        **kwargs: Passed to ``ToolDispatcher`` (e.g. a shared ``pool``).
+    """
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def prepare(self, name, args):
+        args = copy.deepcopy(args)
+        defaults = WORKSPACE_DEFAULT_ARGS.get(name, ())
+        try:
+            for spec in WORKSPACE_PATH_ARGS.get(name, ()):
+                for fields, key in _fields(args, spec):
+                    value = fields.get(key)
+                    if isinstance(value, str) and value:
+                        fields[key] = resolve_path(self.root, value)
+                    elif not value and spec in defaults:
+                        fields[key] = self.root
+            for spec in WORKSPACE_NAME_ARGS.get(name, ()):
+                for fields, key in _fields(args, spec):
+                    if isinstance(fields.get(key), str):
+                        check_file_name(fields[key])
+        except ValueError as e:
+            raise ToolArgumentError(f"Invalid arguments for {name}: {e}") from None
+
+        hidden = {}
+        if name in WORKSPACE_ROOT_ARGS:
+            hidden[WORKSPACE_ROOT_ARGS[name]] = self.root
+        return args, hidden